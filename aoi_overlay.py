@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+EnMAP AOI Overlay
+Server-side map layers for bounds sets too large to draw in the browser. An
+uploaded set is sorted once along a Morton (Z-order) curve of AOI centres, so
+every quadtree cell at every zoom is a contiguous run of rows. A viewport
+request then returns either the AOI rectangles in view or, when there are too
+many, one cluster rectangle per quadtree cell, as GeoJSON. Rendering cost in
+the page follows the viewport, not the size of the set.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+
+# Configuration
+MORTON_BITS = 16                 # Quadtree depth of the base grid (~0.005 deg cells)
+CELL_ZOOM_OFFSET = 2             # Cluster cells are 1/4 of a 256 px tile (~64 px) at each zoom
+MAX_FEATURES = 2000              # AOIs in view above this are clustered
+DEFAULT_MAX_OVERLAYS = 16
+DEFAULT_TTL = 3600               # Seconds since last access before an overlay expires
+
+
+class OverlayExpired(KeyError):
+    """The overlay id is unknown or was evicted"""
+
+
+def _spread_bits(values):
+    """Interleave zeros between the low 16 bits of each value (Morton encoding)"""
+    v = values.astype(np.uint64) & np.uint64(0xFFFF)
+    for shift, mask in ((8, 0x00FF00FF), (4, 0x0F0F0F0F), (2, 0x33333333), (1, 0x55555555)):
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+
+def morton_codes(lon, lat, bits=MORTON_BITS):
+    """Z-order code of each (lon, lat) on a 2^bits x 2^bits grid over the globe"""
+    scale = (1 << bits) - 1
+    x = np.clip((lon + 180.0) / 360.0 * scale, 0, scale).astype(np.uint64)
+    y = np.clip((lat + 90.0) / 180.0 * scale, 0, scale).astype(np.uint64)
+    return _spread_bits(x) | (_spread_bits(y) << np.uint64(1))
+
+
+def _intersects(boxes, view):
+    """Mask of `boxes` (n, 4; west > east crosses the antimeridian) touching the `view` bbox"""
+    west, south, east, north = boxes.T
+    crosses = west > east
+    lon_hit = np.where(crosses,
+                       (west <= view[2]) | (east >= view[0]),
+                       (west <= view[2]) & (east >= view[0]))
+    return lon_hit & (south <= view[3]) & (north >= view[1])
+
+
+def _in_view(boxes, view):
+    """_intersects for a view that may itself cross the antimeridian"""
+    if view[0] <= view[2]:
+        return _intersects(boxes, view)
+    west, south, east, north = view
+    return _intersects(boxes, [west, south, 180.0, north]) | _intersects(boxes, [-180.0, south, east, north])
+
+
+def _rectangle(bbox):
+    """GeoJSON Polygon ring for a bbox; antimeridian boxes run past 180 so Leaflet draws them whole"""
+    west, south, east, north = bbox
+    if west > east:
+        east += 360.0
+    return {'type': 'Polygon', 'coordinates': [[[west, south], [east, south], [east, north], [west, north],
+                                                [west, south]]]}
+
+
+class AOIOverlay:
+    """
+    One uploaded bounds set, Morton-sorted, with per-level cluster arrays
+    built on first use and kept for later viewport requests.
+    """
+
+    def __init__(self, ids, bboxes):
+        bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        west, south, east, north = bboxes.T
+        span = np.where(west > east, east + 360.0 - west, east - west)
+        lon = west + span / 2
+        lon = np.where(lon > 180.0, lon - 360.0, lon)
+        codes = morton_codes(lon, (south + north) / 2)
+        order = np.argsort(codes, kind='stable')
+
+        self.id = uuid.uuid4().hex
+        self.ids = [ids[i] for i in order.tolist()]
+        self.bboxes = bboxes[order]
+        self.codes = codes[order]
+        self.last_access = time.time()
+        self._levels = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def bounds(self):
+        """Overall [west, south, east, north] of the set (crossing boxes counted as reaching +/-180)"""
+        if not len(self.ids):
+            return None
+        west, south, east, north = self.bboxes.T
+        crosses = west > east
+        return [float(np.where(crosses, -180.0, west).min()), float(south.min()),
+                float(np.where(crosses, 180.0, east).max()), float(north.max())]
+
+    def clusters(self, level):
+        """(counts, envelopes, first row) of the non-empty quadtree cells at `level`"""
+        level = min(max(level, 0), MORTON_BITS)
+        with self._lock:
+            cached = self._levels.get(level)
+        if cached is not None:
+            return cached
+
+        cells = self.codes >> np.uint64(2 * (MORTON_BITS - level))
+        starts = np.flatnonzero(np.r_[True, cells[1:] != cells[:-1]])
+        counts = np.diff(np.r_[starts, len(cells)])
+        # Envelopes in a 0..360 frame for crossing boxes, folded back afterwards
+        west, south, east, north = self.bboxes.T
+        east = np.where(west > east, east + 360.0, east)
+        envelopes = np.column_stack([
+            np.minimum.reduceat(west, starts), np.minimum.reduceat(south, starts),
+            np.maximum.reduceat(east, starts), np.maximum.reduceat(north, starts),
+        ])
+        wraps = envelopes[:, 2] > 180.0
+        envelopes[wraps, 2] -= 360.0
+        result = (counts, envelopes, starts)
+        with self._lock:
+            self._levels[level] = result
+        return result
+
+    def features(self, view, zoom, max_features=MAX_FEATURES):
+        """
+        GeoJSON FeatureCollection for a viewport bbox at a Leaflet zoom level:
+        the AOIs themselves when at most `max_features` are in view, otherwise
+        one rectangle per quadtree cell (~64 px at this zoom) with a "count".
+        """
+        self.last_access = time.time()
+        view = _clip_view(view)
+        hits = np.flatnonzero(_in_view(self.bboxes, view))
+        if len(hits) <= max_features:
+            features = [{
+                'type': 'Feature',
+                'geometry': _rectangle(bbox),
+                'properties': {'granule_id': self.ids[i], 'bbox': bbox},
+            } for i, bbox in zip(hits.tolist(), self.bboxes[hits].tolist())]
+            return {'type': 'FeatureCollection', 'mode': 'aois', 'in_view': len(hits), 'features': features}
+
+        counts, envelopes, starts = self.clusters(int(zoom) + CELL_ZOOM_OFFSET)
+        visible = np.flatnonzero(_in_view(envelopes, view))
+        features = []
+        for i, count, bbox in zip(visible.tolist(), counts[visible].tolist(), envelopes[visible].tolist()):
+            properties = {'count': count, 'bbox': bbox}
+            if count == 1:
+                properties['granule_id'] = self.ids[int(starts[i])]
+            features.append({'type': 'Feature', 'geometry': _rectangle(bbox), 'properties': properties})
+        return {'type': 'FeatureCollection', 'mode': 'clusters', 'in_view': len(hits), 'features': features}
+
+
+def _clip_view(view):
+    """
+    Viewport bbox limited to the globe, with longitudes wrapped into
+    [-180, 180) (west > east when it spans the antimeridian); a view 360 deg
+    or wider covers every longitude.
+    """
+    west, south, east, north = (float(v) for v in view)
+    if east - west >= 360.0:
+        west, east = -180.0, 180.0
+    else:
+        west = (west + 180.0) % 360.0 - 180.0
+        east = (east + 180.0) % 360.0 - 180.0
+    return [west, max(south, -90.0), east, min(north, 90.0)]
+
+
+class OverlayStore:
+    """LRU/TTL-bounded set of uploaded overlays"""
+
+    def __init__(self, max_overlays=DEFAULT_MAX_OVERLAYS, ttl=DEFAULT_TTL):
+        self.max_overlays = max_overlays
+        self.ttl = ttl
+        self._overlays = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def create(self, ids, bboxes):
+        """Index a bounds set and return its overlay"""
+        overlay = AOIOverlay(ids, bboxes)
+        with self._lock:
+            self._expire_locked()
+            self._overlays[overlay.id] = overlay
+            while len(self._overlays) > self.max_overlays:
+                self._overlays.popitem(last=False)
+                self.evicted += 1
+        return overlay
+
+    def get(self, overlay_id):
+        with self._lock:
+            self._expire_locked()
+            overlay = self._overlays.get(overlay_id)
+            if overlay is None:
+                raise OverlayExpired(overlay_id)
+            self._overlays.move_to_end(overlay_id)
+            return overlay
+
+    def delete(self, overlay_id):
+        with self._lock:
+            return self._overlays.pop(overlay_id, None) is not None
+
+    def stats(self):
+        with self._lock:
+            return {'overlays': len(self._overlays), 'aois': sum(len(o) for o in self._overlays.values()),
+                    'evicted': self.evicted}
+
+    def _expire_locked(self):
+        now = time.time()
+        for overlay_id in [k for k, o in self._overlays.items() if now - o.last_access > self.ttl]:
+            del self._overlays[overlay_id]
+            self.evicted += 1
@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""
+EnMAP Benchmark Suite
+Reproducible performance runs against a local fake STAC API (fake_stac.py),
+so no request reaches geoservice.dlr.de. Results are written as JSON and can
+be compared across commits.
+
+    python benchmark.py --output bench/$(git rev-parse --short HEAD).json
+    python benchmark.py --scenarios single_aoi,preview_fanout --compare bench/old.json
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+
+ROOT = Path(__file__).parent
+EXAMPLE_CSV = ROOT / 'example_bounds.csv'
+SCENARIOS = ('cold_start', 'single_aoi', 'csv_batch', 'preview_fanout', 'cli_batch', 'upstream_faults')
+DATETIME_RANGE = '2022-01-01/2026-01-01'
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered) + 0.5)) - 1))]
+
+
+def latency_summary(seconds):
+    return {
+        'count': len(seconds),
+        'mean_ms': round(statistics.mean(seconds) * 1000, 2),
+        'p50_ms': round(percentile(seconds, 0.5) * 1000, 2),
+        'p95_ms': round(percentile(seconds, 0.95) * 1000, 2),
+        'max_ms': round(max(seconds) * 1000, 2),
+    }
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_fake_stac(args, extra=()):
+    """Run fake_stac.py in its own process so it does not share our GIL"""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, str(ROOT / 'fake_stac.py'), '--port', str(port), '--items', str(args.items),
+         '--seed', str(args.seed), '--latency', str(args.latency), '--jitter', str(args.jitter),
+         '--asset-latency', str(args.asset_latency), *extra],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{port}/"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                response.read()
+            return process, url
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("fake_stac.py did not start")
+
+
+def load_example_rows():
+    with open(EXAMPLE_CSV, 'r') as f:
+        return list(csv.DictReader(f))
+
+
+def scaled_csv(rows, count, seed):
+    """The example CSV repeated to `count` rows with small random shifts"""
+    rng = random.Random(seed)
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=['granule_id', 'north_lat', 'south_lat', 'west_lon', 'east_lon'])
+    writer.writeheader()
+    for i in range(count):
+        row = rows[i % len(rows)]
+        dlat, dlon = rng.uniform(-0.2, 0.2), rng.uniform(-0.2, 0.2)
+        writer.writerow({
+            'granule_id': f"{row['granule_id']}_{i}",
+            'north_lat': float(row['north_lat']) + dlat,
+            'south_lat': float(row['south_lat']) + dlat,
+            'west_lon': float(row['west_lon']) + dlon,
+            'east_lon': float(row['east_lon']) + dlon,
+        })
+    return out.getvalue()
+
+
+def row_bbox(row):
+    return [float(row['west_lon']), float(row['south_lat']), float(row['east_lon']), float(row['north_lat'])]
+
+
+def bench_single_aoi(server, args, rows):
+    """Repeated single-AOI queries: cold (cache off), coalesced duplicates and warm cache hits"""
+    client = server.app.test_client()
+    rng = random.Random(args.seed)
+    valid = [row for row in rows if float(row['north_lat']) > float(row['south_lat'])]
+
+    def query(bbox, cache):
+        start = time.perf_counter()
+        response = client.post('/api/query-enmap', json={
+            'bounds': bbox, 'datetime': DATETIME_RANGE, 'max_items': args.max_items, 'cache': cache})
+        elapsed = time.perf_counter() - start
+        data = response.get_json()
+        return elapsed, data.get('count', 0), response.status_code
+
+    cold = [query(row_bbox(rng.choice(valid)), False) for _ in range(args.repeat)]
+    bbox = row_bbox(valid[0])
+    query(bbox, True)
+    warm = [query(bbox, True) for _ in range(args.repeat)]
+
+    # The same AOI opened by many users at once
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        start = time.perf_counter()
+        duplicates = list(executor.map(lambda _: query(bbox, False), range(args.concurrency)))
+        duplicate_wall = time.perf_counter() - start
+
+    return {
+        'cold': {**latency_summary([t for t, _, _ in cold]),
+                 'items_mean': round(statistics.mean(n for _, n, _ in cold), 1),
+                 'errors': sum(1 for _, _, status in cold if status != 200)},
+        'warm_cache': latency_summary([t for t, _, _ in warm]),
+        'concurrent_duplicates': {
+            'requests': len(duplicates),
+            'wall_ms': round(duplicate_wall * 1000, 2),
+            'errors': sum(1 for _, _, status in duplicates if status != 200),
+        },
+    }
+
+
+def bench_csv_batch(server, args, rows):
+    """The example CSV scaled to --rows AOIs through /api/query-enmap/batch, buffered and streamed"""
+    client = server.app.test_client()
+    text = scaled_csv(rows, args.rows, args.seed)
+    body = {'csv': text, 'datetime': DATETIME_RANGE, 'max_items': args.max_items, 'cache': False}
+
+    start = time.perf_counter()
+    response = client.post('/api/query-enmap/batch', json=body)
+    buffered = time.perf_counter() - start
+    data = response.get_json()
+    failed = sum(1 for aoi in data.get('aois', []) if aoi.get('error'))
+
+    start = time.perf_counter()
+    response = client.post('/api/query-enmap/batch', json={**body, 'stream': 'ndjson'}, buffered=False)
+    first_item = None
+    messages = 0
+    for chunk in response.response:
+        for line in chunk.splitlines():
+            if not line.strip():
+                continue
+            messages += 1
+            if first_item is None and json.loads(line).get('type') == 'item':
+                first_item = time.perf_counter() - start
+    streamed = time.perf_counter() - start
+    response.close()
+
+    return {
+        'rows': args.rows,
+        'unique_scenes': data.get('count'),
+        'failed_aois': failed,
+        'buffered_s': round(buffered, 3),
+        'aois_per_s': round(args.rows / buffered, 1),
+        'streamed_s': round(streamed, 3),
+        'stream_first_item_ms': round(first_item * 1000, 2) if first_item is not None else None,
+        'stream_messages': messages,
+    }
+
+
+def bench_preview_fanout(server, args, rows):
+    """Concurrent /api/preview requests: cold distinct URLs, warm repeats, and one URL requested by everyone"""
+    client = server.app.test_client()
+    bbox = row_bbox(rows[0])
+    results = client.post('/api/query-enmap', json={
+        'bounds': bbox, 'datetime': DATETIME_RANGE, 'max_items': args.previews, 'cache': False}).get_json()
+    urls = [item['preview_url'] for item in results.get('items', [])][:args.previews]
+    if not urls:
+        return {'error': 'no scenes found for preview fan-out'}
+
+    def fetch(url):
+        start = time.perf_counter()
+        response = client.get('/api/preview', query_string={'url': url})
+        response.get_data()
+        return time.perf_counter() - start, response.status_code, response.headers.get('X-Preview-Cache')
+
+    def fan_out(targets):
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            start = time.perf_counter()
+            timings = list(executor.map(fetch, targets))
+            return time.perf_counter() - start, timings
+
+    cold_wall, cold = fan_out(urls)
+    warm_wall, warm = fan_out(urls)
+    misses_before = server.preview_cache.stats()['misses']
+    shared_url = urls[0] + '?fanout'
+    same_wall, same = fan_out([shared_url] * args.concurrency)
+    same_upstream = server.preview_cache.stats()['misses'] - misses_before
+
+    def summary(wall, timings):
+        return {
+            **latency_summary([t for t, _, _ in timings]),
+            'wall_ms': round(wall * 1000, 2),
+            'requests_per_s': round(len(timings) / wall, 1),
+            'errors': sum(1 for _, status, _ in timings if status not in (200, 304)),
+        }
+
+    return {
+        'urls': len(urls),
+        'cold': summary(cold_wall, cold),
+        'warm': summary(warm_wall, warm),
+        'same_url': {**summary(same_wall, same), 'upstream_fetches': same_upstream},
+    }
+
+
+def bench_cli_batch(stac_url, args, rows):
+    """enmap_query.py --csv-file over the scaled CSV, serial and concurrent, as subprocesses"""
+    count = min(args.rows, args.cli_rows)
+    with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+        f.write(scaled_csv(rows, count, args.seed))
+        csv_path = f.name
+    runs = {}
+    try:
+        for label, concurrency in (('serial', 1), ('concurrent', args.concurrency)):
+            command = [sys.executable, str(ROOT / 'enmap_query.py'), '--stac-url', stac_url,
+                       '--csv-file', csv_path, '--datetime', DATETIME_RANGE, '--max-items', str(args.max_items),
+                       '--concurrency', str(concurrency), '--rate', '1000']
+            start = time.perf_counter()
+            completed = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=ROOT)
+            elapsed = time.perf_counter() - start
+            runs[label] = {
+                'concurrency': concurrency,
+                'wall_s': round(elapsed, 3),
+                'aois_per_s': round(count / elapsed, 1),
+                'exit_code': completed.returncode,
+            }
+    finally:
+        os.unlink(csv_path)
+    return {'rows': count, **runs}
+
+
+def bench_upstream_faults(args, rows):
+    """
+    Single-AOI STAC searches against a fake catalog with a slow tail and failing
+    searches, without and with hedged requests (retries and breakers stay on)
+    """
+    from enmap_core import EnMAPQuery
+    from stac_session import CatalogManager
+
+    process, stac_url = start_fake_stac(args, ['--tail-rate', str(args.tail_rate), '--tail-latency', '1000',
+                                               '--search-error-rate', str(args.search_error_rate)])
+    rng = random.Random(args.seed)
+    valid = [row for row in rows if float(row['north_lat']) > float(row['south_lat'])]
+    bboxes = [row_bbox(rng.choice(valid)) for _ in range(args.repeat * 5)]
+    results = {'tail_rate': args.tail_rate, 'search_error_rate': args.search_error_rate}
+    try:
+        for label, hedge in (('no_hedge', False), ('hedged', True)):
+            manager = CatalogManager(stac_url)
+            manager.upstream.hedge = hedge
+            query = EnMAPQuery(stac_url, manager=manager)
+            timings, errors = [], 0
+            for bbox in bboxes:
+                start = time.perf_counter()
+                try:
+                    query.search_items(bbox, DATETIME_RANGE, args.max_items)
+                except Exception:
+                    errors += 1
+                timings.append(time.perf_counter() - start)
+            counts = manager.upstream.stats()['operations'].get('stac_search', {})
+            results[label] = {**latency_summary(timings), 'p99_ms': round(percentile(timings, 0.99) * 1000, 2),
+                              'errors': errors, 'retries': counts.get('retries', 0),
+                              'hedged': counts.get('hedged', 0), 'hedge_wins': counts.get('hedge_wins', 0)}
+            manager.close()
+    finally:
+        process.terminate()
+        process.wait()
+    return results
+
+
+def bench_cold_start(stac_url, args, rows):
+    """Fresh-process start-up: CLI --help, one CLI --bbox query, server import and server boot to first response"""
+    python = sys.executable
+    bbox = [str(v) for v in row_bbox(rows[0])]
+    commands = {
+        'cli_help': [python, 'enmap_query.py', '--help'],
+        'cli_single_bbox': [python, 'enmap_query.py', '--stac-url', stac_url, '--bbox', *bbox,
+                            '--datetime', DATETIME_RANGE, '--max-items', '10'],
+        'server_import': [python, '-c', 'import server'],
+    }
+    env = {**os.environ, 'ENMAP_STAC_URL': stac_url}
+    results = {}
+    for name, command in commands.items():
+        timings = []
+        for _ in range(args.cold_runs):
+            start = time.perf_counter()
+            subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=ROOT, env=env)
+            timings.append(time.perf_counter() - start)
+        results[name] = latency_summary(timings)
+
+    timings = []
+    for _ in range(args.cold_runs):
+        port = free_port()
+        start = time.perf_counter()
+        process = subprocess.Popen([python, 'server.py', '--serve', '--workers', '1', '--port', str(port)],
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=ROOT, env=env)
+        try:
+            deadline = time.monotonic() + 30
+            while time.monotonic() < deadline:
+                try:
+                    with urllib.request.urlopen(f"http://localhost:{port}/api/status", timeout=1) as response:
+                        response.read()
+                    timings.append(time.perf_counter() - start)
+                    break
+                except OSError:
+                    time.sleep(0.02)
+        finally:
+            process.terminate()
+            process.wait()
+    if timings:
+        results['server_boot'] = latency_summary(timings)
+    return results
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit or None, dirty
+    except OSError:
+        return None, None
+
+
+def flatten(data, prefix=''):
+    """{'a': {'b': 1}} -> {'a.b': 1} for numeric leaves"""
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def print_comparison(current, previous):
+    """Print metrics that exist in both runs with their relative change"""
+    now, before = flatten(current['scenarios']), flatten(previous['scenarios'])
+    print(f"\n📊 {previous.get('commit')} → {current.get('commit')}")
+    for name in sorted(set(now) & set(before)):
+        old, new = before[name], now[name]
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+        print(f"   {name:<48} {old:>12} → {new:<12} {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark server.py and enmap_query.py against a local fake STAC API",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=f"Scenarios: {', '.join(SCENARIOS)}"
+    )
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='Comma-separated scenarios to run (default: all)')
+    parser.add_argument('--items', type=int, default=5000, help='Synthetic scenes in the fake catalog (default: 5000)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--latency', type=float, default=50, help='Fake STAC latency in ms (default: 50)')
+    parser.add_argument('--jitter', type=float, default=20, help='Fake latency jitter in ms (default: 20)')
+    parser.add_argument('--asset-latency', type=float, default=30, help='Fake quicklook latency in ms (default: 30)')
+    parser.add_argument('--max-items', type=int, default=50, help='max_items per query (default: 50)')
+    parser.add_argument('--repeat', type=int, default=20, help='Single-AOI queries per measurement (default: 20)')
+    parser.add_argument('--rows', type=int, default=2000, help='AOIs in the scaled CSV (default: 2000)')
+    parser.add_argument('--cli-rows', type=int, default=200, help='AOIs for the CLI runs (default: 200)')
+    parser.add_argument('--cold-runs', type=int, default=5, help='Fresh processes per cold-start measurement (default: 5)')
+    parser.add_argument('--previews', type=int, default=50, help='Distinct previews to fan out (default: 50)')
+    parser.add_argument('--concurrency', type=int, default=16, help='Client concurrency (default: 16)')
+    parser.add_argument('--tail-rate', type=float, default=0.02,
+                        help='Share of fake upstream responses delayed by 1 s in upstream_faults (default: 0.02)')
+    parser.add_argument('--search-error-rate', type=float, default=0.05,
+                        help='Share of fake STAC searches failing in upstream_faults (default: 0.05)')
+    parser.add_argument('--output', type=str, help='Write results JSON here (default: stdout)')
+    parser.add_argument('--compare', type=str, help='Earlier results JSON to compare against')
+    args = parser.parse_args()
+
+    selected = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(selected) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    process, stac_url = start_fake_stac(args)
+    cache_dir = tempfile.mkdtemp(prefix='enmap_bench_')
+    try:
+        # server.py reads its upstream and cache locations at import time
+        os.environ['ENMAP_STAC_URL'] = stac_url
+        os.environ['ENMAP_PREVIEW_CACHE_DIR'] = cache_dir
+        os.environ.pop('ENMAP_QUERY_CACHE_DIR', None)
+        os.environ.pop('ENMAP_FOOTPRINT_INDEX', None)
+        import server
+        from metrics import STAGE_SECONDS
+
+        rows = load_example_rows()
+        runners = {
+            'single_aoi': lambda: bench_single_aoi(server, args, rows),
+            'csv_batch': lambda: bench_csv_batch(server, args, rows),
+            'preview_fanout': lambda: bench_preview_fanout(server, args, rows),
+            'cli_batch': lambda: bench_cli_batch(stac_url, args, rows),
+            'cold_start': lambda: bench_cold_start(stac_url, args, rows),
+            'upstream_faults': lambda: bench_upstream_faults(args, rows),
+        }
+        scenarios = {}
+        for name in selected:
+            print(f"⏳ {name}...", file=sys.stderr, flush=True)
+            start = time.perf_counter()
+            scenarios[name] = runners[name]()
+            print(f"   done in {time.perf_counter() - start:.1f}s", file=sys.stderr, flush=True)
+        stages = {stage: {'count': count, 'total_s': round(total, 4)}
+                  for (stage,), (_, total, count) in STAGE_SECONDS.snapshot().items()}
+    finally:
+        process.terminate()
+        process.wait()
+
+    commit, dirty = git_revision()
+    results = {
+        'commit': commit,
+        'dirty': dirty,
+        'created': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'scenarios': scenarios,
+        'stages': stages,
+    }
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(text + '\n')
+        print(f"✅ Results written to {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            print_comparison(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+EnMAP Bounds Reader
+Streaming reader for bounds viewer CSVs (granule_id, north_lat, south_lat,
+west_lon, east_lon) and equivalent row dicts. Rows are parsed in chunks into
+numpy arrays and validated in bulk; bad rows are reported and skipped, so one
+typo does not sink a file with millions of AOIs.
+"""
+
+import csv
+from collections import namedtuple
+
+import numpy as np
+
+
+# Configuration
+CHUNK_ROWS = 50000               # Rows parsed and validated per chunk
+MAX_SPAN_DEG = 10.0              # Larger AOIs are rejected (EnMAP scenes are ~0.27 deg across)
+MAX_ERRORS = 1000                # Row errors kept for reporting; the rest are only counted
+BOUNDS_COLUMNS = ('west_lon', 'south_lat', 'east_lon', 'north_lat')   # bbox order
+
+BoundsChunk = namedtuple('BoundsChunk', ['ids', 'rows', 'bboxes', 'antimeridian'])
+BoundsChunk.__doc__ = "Valid AOIs of one chunk: ids, 1-based row numbers, (n, 4) bboxes, crossing flags"
+
+
+def _to_float(values):
+    """Float array for a column; unparseable or missing values become NaN"""
+    try:
+        return np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        out = np.empty(len(values), dtype=np.float64)
+        for i, value in enumerate(values):
+            try:
+                out[i] = float(value)
+            except (TypeError, ValueError):
+                out[i] = np.nan
+        return out
+
+
+class BoundsReader:
+    """
+    Parse and validate AOI bounds chunk by chunk.
+
+    Checks, in order (a row gets the first that fails):
+    - every coordinate is a finite number
+    - latitudes within [-90, 90], longitudes within [-180, 180]
+    - south_lat <= north_lat
+    - west_lon <= east_lon, unless the box crosses the antimeridian
+      (kept as a STAC bbox with west > east)
+    - neither span exceeds `max_span` degrees
+
+    Memory stays bounded by `chunk_rows`. `errors` keeps the first
+    `max_errors` row errors, and `rows`/`valid`/`invalid` count every row.
+    """
+
+    def __init__(self, chunk_rows=CHUNK_ROWS, max_span=MAX_SPAN_DEG, max_errors=MAX_ERRORS):
+        self.chunk_rows = chunk_rows
+        self.max_span = max_span
+        self.max_errors = max_errors
+        self.errors = []
+        self.rows = 0
+        self.valid = 0
+        self.invalid = 0
+
+    def csv_chunks(self, lines):
+        """BoundsChunks from CSV text lines (a file object or io.StringIO)"""
+        reader = csv.reader(lines)
+        header = next(reader, None)
+        if header is None:
+            return
+        columns = {name.strip(): i for i, name in enumerate(header)}
+        missing = [name for name in BOUNDS_COLUMNS if name not in columns]
+        if missing:
+            raise ValueError(f"CSV is missing column(s): {', '.join(missing)}")
+        id_col = columns.get('granule_id')
+        indices = [columns[name] for name in BOUNDS_COLUMNS]
+        width = len(header)
+
+        rows = []
+        for row in reader:
+            if len(row) != width:
+                if not any(cell.strip() for cell in row):
+                    continue
+                row = (row + [''] * width)[:width]
+            rows.append(row)
+            if len(rows) >= self.chunk_rows:
+                yield self._csv_chunk(rows, id_col, indices)
+                rows = []
+        if rows:
+            yield self._csv_chunk(rows, id_col, indices)
+
+    def record_chunks(self, records):
+        """BoundsChunks from row dicts with the CSV column names"""
+        batch = []
+        for record in records:
+            batch.append(record if isinstance(record, dict) else {})
+            if len(batch) >= self.chunk_rows:
+                yield self._record_chunk(batch)
+                batch = []
+        if batch:
+            yield self._record_chunk(batch)
+
+    def aois(self, chunks):
+        """Yield {"granule_id", "bbox"} dicts (plus "antimeridian": True when crossing) from chunks"""
+        for chunk in chunks:
+            for granule_id, bbox, crosses in zip(chunk.ids, chunk.bboxes.tolist(), chunk.antimeridian.tolist()):
+                aoi = {'granule_id': granule_id, 'bbox': bbox}
+                if crosses:
+                    aoi['antimeridian'] = True
+                yield aoi
+
+    def summary(self):
+        return {'rows': self.rows, 'valid': self.valid, 'invalid': self.invalid,
+                'errors_truncated': self.invalid > len(self.errors)}
+
+    def _csv_chunk(self, rows, id_col, indices):
+        columns = list(zip(*rows))
+        ids = [cell.strip() for cell in columns[id_col]] if id_col is not None else [''] * len(rows)
+        return self._chunk(ids, [columns[i] for i in indices])
+
+    def _record_chunk(self, records):
+        ids = [str(record.get('granule_id') or '').strip() for record in records]
+        return self._chunk(ids, [[record.get(name) for record in records] for name in BOUNDS_COLUMNS])
+
+    def _chunk(self, ids, values):
+        """Validate one chunk; `values` holds the raw west, south, east, north columns"""
+        first_row = self.rows + 1
+        self.rows += len(ids)
+        rows = np.arange(first_row, first_row + len(ids), dtype=np.int64)
+        columns = [_to_float(column) for column in values]
+        bboxes = np.column_stack(columns)
+        west, south, east, north = columns
+
+        lon_span = east - west
+        crosses = lon_span < 0
+        lon_span = np.where(crosses, lon_span + 360.0, lon_span)
+        lat_span = north - south
+
+        # (mask, message builder) in priority order; a row reports its first failure
+        checks = [
+            (~np.isfinite(bboxes).all(axis=1),
+             lambda b: "non-numeric or missing " + ', '.join(
+                 name for name, v in zip(BOUNDS_COLUMNS, b) if not np.isfinite(v))),
+            ((np.abs(south) > 90) | (np.abs(north) > 90),
+             lambda b: f"latitude out of range [-90, 90]: south_lat={b[1]}, north_lat={b[3]}"),
+            ((np.abs(west) > 180) | (np.abs(east) > 180),
+             lambda b: f"longitude out of range [-180, 180]: west_lon={b[0]}, east_lon={b[2]}"),
+            (south > north,
+             lambda b: f"south_lat {b[1]} is north of north_lat {b[3]}"),
+            (lat_span > self.max_span,
+             lambda b: f"AOI spans {b[3] - b[1]:.2f}° of latitude (max {self.max_span:g}°)"),
+            (crosses & (lon_span > self.max_span),
+             lambda b: f"west_lon {b[0]} is east of east_lon {b[2]}"),
+            (lon_span > self.max_span,
+             lambda b: f"AOI spans {b[2] - b[0]:.2f}° of longitude (max {self.max_span:g}°)"),
+        ]
+        failed = np.full(len(ids), -1)
+        with np.errstate(invalid='ignore'):
+            for n, (mask, _) in enumerate(checks):
+                failed[(failed < 0) & mask] = n
+        bad = failed >= 0
+
+        room = max(0, self.max_errors - len(self.errors))
+        for i in np.flatnonzero(bad)[:room].tolist():
+            error = {'row': int(rows[i]), 'error': f"Invalid bounds: {checks[failed[i]][1](bboxes[i])}"}
+            if ids[i]:
+                error['granule_id'] = ids[i]
+            self.errors.append(error)
+
+        good = np.flatnonzero(~bad)
+        self.valid += len(good)
+        self.invalid += int(bad.sum())
+        good_rows = rows[good]
+        return BoundsChunk(
+            ids=[ids[i] or f'aoi_{row}' for i, row in zip(good.tolist(), good_rows.tolist())],
+            rows=good_rows,
+            bboxes=bboxes[good],
+            antimeridian=crosses[good],
+        )
+
+
+def read_bounds_csv(path, **kwargs):
+    """All valid AOIs of a CSV file as a list, plus the reader (for errors and counts)"""
+    reader = BoundsReader(**kwargs)
+    with open(path, newline='') as f:
+        aois = list(reader.aois(reader.csv_chunks(f)))
+    return aois, reader
+
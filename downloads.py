@@ -0,0 +1,520 @@
+#!/usr/bin/env python3
+"""
+EnMAP Bulk Downloads
+Server-side download jobs for selected scenes: bounded parallelism, chunked
+streaming to disk, HTTP Range resume from `.part` files, retries with
+exponential backoff and optional SHA-256 verification. Jobs can be polled,
+followed through progress events, or cancelled. Each file's source URL and
+validator (ETag or Last-Modified) are kept in `.meta/`, so a resume only
+splices bytes of the same remote file.
+"""
+
+import hashlib
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+
+from metrics import timed, count_error
+
+
+# Configuration
+DEFAULT_DOWNLOAD_DIR = Path(tempfile.gettempdir()) / 'enmap_downloads'
+DEFAULT_WORKERS = 4              # Files downloaded at once across all jobs
+MAX_JOBS = 64                    # Finished job records kept for polling
+MAX_FILES_PER_JOB = 1000
+MAX_ATTEMPTS = 5                 # Per file, including the first try
+BACKOFF_BASE = 1.0               # Seconds; doubled after every failed attempt
+BACKOFF_MAX = 30.0
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+CHUNK_SIZE = 1024 * 1024
+PROGRESS_INTERVAL = 0.5          # Seconds between byte-progress notifications per file
+RETRY_STATUS = {408, 425, 429, 500, 502, 503, 504}
+CONTENT_RANGE_PATTERN = re.compile(r'bytes (\d+)-(\d+)/(\d+|\*)')
+META_DIR = '.meta'               # Per-file {"url", "validator"} records inside the download directory
+
+FINISHED_STATES = ('completed', 'failed', 'cancelled')
+
+
+class DownloadError(Exception):
+    """A file could not be downloaded; `retry` tells whether another attempt may help"""
+
+    def __init__(self, message, retry=True):
+        super().__init__(message)
+        self.retry = retry
+
+
+class _Cancelled(Exception):
+    pass
+
+
+class _File:
+    __slots__ = ('id', 'url', 'sha256', 'name', 'path', 'state', 'bytes', 'total',
+                 'attempts', 'resumed_from', 'error', 'verified', 'notified')
+
+    def __init__(self, spec, name):
+        self.id = spec.get('id') or name
+        self.url = spec['url']
+        self.sha256 = (spec.get('sha256') or '').lower() or None
+        self.name = name
+        self.path = None
+        self.state = 'pending'
+        self.bytes = 0
+        self.total = None
+        self.attempts = 0
+        self.resumed_from = 0
+        self.error = None
+        self.verified = None
+        self.notified = 0.0
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'url': self.url,
+            'name': self.name,
+            'path': str(self.path) if self.path else None,
+            'state': self.state,
+            'bytes': self.bytes,
+            'total': self.total,
+            'attempts': self.attempts,
+            'resumed_from': self.resumed_from,
+            'verified': self.verified,
+            'error': self.error,
+        }
+
+
+class _Job:
+    def __init__(self, files):
+        self.id = uuid.uuid4().hex[:12]
+        self.created = time.time()
+        self.finished = None
+        self.files = files
+        self.cancelled = False
+        self.futures = []
+        self.version = 0
+
+    @property
+    def state(self):
+        states = {f.state for f in self.files}
+        if states & {'pending', 'downloading', 'retrying'}:
+            return 'cancelling' if self.cancelled else 'running'
+        if 'cancelled' in states:
+            return 'cancelled'
+        return 'failed' if 'failed' in states else 'completed'
+
+
+def file_name(url, used):
+    """Local file name for `url`: the last path segment, made unique within a job"""
+    parsed = urlparse(url)
+    name = unquote(os.path.basename(parsed.path)) or 'download'
+    name = re.sub(r'[^A-Za-z0-9._-]', '_', name).lstrip('.') or 'download'
+    stem, suffix = os.path.splitext(name)
+    candidate, n = name, 1
+    while candidate in used:
+        candidate = f"{stem}_{n}{suffix}"
+        n += 1
+    used.add(candidate)
+    return candidate
+
+
+def url_file_name(name, url):
+    """`name` with a short hash of `url`, for when the plain name holds another URL's file"""
+    stem, suffix = os.path.splitext(name)
+    return f"{stem}_{hashlib.sha1(url.encode('utf-8')).hexdigest()[:8]}{suffix}"
+
+
+def _validator(response):
+    """Strong ETag, else Last-Modified: what If-Range may carry (RFC 9110 forbids weak ETags)"""
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('Last-Modified')
+
+
+class DownloadManager:
+    """
+    Runs download jobs on a shared pool of `workers` threads.
+
+    Files are named after the last URL segment and written into
+    `download_dir`, so a file is streamed into `<name>.part` and renamed once
+    complete (and verified, if a sha256 was given). A file that already
+    exists for the same URL is skipped, and an existing `.part` file - left
+    by a failed attempt, a cancelled job or a restart - is resumed with a
+    Range request guarded by If-Range, so a changed remote file is fetched
+    whole. A name already holding another URL's file gets a URL-hash suffix.
+    Connection errors, timeouts, truncated bodies and 408/429/5xx responses
+    are retried with exponential backoff and jitter.
+
+    `session_factory` returns a requests-compatible session, so downloads
+    share the server's pooled connections; without one each file gets a
+    plain requests.Session.
+    """
+
+    def __init__(self, download_dir=DEFAULT_DOWNLOAD_DIR, workers=DEFAULT_WORKERS, session_factory=None,
+                 max_attempts=MAX_ATTEMPTS, backoff_base=BACKOFF_BASE):
+        self.download_dir = Path(download_dir)
+        self.workers = workers
+        self.session_factory = session_factory
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self._executor = None
+        self._jobs = OrderedDict()
+        self._path_locks = {}           # file name -> [Lock, users], so two jobs never write the same .part
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self.counts = {'jobs': 0, 'files': 0, 'completed': 0, 'failed': 0, 'cancelled': 0,
+                       'retries': 0, 'resumed': 0, 'checksum_mismatches': 0, 'bytes': 0}
+
+    def create(self, files):
+        """
+        Start a job for `files`, a list of {"url", optional "id", optional "sha256"}.
+        Returns the job id.
+        """
+        if not files:
+            raise ValueError("No files to download")
+        if len(files) > MAX_FILES_PER_JOB:
+            raise ValueError(f"Too many files (max {MAX_FILES_PER_JOB})")
+        for spec in files:
+            if not isinstance(spec, dict) or not str(spec.get('url', '')).startswith(('http://', 'https://')):
+                raise ValueError(f"Invalid download entry: {spec!r}")
+
+        used = set()
+        job = _Job([_File(spec, file_name(spec['url'], used)) for spec in files])
+        self.download_dir.mkdir(parents=True, exist_ok=True)
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='enmap-download')
+            self._jobs[job.id] = job
+            self._trim_jobs_locked()
+            self.counts['jobs'] += 1
+            self.counts['files'] += len(job.files)
+            job.futures = [self._executor.submit(self._run_file, job, f) for f in job.files]
+        return job.id
+
+    def cancel(self, job_id):
+        """Stop a job; running files stop at the next chunk and keep their .part for resume"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return False
+            job.cancelled = True
+        for f, future in zip(job.files, job.futures):
+            if future.cancel():
+                with self._lock:
+                    self._finish_file_locked(job, f, 'cancelled')
+        return True
+
+    def status(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._status_locked(job) if job is not None else None
+
+    def wait(self, job_id, version=-1, timeout=PROGRESS_INTERVAL * 2):
+        """
+        Block until job `job_id` changes past `version` (or `timeout` passes).
+        Returns (status, version); status is None for unknown jobs.
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    return None, version
+                remaining = deadline - time.monotonic()
+                if job.version != version or remaining <= 0:
+                    return self._status_locked(job), job.version
+                self._changed.wait(remaining)
+
+    def shutdown(self):
+        """Cancel all jobs and stop the worker pool"""
+        with self._lock:
+            job_ids = list(self._jobs)
+            executor, self._executor = self._executor, None
+        for job_id in job_ids:
+            self.cancel(job_id)
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            active = sum(1 for job in self._jobs.values() if job.finished is None)
+            return {'workers': self.workers, 'active_jobs': active, 'download_dir': str(self.download_dir),
+                    **self.counts}
+
+    def _status_locked(self, job):
+        files = [f.to_dict() for f in job.files]
+        by_state = {}
+        for f in job.files:
+            by_state[f.state] = by_state.get(f.state, 0) + 1
+        known_totals = [f.total for f in job.files if f.total is not None]
+        return {
+            'id': job.id,
+            'state': job.state,
+            'created': job.created,
+            'finished': job.finished,
+            'directory': str(self.download_dir),
+            'file_count': len(files),
+            'files_by_state': by_state,
+            'bytes': sum(f.bytes for f in job.files),
+            'total_bytes': sum(known_totals) if len(known_totals) == len(files) else None,
+            'files': files,
+        }
+
+    def _trim_jobs_locked(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished is not None]
+        for job_id in finished[:max(0, len(self._jobs) - MAX_JOBS)]:
+            del self._jobs[job_id]
+
+    def _notify_locked(self, job):
+        job.version += 1
+        self._changed.notify_all()
+
+    def _set_state(self, job, f, state, error=None):
+        with self._lock:
+            f.state = state
+            f.error = error
+            self._notify_locked(job)
+
+    def _finish_file_locked(self, job, f, state, error=None):
+        f.state = state
+        f.error = error
+        self.counts[state] += 1
+        if job.state in FINISHED_STATES and job.finished is None:
+            job.finished = time.time()
+        self._notify_locked(job)
+
+    @contextmanager
+    def _path_lock(self, name):
+        """Hold the lock for file `name`; the entry is dropped once no job uses it"""
+        with self._lock:
+            entry = self._path_locks.setdefault(name, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._path_locks[name]
+
+    def _run_file(self, job, f):
+        with self._path_lock(f.name):
+            if not self._taken_by_other_url(f):
+                return self._run_file_locked(job, f)
+        with self._lock:
+            f.name = url_file_name(f.name, f.url)
+        with self._path_lock(f.name):
+            self._run_file_locked(job, f)
+
+    def _taken_by_other_url(self, f):
+        """True when `f.name` (or its .part) holds a file downloaded from a different URL"""
+        path = self.download_dir / f.name
+        if not path.exists() and not path.with_name(path.name + '.part').exists():
+            return False
+        url = self._read_meta(f.name).get('url')
+        if url is None:
+            # Predates the URL records: only a checksum can tell it is this file
+            return f.sha256 is None
+        return url != f.url
+
+    def _meta_path(self, name):
+        return self.download_dir / META_DIR / f"{name}.json"
+
+    def _read_meta(self, name):
+        try:
+            with open(self._meta_path(name), 'r', encoding='utf-8') as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_meta(self, name, meta):
+        path = self._meta_path(name)
+        path.parent.mkdir(exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as fh:
+            json.dump(meta, fh)
+        os.replace(tmp_path, path)
+
+    def _session(self):
+        if self.session_factory is not None:
+            return self.session_factory()
+        import requests
+        return requests.Session()
+
+    def _run_file_locked(self, job, f):
+        session = self._session()
+        attempt_error = None
+        while True:
+            if job.cancelled:
+                with self._lock:
+                    self._finish_file_locked(job, f, 'cancelled')
+                return
+            with self._lock:
+                f.attempts += 1
+                f.state = 'downloading'
+                self._notify_locked(job)
+            try:
+                with timed('download'):
+                    self._download(session, job, f)
+            except _Cancelled:
+                with self._lock:
+                    self._finish_file_locked(job, f, 'cancelled')
+                return
+            except Exception as e:
+                count_error(e)
+                attempt_error = str(e)
+                if getattr(e, 'retry', True) and f.attempts < self.max_attempts:
+                    delay = min(BACKOFF_MAX, self.backoff_base * 2 ** (f.attempts - 1))
+                    with self._lock:
+                        self.counts['retries'] += 1
+                    self._set_state(job, f, 'retrying', attempt_error)
+                    if self._sleep_unless_cancelled(job, delay * random.uniform(0.5, 1.0)):
+                        continue
+                    with self._lock:
+                        self._finish_file_locked(job, f, 'cancelled')
+                    return
+                with self._lock:
+                    self._finish_file_locked(job, f, 'failed', attempt_error)
+                return
+            with self._lock:
+                self.counts['bytes'] += f.bytes - f.resumed_from
+                self._finish_file_locked(job, f, 'completed')
+            return
+
+    def _sleep_unless_cancelled(self, job, delay):
+        """Back off for `delay` seconds; False if the job was cancelled meanwhile"""
+        deadline = time.monotonic() + delay
+        with self._lock:
+            while not job.cancelled:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return True
+                self._changed.wait(remaining)
+        return False
+
+    def _download(self, session, job, f):
+        """One attempt: resume or start `<name>.part`, then verify and move into place"""
+        path = self.download_dir / f.name
+        part = path.with_name(path.name + '.part')
+        f.path = path
+        if path.exists():
+            if f.sha256 is None or _file_sha256(path) == f.sha256:
+                size = path.stat().st_size
+                with self._lock:
+                    f.bytes = f.total = f.resumed_from = size
+                    f.verified = True if f.sha256 else None
+                return
+            path.unlink()
+
+        offset = part.stat().st_size if part.exists() else 0
+        meta = self._read_meta(f.name)
+        if offset and (meta.get('url') != f.url or not meta.get('validator')):
+            # Without a validator of the same URL the .part may hold another version's bytes
+            part.unlink()
+            offset = 0
+        headers = {}
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+            headers['If-Range'] = meta['validator']    # A changed remote file is sent whole (200)
+        with session.get(f.url, headers=headers, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                         verify=False, stream=True) as response:
+            if response.status_code == 416 and offset:
+                # The .part file is already complete (or longer than the remote file)
+                total = _content_range_total(response.headers.get('Content-Range'))
+                if total is None or total != offset:
+                    part.unlink()
+                    raise DownloadError("Partial file does not match remote size; restarting")
+                response_offset = offset
+                total = offset
+            elif response.status_code == 206 and offset:
+                match = CONTENT_RANGE_PATTERN.match(response.headers.get('Content-Range', ''))
+                if match is None or int(match.group(1)) != offset:
+                    part.unlink()
+                    raise DownloadError("Server ignored the resume offset; restarting")
+                response_offset = offset
+                total = int(match.group(3)) if match.group(3) != '*' else None
+            elif response.status_code == 200:
+                response_offset = 0
+                length = response.headers.get('Content-Length')
+                total = int(length) if length and length.isdigit() else None
+            else:
+                raise DownloadError(f"HTTP {response.status_code} for {f.url}",
+                                    retry=response.status_code in RETRY_STATUS)
+
+            if response_offset == 0:
+                self._write_meta(f.name, {'url': f.url, 'validator': _validator(response)})
+            if response_offset:
+                with self._lock:
+                    if f.resumed_from == 0:
+                        self.counts['resumed'] += 1
+                    f.resumed_from = response_offset
+            with self._lock:
+                f.bytes = response_offset
+                f.total = total
+
+            hasher = None
+            if f.sha256:
+                hasher = _file_sha256(part, hashlib.sha256()) if response_offset else hashlib.sha256()
+
+            with open(part, 'ab' if response_offset else 'wb') as out:
+                if response.status_code != 416:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        if job.cancelled:
+                            raise _Cancelled()
+                        out.write(chunk)
+                        if hasher is not None:
+                            hasher.update(chunk)
+                        self._progress(job, f, len(chunk))
+
+        if total is not None and f.bytes != total:
+            raise DownloadError(f"Incomplete download: {f.bytes} of {total} bytes")
+        if hasher is not None:
+            digest = hasher.hexdigest()
+            if digest != f.sha256:
+                part.unlink()
+                with self._lock:
+                    self.counts['checksum_mismatches'] += 1
+                    f.verified = False
+                # Only a resumed download can be fixed by fetching the whole file again
+                raise DownloadError(f"SHA-256 mismatch: expected {f.sha256}, got {digest}",
+                                    retry=response_offset > 0)
+            f.verified = True
+        os.replace(part, path)
+
+    def _progress(self, job, f, size):
+        with self._lock:
+            f.bytes += size
+            now = time.monotonic()
+            if now - f.notified >= PROGRESS_INTERVAL:
+                f.notified = now
+                self._notify_locked(job)
+
+
+def _file_sha256(path, hasher=None):
+    """Hex SHA-256 of a file, or the updated `hasher` if one is given"""
+    hasher_given = hasher is not None
+    hasher = hasher if hasher_given else hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher if hasher_given else hasher.hexdigest()
+
+
+def _content_range_total(header):
+    """Total size from a `bytes */<total>` or `bytes a-b/<total>` header, or None"""
+    if not header or '/' not in header:
+        return None
+    total = header.rsplit('/', 1)[1]
+    return int(total) if total.isdigit() else None
@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+EnMAP Core
+Query layer shared by server.py and enmap_query.py: one EnMAPQuery over the
+process-wide STAC catalog (stac_session.py), footprint index lookups and
+scene formatting. Long datetime ranges can be searched as concurrent time
+windows. Heavy dependencies (pystac-client, requests, numpy) are
+imported on first query, so importing this module costs a few milliseconds.
+"""
+
+import importlib.util
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timezone
+
+from stac_session import STAC_URL, get_manager
+from scene_record import format_datetime, scene_from_fields, scene_from_item
+from query_cache import normalize_datetime_range
+from metrics import observe_stage, timed, count_error
+from profiling import in_context
+from upstream_limits import UpstreamBusy
+from upstream_client import busy_cause, operation
+
+
+# Configuration
+COLLECTION = "ENMAP_HSI_L2A"
+DEFAULT_DATETIME = "2024-01-01/2026-01-05"
+MIN_WINDOW_DAYS = 30             # Ranges are not split into windows shorter than this
+MAX_WINDOWS = 16
+NEWEST_FIRST = [{'field': 'properties.datetime', 'direction': 'desc'}]   # sortby, when the API supports it
+
+
+def stac_available():
+    """True if pystac-client is installed (checked without importing it)"""
+    return importlib.util.find_spec('pystac_client') is not None
+
+
+def _format_instant(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def _newest_first(items):
+    """Items sorted by acquisition time, newest first (undated last)"""
+    return sorted(items, key=lambda item: (item.datetime is not None, item.datetime and item.datetime.timestamp()),
+                  reverse=True)
+
+
+def split_datetime_range(datetime_range, windows, min_days=MIN_WINDOW_DAYS):
+    """
+    Split a closed STAC datetime range into up to `windows` equal sub-ranges,
+    newest first, as [(datetime string, start, end)] with epoch bounds.
+    Open-ended ranges, single instants and ranges shorter than two
+    `min_days` windows come back as one window.
+    """
+    windows = min(int(windows or 1), MAX_WINDOWS)
+    try:
+        start, end = normalize_datetime_range(datetime_range) if windows > 1 else (None, None)
+    except ValueError:
+        start = end = None          # Left for the STAC API to accept or reject
+    if start is not None and end is not None and end > start:
+        windows = min(windows, int((end - start) // (min_days * 86400)))
+    if windows <= 1 or start is None or end is None or end <= start:
+        return [(datetime_range, start, end)]
+    
+    step = (end - start) / windows
+    bounds = [start + round(step * k) for k in range(windows)] + [end]
+    return [(f"{_format_instant(bounds[k])}/{_format_instant(bounds[k + 1])}", bounds[k], bounds[k + 1])
+            for k in reversed(range(windows))]
+
+
+class _WindowState:
+    """
+    Items collected per time window (index 0 = newest) by concurrent searches.
+
+    Window i only needs as many items as `max_items` minus what the newer
+    windows already hold, so it stops paging once it has that many. Unsorted
+    windows (`ordered=False`) must be read in full, so only windows behind
+    finished newer ones holding `max_items` stop. A failed window also stops
+    every older one: the merge raises before reaching them.
+    """
+    
+    def __init__(self, count, max_items, ordered=True):
+        self.cond = threading.Condition()
+        self.max_items = max_items
+        self.ordered = ordered
+        self.items = [[] for _ in range(count)]
+        self.done = [False] * count
+        self.errors = [None] * count
+        self.cutoff = count          # Windows at or past this index are not needed
+        self.cancelled = False
+    
+    def needed(self, i):
+        """True while window i may still contribute to the merged result (hold cond)"""
+        if self.cancelled or i >= self.cutoff:
+            return False
+        newer = sum(len(items) for items in self.items[:i])
+        if not self.ordered:
+            return not (all(self.done[:i]) and newer >= self.max_items)
+        return len(self.items[i]) < self.max_items - newer
+    
+    def cancel(self):
+        with self.cond:
+            self.cancelled = True
+            self.cond.notify_all()
+
+
+class EnMAPQuery:
+    """
+    Query EnMAP HSI L2A scenes from a STAC API.
+
+    Constructing one is cheap: the catalog and HTTP session are shared per
+    STAC URL. An optional `limiter` (see upstream_limits.py) caps concurrent
+    page requests.
+    """
+
+    def __init__(self, stac_url=STAC_URL, manager=None, limiter=None, collection=COLLECTION, windows=1):
+        self.stac_url = stac_url
+        self.manager = manager or get_manager(stac_url)
+        self.limiter = limiter
+        self.collection = collection
+        self.windows = windows
+
+    @property
+    def catalog(self):
+        return self.manager.get_catalog()
+
+    def _slot(self):
+        return self.limiter.slot() if self.limiter is not None else nullcontext()
+
+    def iter_items(self, bbox, datetime_range=DEFAULT_DATETIME, max_items=100, limit=None):
+        """
+        Yield Items page by page as the STAC API returns them (`limit` = page size).
+        Each page request holds an upstream slot only while it is in flight.
+        Results are requested newest first when the API supports `sortby`.
+        
+        With `windows` > 1 a long datetime range is searched as that many
+        concurrent sub-windows, merged newest first (see iter_windows).
+        """
+        windows = split_datetime_range(datetime_range, self.windows)
+        if len(windows) > 1:
+            return self.iter_windows(bbox, windows, max_items, limit)
+        return self._iter_search(bbox, datetime_range, max_items, limit, self._sortby())
+
+    def _sortby(self):
+        """NEWEST_FIRST if the API supports the sort extension, else None"""
+        try:
+            return NEWEST_FIRST if self.manager.supports_sort() else None
+        except Exception:
+            # The search that follows reports catalog errors
+            return None
+    
+    def iter_windows(self, bbox, windows, max_items=100, limit=None):
+        """
+        Search `windows` (from split_datetime_range, newest first) concurrently and
+        yield their Items newest first without duplicates, like a single search.
+        With `sortby` support each window is requested newest first, and the
+        newest window streams as its pages arrive while older windows are
+        buffered until their turn. Without it a window can only be sorted once
+        complete, so every window is read in full (not cut at `max_items`, which
+        would keep an arbitrary subset) and sorted before it is merged.
+        Searches stop paging once newer windows hold `max_items`, and closing
+        the generator cancels the rest. A window's error is raised when the
+        merge reaches it.
+        """
+        sortby = self._sortby()
+        state = _WindowState(len(windows), max_items, ordered=sortby is not None)
+        executor = ThreadPoolExecutor(max_workers=len(windows), thread_name_prefix='enmap-window')
+        for i, window in enumerate(windows):
+            # Each window runs in a copy of this context, so a request trace (and profile) sees it
+            executor.submit(in_context(self._fetch_window), state, i, bbox, window, max_items if sortby else None,
+                            limit, sortby)
+        
+        seen, count = set(), 0
+        try:
+            for i in range(len(windows)):
+                position = 0
+                while True:
+                    with state.cond:
+                        state.cond.wait_for(lambda: (sortby and len(state.items[i]) > position) or state.done[i])
+                        batch = state.items[i][position:]
+                        position += len(batch)
+                        if not sortby:
+                            batch = _newest_first(batch)
+                        if not batch and state.errors[i] is not None:
+                            raise state.errors[i]
+                        finished = not batch and state.done[i]
+                    if finished:
+                        break
+                    for item in batch:
+                        if item.id in seen:
+                            continue
+                        seen.add(item.id)
+                        yield item
+                        count += 1
+                        if count >= max_items:
+                            return
+        finally:
+            state.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _fetch_window(self, state, i, bbox, window, max_items, limit, sortby=None):
+        """Collect one window's Items into `state` until it is no longer needed"""
+        datetime_range, _, end = window
+        try:
+            with state.cond:
+                if not state.needed(i):
+                    return
+            for item in self._iter_search(bbox, datetime_range, max_items, limit, sortby):
+                # STAC ranges are closed: a scene on the boundary belongs to the newer window
+                if i > 0 and item.datetime is not None and item.datetime.timestamp() >= end:
+                    continue
+                with state.cond:
+                    if not state.needed(i):
+                        return
+                    state.items[i].append(item)
+                    state.cond.notify_all()
+        except Exception as e:
+            with state.cond:
+                state.errors[i] = e
+                state.cutoff = min(state.cutoff, i + 1)
+        finally:
+            with state.cond:
+                state.done[i] = True
+                state.cond.notify_all()
+    
+    def _iter_search(self, bbox, datetime_range, max_items, limit, sortby=None):
+        """One paged STAC search"""
+        try:
+            with self._slot(), operation('stac_search'):
+                kwargs = {'sortby': sortby} if sortby else {}
+                search = self.manager.search(
+                    collections=[self.collection],
+                    bbox=bbox,
+                    datetime=datetime_range,
+                    max_items=max_items,
+                    limit=limit,
+                    **kwargs
+                )
+            pages = search.pages()
+            while True:
+                with self._slot(), timed('stac_search'), operation('stac_search'):
+                    page = next(pages, None)
+                if page is None:
+                    return
+                yield from page
+        except UpstreamBusy:
+            raise
+        except Exception as e:
+            # pystac-client wraps a breaker's fast failure in APIError; keep it a 503
+            busy = busy_cause(e)
+            if busy is not None:
+                raise busy from e
+            # Paging errors surface here; re-open the catalog on next use
+            count_error(e)
+            self.manager.invalidate()
+            raise
+
+    def search_items(self, bbox, datetime_range=DEFAULT_DATETIME, max_items=100):
+        """Run one STAC search and return all Items; raises on upstream errors"""
+        return list(self.iter_items(bbox, datetime_range, max_items))
+
+    def query_scenes(self, bbox, datetime_range=DEFAULT_DATETIME, max_items=100):
+        """
+        Run one STAC search, converting each Item to a SceneRecord as its page arrives.
+
+        Returns (scenes, error); UpstreamBusy is raised so callers can shed load.
+        """
+        try:
+            scenes, parse_seconds = [], 0.0
+            for item in self.iter_items(bbox, datetime_range, max_items):
+                start = time.perf_counter()
+                scenes.append(scene_from_item(item))
+                parse_seconds += time.perf_counter() - start
+            observe_stage('item_parse', parse_seconds)
+            return scenes, None
+        except UpstreamBusy:
+            raise
+        except Exception as e:
+            return None, str(e)
+
+
+def search_index(index, bbox, datetime_range=DEFAULT_DATETIME, max_items=100):
+    """
+    Footprint index records matching a bbox and STAC datetime range, newest first.
+    A bbox crossing the antimeridian (west > east) is searched as two halves.
+    """
+    start, end = normalize_datetime_range(datetime_range)
+    with timed('index_search'):
+        if bbox[0] <= bbox[2]:
+            return index.search(bbox, start, end, max_items)
+        west, south, east, north = bbox
+        records = {}
+        for half in ([west, south, 180.0, north], [-180.0, south, east, north]):
+            for record in index.search(half, start, end, max_items):
+                records.setdefault(record['id'], record)
+        return sorted(records.values(), key=lambda r: -r['datetime'])[:max_items]
+
+
+def scene_from_index_record(record):
+    """SceneRecord from a footprint index record (NaN cloud cover becomes None)"""
+    cloud_cover = None if record['cloud_cover'] != record['cloud_cover'] else record['cloud_cover']
+    return scene_from_fields(record['id'], format_datetime(record['datetime']), cloud_cover, record['assets'],
+                             record.get('bbox'), record['datetime'], record.get('geometry'))
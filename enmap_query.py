@@ -5,18 +5,49 @@ Queries the DLR EOC STAC API for EnMAP HSI L2A products within specified bounds.
 """
 
 import argparse
-import json
-import csv
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 from datetime import datetime
 from pathlib import Path
-from pystac_client import Client
+from enmap_core import EnMAPQuery as CoreQuery, search_index, split_datetime_range
+from stac_session import STAC_URL
+from upstream_client import parse_timeouts
+from scene_record import item_timestamp, scene_from_item, scene_to_result
+from metrics import timed, print_timings
+from profiling import in_context, profiled
 
 
-class EnMAPQuery:
-    def __init__(self, stac_url="https://geoservice.dlr.de/eoc/ogc/stac/v1/"):
-        self.stac_url = stac_url
-        self.catalog = Client.open(stac_url)
-        self.collection = "ENMAP_HSI_L2A"
+class TokenBucket:
+    """Thread-safe token bucket: `rate` acquisitions per second with bursts up to `capacity`"""
+    
+    def __init__(self, rate, capacity=None):
+        if not rate > 0:
+            raise ValueError(f"rate must be positive, got {rate!r}")
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1.0, rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """Block until a token is available"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class EnMAPQuery(CoreQuery):
+    """enmap_core.EnMAPQuery plus console output, batch runs and export for the CLI"""
     
     def query_bounds(self, bbox, datetime_range="2024-01-01/2026-01-05", max_items=100):
         """
@@ -33,87 +64,162 @@ class EnMAPQuery:
         print(f"🔍 Querying EnMAP data...")
         print(f"   Bounding Box: {bbox}")
         print(f"   Time Range: {datetime_range}")
+        windows = len(split_datetime_range(datetime_range, self.windows))
+        if windows > 1:
+            print(f"   Time Windows: {windows} (searched concurrently)")
         print(f"   Collection: {self.collection}")
         print()
         
         try:
-            search = self.catalog.search(
-                collections=[self.collection],
-                bbox=bbox,
-                datetime=datetime_range,
-                max_items=max_items
-            )
-            
-            items = search.item_collection()
-            return list(items)
-        
+            return self.search_items(bbox, datetime_range, max_items)
         except Exception as e:
             print(f"❌ Error querying STAC API: {e}")
             return []
     
-    def print_results(self, items):
+    def query_many(self, bounds_list, datetime_range="2024-01-01/2026-01-05", max_items=100,
+                   concurrency=4, rate=5.0, retries=0, backoff=1.0):
+        """
+        Query many AOIs concurrently.
+        
+        AOI searches are started at most `rate` per second (a token bucket
+        charged once per search attempt, not per page). Each page request is
+        already retried by upstream_client.py; `retries` re-runs a whole failed
+        AOI search on top of that, with exponential backoff. Progress goes to
+        stderr. A bounds dict may carry its own "datetime" range.
+        
+        Returns:
+            List of (items, error) tuples in the same order as `bounds_list`
+        """
+        bucket = TokenBucket(rate, capacity=concurrency)
+        
+        def run(bounds):
+            error = None
+            for attempt in range(retries + 1):
+                bucket.acquire()
+                try:
+                    return self.search_items(bounds['bbox'], bounds.get('datetime', datetime_range), max_items), None
+                except Exception as e:
+                    error = e
+                    if attempt < retries:
+                        time.sleep(backoff * (2 ** attempt))
+            return [], str(error)
+        
+        results = [None] * len(bounds_list)
+        failed = 0
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {executor.submit(in_context(run), bounds): i for i, bounds in enumerate(bounds_list)}
+            for done, future in enumerate(as_completed(futures), start=1):
+                results[futures[future]] = future.result()
+                if results[futures[future]][1]:
+                    failed += 1
+                print(f"\r⏳ {done}/{len(bounds_list)} AOIs done ({failed} failed)", end='', file=sys.stderr, flush=True)
+        print(file=sys.stderr)
+        return results
+    
+    def query_index(self, index, bbox, datetime_range="2024-01-01/2026-01-05", max_items=100):
+        """Query the local footprint index instead of the STAC API."""
+        from footprint_index import to_pystac_item
+        
+        print(f"🔍 Querying local footprint index ({len(index)} scenes)...")
+        print(f"   Bounding Box: {bbox}")
+        print(f"   Time Range: {datetime_range}")
+        print()
+        
+        records = search_index(index, bbox, datetime_range, max_items)
+        with timed('format'):
+            return [to_pystac_item(r, self.collection) for r in records]
+    
+    def apply_coverage(self, items, bbox, min_coverage=0):
+        """
+        Post-filter for query_bounds/query_index results: intersect each item's
+        footprint with the AOI `bbox`.
+        
+        Returns:
+            (items covering at least `min_coverage` % of the AOI, {item id: coverage %});
+            items without a known footprint are kept with coverage None
+        """
+        from footprint_coverage import coverage_fractions, coverage_percent
+        
+        with timed('coverage'):
+            fractions = coverage_fractions(bbox, [(item.geometry, item.bbox) for item in items])
+        coverage = {item.id: coverage_percent(f) for item, f in zip(items, fractions.tolist())}
+        kept = [item for item in items
+                if not min_coverage or coverage[item.id] is None or coverage[item.id] >= min_coverage]
+        if len(kept) < len(items):
+            print(f"🎯 {len(items) - len(kept)} scene(s) cover less than {min_coverage:g}% of the AOI")
+        return kept, coverage
+    
+    def print_results(self, items, coverage=None):
         """Print results in a formatted table."""
         if not items:
             print("❌ No EnMAP scenes found for the specified criteria.")
             return
         
+        coverage = coverage or {}
         print(f"✅ Found {len(items)} matching EnMAP scenes!\n")
-        print("=" * 100)
-        print(f"{'ID':<40} {'Date':<20} {'Cloud Cover':<15} {'Data Available':<15}")
-        print("=" * 100)
+        print("=" * 112)
+        print(f"{'ID':<40} {'Date':<20} {'Cloud Cover':<15} {'Coverage':<11} {'Data Available':<15}")
+        print("=" * 112)
         
         for item in items:
             item_id = item.id[:38] + ".." if len(item.id) > 40 else item.id
             date = str(item.datetime)[:10] if item.datetime else "N/A"
             cloud_cover = f"{item.properties.get('eo:cloud_cover', 'N/A')}%"
+            covered = f"{coverage[item.id]}%" if coverage.get(item.id) is not None else "N/A"
             has_data = "✓ Yes" if "data" in item.assets else "✗ No"
             
-            print(f"{item_id:<40} {date:<20} {cloud_cover:<15} {has_data:<15}")
+            print(f"{item_id:<40} {date:<20} {cloud_cover:<15} {covered:<11} {has_data:<15}")
         
-        print("=" * 100)
+        print("=" * 112)
         print()
     
-    def export_results(self, items, output_file="enmap_results.json"):
-        """Export results to JSON file."""
-        results = []
-        for item in items:
-            result = {
-                "id": item.id,
-                "datetime": str(item.datetime),
-                "cloud_cover": item.properties.get("eo:cloud_cover", None),
-                "data_url": item.assets.get("data", {}).get("href") if "data" in item.assets else None,
-                "preview_url": item.assets.get("thumbnail", {}).get("href") if "thumbnail" in item.assets else None,
-            }
-            results.append(result)
-        
-        with open(output_file, 'w') as f:
-            json.dump(results, f, indent=2)
+    def export_results(self, exporter, items, aoi_id=None, coverage=None):
+        """Write one AOI's results to an exporters.py writer, one row per item."""
+        from exporters import export_row
         
-        print(f"✅ Results exported to: {output_file}")
+        coverage = coverage or {}
+        for item in items:
+            with timed('format'):
+                scene = scene_from_item(item)
+                row = export_row({**scene_to_result(scene), 'coverage': coverage.get(item.id),
+                                  'bbox': scene.bbox, 'geometry': scene.geometry}, aoi_id)
+            with timed('serialize'):
+                exporter.write(row)
     
     def load_bounds_from_csv(self, csv_file):
-        """Load bounds from the CSV Bounds Viewer export."""
-        bounds_list = []
+        """Load bounds from the CSV Bounds Viewer export, skipping (and reporting) invalid rows."""
+        from bounds_reader import read_bounds_csv
+        
         try:
-            with open(csv_file, 'r') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    bbox = [
-                        float(row['west_lon']),
-                        float(row['south_lat']),
-                        float(row['east_lon']),
-                        float(row['north_lat'])
-                    ]
-                    bounds_list.append({
-                        'granule_id': row['granule_id'],
-                        'bbox': bbox
-                    })
-        except Exception as e:
+            bounds_list, reader = read_bounds_csv(csv_file)
+        except (OSError, ValueError) as e:
             print(f"❌ Error reading CSV file: {e}")
+            return []
         
+        print_row_errors(reader)
         return bounds_list
 
 
+def print_row_errors(reader):
+    """Warn about rows a BoundsReader skipped"""
+    for error in reader.errors:
+        name = f" ({error['granule_id']})" if 'granule_id' in error else ''
+        print(f"⚠️  Skipping row {error['row']}{name}: {error['error']}", file=sys.stderr)
+    if reader.invalid > len(reader.errors):
+        print(f"⚠️  ... {reader.invalid - len(reader.errors)} more invalid rows", file=sys.stderr)
+
+
+def positive_float(value):
+    """argparse type for a float > 0"""
+    try:
+        number = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid number: {value!r}")
+    if not number > 0:
+        raise argparse.ArgumentTypeError(f"must be greater than 0, got {value}")
+    return number
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Query EnMAP data availability for specified geographic bounds",
@@ -129,8 +235,35 @@ Examples:
   # Query with custom time range
   python enmap_query.py --bbox 11.23 48.05 11.33 48.11 --datetime 2025-01-01/2025-12-31
   
+  # Search a multi-year range as 4 concurrent time windows
+  python enmap_query.py --bbox 11.23 48.05 11.33 48.11 --datetime 2022-01-01/2026-01-05 --windows 4
+  
   # Export results to JSON
   python enmap_query.py --bbox 11.23 48.05 11.33 48.11 --export enmap_results.json
+  
+  # Stream a large batch to GeoParquet (format also follows .ndjson/.csv/.parquet suffixes)
+  python enmap_query.py --csv-file bounds.csv --export results.parquet --export-format parquet
+  
+  # Query a large CSV with 8 parallel searches, starting at most 5 AOI searches/s
+  python enmap_query.py --csv-file bounds.csv --concurrency 8 --rate 5
+  
+  # Sync a local footprint index and query it without STAC round-trips
+  python enmap_query.py --csv-file bounds.csv --index enmap_index.npz --sync-index
+  
+  # Keep only scenes whose footprint covers at least 50% of the AOI
+  python enmap_query.py --csv-file bounds.csv --min-coverage 50
+  
+  # Nightly job: only report scenes that appeared since the previous run
+  python enmap_query.py --csv-file bounds.csv --watch enmap_watch.json
+  
+  # Allow slow STAC pages up to 60 s and never send hedged duplicates
+  python enmap_query.py --csv-file bounds.csv --timeouts stac_search=60 --no-hedge
+  
+  # Print per-stage latencies (catalog open, STAC search, formatting) at the end
+  python enmap_query.py --csv-file bounds.csv --timings
+  
+  # Profile a slow run and inspect it (python -m pstats enmap.prof, or snakeviz)
+  python enmap_query.py --bbox 11.23 48.05 11.33 48.11 --profile enmap.prof
         """
     )
     
@@ -162,47 +295,248 @@ Examples:
         help='Maximum number of results to return (default: 100)'
     )
     
+    parser.add_argument(
+        '--windows',
+        type=int,
+        default=1,
+        help='Split the time range into up to this many concurrent STAC searches (default: 1)'
+    )
+    
+    parser.add_argument(
+        '--min-coverage',
+        type=float,
+        default=0,
+        help='Drop scenes whose footprint covers less than this %% of the AOI (default: 0)'
+    )
+    
     parser.add_argument(
         '--export',
         type=str,
-        help='Export results to JSON file'
+        help='Export results to a file, written as each AOI finishes'
+    )
+    
+    parser.add_argument(
+        '--export-format',
+        choices=['json', 'ndjson', 'csv', 'parquet'],
+        help='Export format (default: from the --export suffix, else json; parquet is GeoParquet and needs pyarrow)'
+    )
+    
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=1,
+        help='Number of AOIs to query in parallel (default: 1, serial)'
+    )
+    
+    parser.add_argument(
+        '--rate',
+        type=positive_float,
+        default=5.0,
+        help='AOI searches started per second when --concurrency > 1 (default: 5)'
+    )
+    
+    parser.add_argument(
+        '--retries',
+        type=int,
+        default=0,
+        help='Re-run a failed AOI search this many times; needs --concurrency > 1 (default: 0; '
+             'page requests are already retried, so each re-run multiplies the attempts)'
+    )
+    
+    parser.add_argument(
+        '--watch',
+        type=str,
+        metavar='STATE_FILE',
+        help='Incremental mode: search only since the last run recorded in STATE_FILE and report new scenes'
+    )
+    
+    parser.add_argument(
+        '--index',
+        type=str,
+        help='Query a local footprint index (.npz) instead of the STAC API'
+    )
+    
+    parser.add_argument(
+        '--sync-index',
+        action='store_true',
+        help='Incrementally sync the --index file from the STAC API before querying'
+    )
+    
+    parser.add_argument(
+        '--stac-url',
+        type=str,
+        default=STAC_URL,
+        help='STAC API root (default: DLR EOC; e.g. a local fake_stac.py server)'
+    )
+    
+    parser.add_argument(
+        '--timeouts',
+        type=str,
+        metavar='OP=SECONDS,...',
+        help='Upstream read timeouts per operation: catalog, stac_search, preview (default: 15, 30, 10)'
+    )
+    
+    parser.add_argument(
+        '--no-hedge',
+        action='store_true',
+        help="Never send a duplicate of a STAC request that runs past the host's recent p95 latency"
+    )
+    
+    parser.add_argument(
+        '--timings',
+        action='store_true',
+        help='Print per-stage latency timings to stderr when done'
+    )
+    
+    parser.add_argument(
+        '--profile',
+        type=str,
+        metavar='OUT.prof',
+        help='Write a cProfile of the run (worker threads merged in) to this file'
     )
     
     args = parser.parse_args()
     
     # Validate inputs
+    if args.concurrency < 1:
+        parser.error(f"argument --concurrency: must be at least 1, got {args.concurrency}")
+    if args.retries < 0:
+        parser.error(f"argument --retries: must not be negative, got {args.retries}")
+    if args.retries and (args.concurrency == 1 or args.index):
+        parser.error("argument --retries: only applies to STAC searches with --concurrency > 1")
     if not args.bbox and not args.csv_file:
         parser.print_help()
         print("\n❌ Error: Please provide either --bbox or --csv-file")
         return
     
+    with profiled(args.profile) if args.profile else nullcontext():
+        run_queries(args)
+    if args.profile:
+        print(f"📈 Profile written to: {args.profile} (python -m pstats {args.profile})")
+
+
+def run_queries(args):
+    """Run the queries described by the parsed command line"""
     # Initialize query object
-    query = EnMAPQuery()
+    query = EnMAPQuery(args.stac_url, windows=args.windows)
+    try:
+        query.manager.upstream.set_timeouts(parse_timeouts(args.timeouts))
+    except ValueError as e:
+        print(f"❌ Error: {e}")
+        return
+    if args.no_hedge:
+        query.manager.upstream.hedge = False
+    
+    index = None
+    if args.index:
+        from footprint_index import FootprintIndex
+        index = FootprintIndex.load(args.index) if Path(args.index).exists() else FootprintIndex(query.collection)
+        if args.sync_index:
+            received = index.sync(query.manager)
+            index.save(args.index)
+            print(f"✅ Index synced: {received} new/updated scenes, {len(index)} total")
     
     # Process bounds
     bounds_to_query = []
     
     if args.bbox:
-        bounds_to_query.append({
-            'name': 'Custom Bounds',
-            'bbox': args.bbox
-        })
+        from bounds_reader import BoundsReader, BOUNDS_COLUMNS
+        
+        reader = BoundsReader()
+        for aoi in reader.aois(reader.record_chunks([dict(zip(BOUNDS_COLUMNS, args.bbox))])):
+            bounds_to_query.append({
+                'name': 'Custom Bounds',
+                'bbox': aoi['bbox']
+            })
+        print_row_errors(reader)
     
     if args.csv_file:
         csv_bounds = query.load_bounds_from_csv(args.csv_file)
         bounds_to_query.extend([{'name': b['granule_id'], 'bbox': b['bbox']} for b in csv_bounds])
     
+    # Watch mode: each AOI searches from shortly before its newest known scene
+    state = None
+    if args.watch:
+        from watch_state import WatchState
+        
+        state = WatchState(args.watch)
+        for bounds in bounds_to_query:
+            bounds['key'] = WatchState.aoi_key(bounds['name'], bounds['bbox'])
+            bounds['datetime'] = state.delta_range(bounds['key'], args.datetime)
+        first_runs = sum(1 for bounds in bounds_to_query if bounds['datetime'] == args.datetime)
+        print(f"👀 Watch mode: {len(bounds_to_query) - first_runs} AOI(s) searched incrementally, "
+              f"{first_runs} for the first time")
+    
+    # Rows are exported per AOI as results come in
+    exporter = export_file = None
+    if args.export:
+        from exporters import export_format, format_available, open_exporter
+        
+        fmt = export_format(args.export, args.export_format)
+        if not format_available(fmt):
+            print("❌ Error: GeoParquet export needs pyarrow (pip install pyarrow)")
+            return
+        export_file = open(args.export, 'wb')
+        exporter = open_exporter(fmt, export_file)
+    
     # Execute queries
-    all_items = []
-    for bounds in bounds_to_query:
-        print(f"\n📍 Querying: {bounds['name']}")
-        items = query.query_bounds(bounds['bbox'], args.datetime, args.max_items)
-        query.print_results(items)
-        all_items.extend(items)
-    
-    # Export if requested
-    if args.export and all_items:
-        query.export_results(all_items, args.export)
+    total_items = 0
+    
+    def finish_aoi(bounds, items):
+        nonlocal total_items
+        if state is not None:
+            complete = len(items) < args.max_items
+            new_ids = set(state.record(bounds['key'], [(item.id, item_timestamp(item)) for item in items], complete))
+            items = [item for item in items if item.id in new_ids]
+            print(f"🆕 {len(items)} new scene(s) since the last run")
+            if not complete:
+                print(f"⚠️  Search hit --max-items {args.max_items}; watermark kept, raise --max-items to catch up")
+        items, coverage = query.apply_coverage(items, bounds['bbox'], args.min_coverage)
+        query.print_results(items, coverage)
+        if exporter is not None:
+            query.export_results(exporter, items, bounds['name'], coverage)
+        total_items += len(items)
+    
+    if args.concurrency > 1 and index is None:
+        start_time = time.perf_counter()
+        results = query.query_many(
+            bounds_to_query, args.datetime, args.max_items,
+            concurrency=args.concurrency, rate=args.rate, retries=args.retries
+        )
+        elapsed = max(time.perf_counter() - start_time, 1e-9)
+        
+        # Print in input order regardless of completion order
+        for bounds, (items, error) in zip(bounds_to_query, results):
+            print(f"\n📍 {bounds['name']}")
+            if error:
+                print(f"❌ Error querying STAC API: {error}")
+                continue
+            finish_aoi(bounds, items)
+        
+        failed = sum(1 for _, error in results if error)
+        print(f"📊 {len(bounds_to_query)} AOIs ({failed} failed), {total_items} items in {elapsed:.1f}s: "
+              f"{len(bounds_to_query) / elapsed:.2f} AOIs/s, {total_items / elapsed:.1f} items/s")
+    else:
+        for bounds in bounds_to_query:
+            print(f"\n📍 Querying: {bounds['name']}")
+            datetime_range = bounds.get('datetime', args.datetime)
+            if index is not None:
+                items = query.query_index(index, bounds['bbox'], datetime_range, args.max_items)
+            else:
+                items = query.query_bounds(bounds['bbox'], datetime_range, args.max_items)
+            finish_aoi(bounds, items)
+    
+    if state is not None:
+        state.save()
+        print(f"👀 {total_items} new scene(s) across {len(bounds_to_query)} AOI(s); state saved to {args.watch}")
+    
+    if exporter is not None:
+        exporter.close()
+        export_file.close()
+        print(f"✅ {exporter.rows} results exported to: {args.export} ({fmt})")
+    
+    if args.timings:
+        print_timings()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+EnMAP Result Export
+Streaming writers for query results: JSON, NDJSON, CSV and GeoParquet. Rows
+are written as they are produced (GeoParquet in row groups), so exports of
+large batch runs never hold the whole result set in memory. Every row carries
+the source AOI id and the scene footprint.
+"""
+
+import csv
+import importlib.util
+import io
+import json
+import struct
+from pathlib import Path
+
+
+# Configuration
+EXPORT_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+FORMAT_SUFFIXES = {'.json': 'json', '.ndjson': 'ndjson', '.jsonl': 'ndjson', '.csv': 'csv',
+                   '.parquet': 'parquet', '.geoparquet': 'parquet'}
+PARQUET_ROW_GROUP = 10000        # Rows buffered per GeoParquet row group
+
+EXPORT_COLUMNS = ('aoi_id', 'id', 'datetime', 'cloud_cover', 'coverage', 'data_url', 'preview_url',
+                  'available_assets', 'bbox', 'geometry')
+CSV_COLUMNS = ('aoi_id', 'id', 'datetime', 'cloud_cover', 'coverage', 'data_url', 'preview_url',
+               'available_assets', 'west_lon', 'south_lat', 'east_lon', 'north_lat', 'geometry_wkt')
+
+
+def export_format(path=None, fmt=None):
+    """Export format from an explicit name or the file suffix; JSON by default"""
+    if fmt:
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format '{fmt}' (use {', '.join(EXPORT_FORMATS)})")
+        return fmt
+    return FORMAT_SUFFIXES.get(Path(path).suffix.lower(), 'json') if path else 'json'
+
+
+def format_available(fmt):
+    """True if the format's optional dependency (pyarrow for GeoParquet) is installed"""
+    return fmt != 'parquet' or importlib.util.find_spec('pyarrow') is not None
+
+
+def export_row(result, aoi_id=None):
+    """Export row for an API result that carries "bbox" and "geometry" (see EXPORT_COLUMNS)"""
+    return {
+        'aoi_id': aoi_id,
+        'id': result['id'],
+        'datetime': result.get('datetime'),
+        'cloud_cover': result.get('cloud_cover'),
+        'coverage': result.get('coverage'),
+        'data_url': result.get('data_url'),
+        'preview_url': result.get('preview_url'),
+        'available_assets': list(result.get('available_assets') or []),
+        'bbox': list(result['bbox'][:4]) if result.get('bbox') else None,
+        'geometry': result.get('geometry'),
+    }
+
+
+def _polygons(geometry):
+    """Polygon coordinate lists of a GeoJSON Polygon/MultiPolygon (empty for anything else)"""
+    if not geometry:
+        return []
+    if geometry.get('type') == 'Polygon':
+        return [geometry.get('coordinates') or []]
+    if geometry.get('type') == 'MultiPolygon':
+        return geometry.get('coordinates') or []
+    return []
+
+
+def geometry_wkt(geometry):
+    """WKT for a GeoJSON Polygon/MultiPolygon, or '' when there is none"""
+    polygons = _polygons(geometry)
+    if not polygons:
+        return ''
+    text = ['(' + ', '.join('(' + ', '.join(f"{p[0]:.6f} {p[1]:.6f}" for p in ring) + ')' for ring in polygon) + ')'
+            for polygon in polygons]
+    if geometry['type'] == 'Polygon':
+        return 'POLYGON ' + text[0]
+    return 'MULTIPOLYGON (' + ', '.join(text) + ')'
+
+
+def _wkb_polygon(polygon):
+    parts = [struct.pack('<BII', 1, 3, len(polygon))]
+    for ring in polygon:
+        parts.append(struct.pack('<I', len(ring)))
+        parts.append(struct.pack(f'<{2 * len(ring)}d', *(v for p in ring for v in p[:2])))
+    return b''.join(parts)
+
+
+def geometry_wkb(geometry):
+    """Little-endian WKB for a GeoJSON Polygon/MultiPolygon, or None"""
+    polygons = _polygons(geometry)
+    if not polygons:
+        return None
+    if geometry['type'] == 'Polygon':
+        return _wkb_polygon(polygons[0])
+    return struct.pack('<BII', 1, 6, len(polygons)) + b''.join(_wkb_polygon(p) for p in polygons)
+
+
+class JSONExporter:
+    """One JSON array, written element by element"""
+
+    def __init__(self, out):
+        self.out = out
+        self.rows = 0
+
+    def write(self, row):
+        prefix = '[\n' if self.rows == 0 else ',\n'
+        self.out.write((prefix + json.dumps(row)).encode('utf-8'))
+        self.rows += 1
+
+    def close(self):
+        self.out.write(b'\n]\n' if self.rows else b'[]\n')
+
+
+class NDJSONExporter:
+    """One JSON object per line"""
+
+    def __init__(self, out):
+        self.out = out
+        self.rows = 0
+
+    def write(self, row):
+        self.out.write((json.dumps(row) + '\n').encode('utf-8'))
+        self.rows += 1
+
+    def close(self):
+        pass
+
+
+class CSVExporter:
+    """CSV with the bounds viewer bbox columns and the footprint as WKT"""
+
+    def __init__(self, out):
+        self.out = io.TextIOWrapper(out, encoding='utf-8', newline='', write_through=True)
+        self.writer = csv.writer(self.out)
+        self.writer.writerow(CSV_COLUMNS)
+        self.rows = 0
+
+    def write(self, row):
+        bbox = row['bbox'] or [None] * 4
+        self.writer.writerow([
+            row['aoi_id'], row['id'], row['datetime'], row['cloud_cover'], row['coverage'],
+            row['data_url'], row['preview_url'], ';'.join(row['available_assets']),
+            *bbox, geometry_wkt(row['geometry']),
+        ])
+        self.rows += 1
+
+    def close(self):
+        self.out.detach()
+
+
+class ParquetExporter:
+    """
+    GeoParquet 1.1: footprints as WKB in "geometry" (OGC:CRS84, the default
+    when "crs" is omitted) with a "bbox" covering column. Rows are buffered
+    and written one row group at a time.
+    """
+
+    def __init__(self, out, row_group=PARQUET_ROW_GROUP):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.out = out
+        self.row_group = row_group
+        self.rows = 0
+        self.buffer = []
+        geo = {
+            'version': '1.1.0',
+            'primary_column': 'geometry',
+            'columns': {'geometry': {
+                'encoding': 'WKB',
+                'geometry_types': ['Polygon', 'MultiPolygon'],
+                'covering': {'bbox': {'xmin': ['bbox', 'xmin'], 'ymin': ['bbox', 'ymin'],
+                                      'xmax': ['bbox', 'xmax'], 'ymax': ['bbox', 'ymax']}},
+            }},
+        }
+        self.schema = pa.schema([
+            ('aoi_id', pa.string()),
+            ('id', pa.string()),
+            ('datetime', pa.string()),
+            ('cloud_cover', pa.float64()),
+            ('coverage', pa.float64()),
+            ('data_url', pa.string()),
+            ('preview_url', pa.string()),
+            ('available_assets', pa.list_(pa.string())),
+            ('bbox', pa.struct([('xmin', pa.float64()), ('ymin', pa.float64()),
+                                ('xmax', pa.float64()), ('ymax', pa.float64())])),
+            ('geometry', pa.binary()),
+        ], metadata={'geo': json.dumps(geo)})
+        self.writer = pq.ParquetWriter(out, self.schema, compression='zstd')
+
+    def write(self, row):
+        self.buffer.append(row)
+        self.rows += 1
+        if len(self.buffer) >= self.row_group:
+            self._flush()
+
+    def close(self):
+        self._flush()
+        self.writer.close()
+
+    def _flush(self):
+        if not self.buffer:
+            return
+        columns = {name: [row[name] for row in self.buffer] for name in EXPORT_COLUMNS}
+        columns['bbox'] = [dict(zip(('xmin', 'ymin', 'xmax', 'ymax'), b)) if b else None for b in columns['bbox']]
+        columns['geometry'] = [geometry_wkb(g) for g in columns['geometry']]
+        self.writer.write_table(self.pa.Table.from_pydict(columns, schema=self.schema))
+        self.buffer = []
+
+
+EXPORTERS = {'json': JSONExporter, 'ndjson': NDJSONExporter, 'csv': CSVExporter, 'parquet': ParquetExporter}
+
+
+def open_exporter(fmt, out):
+    """Exporter writing `fmt` to the binary file object `out`"""
+    return EXPORTERS[fmt](out)
+
+
+class ChunkBuffer(io.RawIOBase):
+    """Write-only binary sink whose contents are taken with drain(), for streaming responses"""
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_export(rows, fmt):
+    """Yield the encoded export of `rows` chunk by chunk as rows arrive"""
+    buffer = ChunkBuffer()
+    exporter = open_exporter(fmt, buffer)
+    for row in rows:
+        exporter.write(row)
+        data = buffer.drain()
+        if data:
+            yield data
+    exporter.close()
+    data = buffer.drain()
+    if data:
+        yield data
@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+"""
+Fake EnMAP STAC Server
+Local stand-in for the DLR EOC STAC API and download host, for benchmarks and
+offline development. Serves deterministic synthetic ENMAP_HSI_L2A items with
+realistic scene ids, bbox/datetime search with paging, and quicklook/download
+files (with Range support), with configurable latency, jitter and injected
+faults: file errors, failed searches, a slow tail of STAC and quicklook
+responses, and a full outage (`outage = True` on a running instance).
+
+    python fake_stac.py --port 8765 --items 5000 --latency 50 --jitter 20
+    ENMAP_STAC_URL=http://127.0.0.1:8765/ python3 server.py
+    python enmap_query.py --stac-url http://127.0.0.1:8765/ --bbox 8.99 45.29 9.14 45.43
+    python fake_stac.py --tail-rate 0.05 --tail-latency 2000 --search-error-rate 0.05
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from query_cache import normalize_datetime_range
+
+
+# Configuration
+COLLECTION = "ENMAP_HSI_L2A"
+DEFAULT_ITEMS = 5000
+DEFAULT_SEED = 42
+DEFAULT_LATENCY = 0.05           # Seconds added to every STAC request
+DEFAULT_JITTER = 0.02            # +/- seconds of uniform jitter
+DEFAULT_ASSET_LATENCY = 0.03     # Seconds added to quicklook/download requests
+DEFAULT_TAIL_LATENCY = 2.0       # Seconds added to the slow share (--tail-rate) of STAC/quicklook requests
+QUICKLOOK_BYTES = 40 * 1024
+DOWNLOAD_BYTES = 1024 * 1024
+MAX_LIMIT = 1000
+SCENE_SIZE_DEG = 0.27            # EnMAP swath is ~30 km
+TRACK_ANGLES = (-8, -9, -10, -11, -12, -13, -14)   # Degrees off north of the descending ground track
+START_DATE = datetime(2022, 6, 1, tzinfo=timezone.utc)
+END_DATE = datetime(2026, 1, 1, tzinfo=timezone.utc)
+HOTSPOT_SHARE = 0.7              # Share of scenes placed around the example AOIs
+EXAMPLE_CSV = Path(__file__).parent / 'example_bounds.csv'
+
+
+def _hotspots():
+    """Centers of the example AOIs, so benchmark queries find scenes"""
+    centers = []
+    try:
+        with open(EXAMPLE_CSV, 'r') as f:
+            for row in csv.DictReader(f):
+                lat = (float(row['north_lat']) + float(row['south_lat'])) / 2
+                lon = (float(row['west_lon']) + float(row['east_lon'])) / 2
+                centers.append((lon, lat))
+    except (OSError, KeyError, ValueError):
+        pass
+    return centers or [(9.07, 45.37)]
+
+
+def _footprint(lon, lat, angle):
+    """Square scene footprint rotated `angle` degrees off north, as [lon, lat] corners"""
+    half = SCENE_SIZE_DEG / 2
+    scale = max(math.cos(math.radians(lat)), 0.2)
+    sin_a, cos_a = math.sin(math.radians(angle)), math.cos(math.radians(angle))
+    corners = []
+    for dx, dy in ((-half, -half), (half, -half), (half, half), (-half, half)):
+        x, y = dx * cos_a - dy * sin_a, dx * sin_a + dy * cos_a
+        corners.append([round(lon + x / scale, 5), round(lat + y, 5)])
+    return corners
+
+
+def make_items(count=DEFAULT_ITEMS, seed=DEFAULT_SEED, base_url='http://127.0.0.1/'):
+    """Deterministic synthetic STAC items; asset hrefs point at `base_url`"""
+    rng = random.Random(seed)
+    hotspots = _hotspots()
+    span = (END_DATE - START_DATE).total_seconds()
+    items = []
+    for n in range(count):
+        if rng.random() < HOTSPOT_SHARE:
+            lon0, lat0 = rng.choice(hotspots)
+            lon, lat = lon0 + rng.gauss(0, 0.3), lat0 + rng.gauss(0, 0.3)
+        else:
+            lon, lat = rng.uniform(-180, 180), rng.uniform(-60, 70)
+        footprint = _footprint(lon, lat, TRACK_ANGLES[n % len(TRACK_ANGLES)])
+        bbox = [round(min(p[0] for p in footprint), 5), round(min(p[1] for p in footprint), 5),
+                round(max(p[0] for p in footprint), 5), round(max(p[1] for p in footprint), 5)]
+
+        acquired = START_DATE + timedelta(seconds=int(rng.random() * span))
+        processed = acquired + timedelta(hours=rng.randint(8, 48))
+        dt_num = 100000 + n
+        version = f"{rng.randint(1, 9):03d}"
+        scene_id = (f"ENMAP01-____L2A-DT{dt_num:010d}_{acquired:%Y%m%dT%H%M%S}Z_{version}_"
+                    f"V010505_{processed:%Y%m%dT%H%M%S}Z")
+        base = (f"{base_url}ENMAP/files/L2A/{acquired:%Y/%m/%d}/DT{dt_num:010d}/{version}/{scene_id}")
+        items.append({
+            'type': 'Feature',
+            'stac_version': '1.0.0',
+            'stac_extensions': [],
+            'id': scene_id,
+            'collection': COLLECTION,
+            'bbox': bbox,
+            'geometry': {'type': 'Polygon', 'coordinates': [footprint + footprint[:1]]},
+            'properties': {
+                'datetime': acquired.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'updated': processed.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                'eo:cloud_cover': round(rng.random() * 100, 1),
+                'platform': 'EnMAP',
+            },
+            'links': [],
+            'assets': {
+                'thumbnail': {'href': f"{base}-QL_VNIR_COG_thumbnail.jpg", 'type': 'image/jpeg', 'roles': ['thumbnail']},
+                'VNIR': {'href': f"{base}-SPECTRAL_IMAGE_VNIR.TIF", 'type': 'image/tiff', 'roles': ['data']},
+                'SWIR': {'href': f"{base}-SPECTRAL_IMAGE_SWIR.TIF", 'type': 'image/tiff', 'roles': ['data']},
+                'metadata': {'href': f"{base}-METADATA.XML", 'type': 'application/xml', 'roles': ['metadata']},
+            },
+            '_range': (bbox, acquired.timestamp()),
+        })
+    # Newest first, like the DLR API
+    items.sort(key=lambda item: item['_range'][1], reverse=True)
+    return items
+
+
+def _sort_ascending(sortby):
+    """True for an ascending datetime sortby (GET "+properties.datetime" or POST [{"direction": "asc"}])"""
+    if isinstance(sortby, str):
+        return sortby.split(',')[0].strip().lstrip('+').endswith('datetime') and not sortby.startswith('-')
+    if isinstance(sortby, list) and sortby:
+        return sortby[0].get('field', '').endswith('datetime') and sortby[0].get('direction') == 'asc'
+    return False
+
+
+def _file_body(path, size):
+    """Deterministic bytes for a fake asset; quicklooks start with a JPEG marker"""
+    block = hashlib.sha256(path.encode('utf-8')).digest() * 64
+    body = (block * (size // len(block) + 1))[:size]
+    if path.endswith('.jpg'):
+        body = b'\xff\xd8\xff\xe0' + body[4:]
+    return body
+
+
+class FakeSTAC:
+    """
+    Threaded fake STAC API + asset host.
+
+    `start()` binds (port 0 picks a free port) and returns the base URL;
+    `stats()` counts requests by kind so benchmarks can see upstream load.
+    """
+
+    def __init__(self, items=DEFAULT_ITEMS, seed=DEFAULT_SEED, latency=DEFAULT_LATENCY, jitter=DEFAULT_JITTER,
+                 asset_latency=DEFAULT_ASSET_LATENCY, quicklook_bytes=QUICKLOOK_BYTES,
+                 download_bytes=DOWNLOAD_BYTES, error_rate=0.0, search_error_rate=0.0, tail_rate=0.0,
+                 tail_latency=DEFAULT_TAIL_LATENCY, sort=True, host='127.0.0.1', port=0):
+        self.item_count = items
+        self.seed = seed
+        self.latency = latency
+        self.jitter = jitter
+        self.asset_latency = asset_latency
+        self.quicklook_bytes = quicklook_bytes
+        self.download_bytes = download_bytes
+        self.error_rate = error_rate
+        self.search_error_rate = search_error_rate
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.sort = sort                 # False: no sort extension, results in a shuffled order
+        self.outage = False
+        self.items = []
+        self._lock = threading.Lock()
+        self.counts = {'landing': 0, 'search': 0, 'quicklook': 0, 'download': 0, 'not_modified': 0, 'not_found': 0,
+                       'injected_errors': 0, 'tail_delays': 0, 'outage_rejects': 0}
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self.url = f"http://{host}:{self._server.server_address[1]}/"
+        self._thread = None
+
+    def _load_items(self):
+        self.items = make_items(self.item_count, self.seed, self.url)
+        if not self.sort:
+            random.Random(self.seed).shuffle(self.items)
+
+    def start(self):
+        self._load_items()
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-stac', daemon=True)
+        self._thread.start()
+        return self.url
+
+    def serve_forever(self):
+        self._load_items()
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+    def _count(self, kind):
+        with self._lock:
+            self.counts[kind] += 1
+
+    def _sleep(self, base):
+        delay = base + random.uniform(-self.jitter, self.jitter) if base else 0
+        if self.tail_rate and random.random() < self.tail_rate:
+            self._count('tail_delays')
+            delay = max(delay, 0) + self.tail_latency
+        if delay > 0:
+            time.sleep(delay)
+
+    def _fault(self, search=False):
+        """Status code to fail this request with (outage, or an injected search error), or None"""
+        if self.outage:
+            self._count('outage_rejects')
+            return 503
+        if search and self.search_error_rate and random.random() < self.search_error_rate:
+            self._count('injected_errors')
+            return random.choice((500, 502, 503))
+        return None
+
+    def landing(self):
+        return {
+            'type': 'Catalog',
+            'id': 'fake-enmap-stac',
+            'stac_version': '1.0.0',
+            'description': 'Fake EnMAP STAC API for benchmarks',
+            'conformsTo': [
+                'https://api.stacspec.org/v1.0.0/core',
+                'https://api.stacspec.org/v1.0.0/item-search',
+                'https://api.stacspec.org/v1.0.0/collections',
+            ] + (['https://api.stacspec.org/v1.0.0/item-search#sort'] if self.sort else []),
+            'links': [
+                {'rel': 'self', 'href': self.url, 'type': 'application/json'},
+                {'rel': 'root', 'href': self.url, 'type': 'application/json'},
+                {'rel': 'search', 'href': self.url + 'search', 'type': 'application/geo+json', 'method': 'GET'},
+                {'rel': 'search', 'href': self.url + 'search', 'type': 'application/geo+json', 'method': 'POST'},
+            ],
+        }
+
+    def search(self, params, method):
+        """Filter, page and wrap items as a FeatureCollection"""
+        bbox = params.get('bbox')
+        if isinstance(bbox, str):
+            bbox = [float(v) for v in bbox.split(',')]
+        collections = params.get('collections')
+        if isinstance(collections, str):
+            collections = collections.split(',')
+        start, end = normalize_datetime_range(params.get('datetime'))
+        limit = min(int(params.get('limit') or 10), MAX_LIMIT)
+        token = int(params.get('token') or 0)
+
+        matched = []
+        if not collections or COLLECTION in collections:
+            for item in self.items:
+                item_bbox, timestamp = item['_range']
+                if bbox and not (item_bbox[0] <= bbox[2] and item_bbox[2] >= bbox[0] and
+                                 item_bbox[1] <= bbox[3] and item_bbox[3] >= bbox[1]):
+                    continue
+                if (start is not None and timestamp < start) or (end is not None and timestamp > end):
+                    continue
+                matched.append(item)
+        if self.sort and _sort_ascending(params.get('sortby')):
+            matched.reverse()
+
+        page = [{k: v for k, v in item.items() if k != '_range'} for item in matched[token:token + limit]]
+        links = []
+        if token + limit < len(matched):
+            if method == 'POST':
+                links.append({'rel': 'next', 'href': self.url + 'search', 'method': 'POST',
+                              'body': {'token': token + limit}, 'merge': True})
+            else:
+                query = {k: v for k, v in params.items() if v is not None}
+                query.update({'token': token + limit, 'limit': limit})
+                if isinstance(query.get('bbox'), list):
+                    query['bbox'] = ','.join(str(v) for v in query['bbox'])
+                if isinstance(query.get('collections'), list):
+                    query['collections'] = ','.join(query['collections'])
+                links.append({'rel': 'next', 'href': self.url + 'search?' + urlencode(query), 'method': 'GET'})
+        return {
+            'type': 'FeatureCollection',
+            'features': page,
+            'links': links,
+            'numberMatched': len(matched),
+            'numberReturned': len(page),
+        }
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, content_type='application/json', headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.wfile.write(body)
+
+            def _json(self, obj):
+                self._send(200, json.dumps(obj).encode('utf-8'), 'application/geo+json')
+
+            def _failed(self, search=False):
+                """Send an injected failure if there is one; True when the request is done"""
+                status = fake._fault(search)
+                if status is None:
+                    return False
+                self._send(status, b'{"error": "injected"}')
+                return True
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                if parsed.path in ('', '/'):
+                    fake._count('landing')
+                    fake._sleep(fake.latency)
+                    if self._failed():
+                        return
+                    return self._json(fake.landing())
+                if parsed.path == '/search':
+                    fake._count('search')
+                    fake._sleep(fake.latency)
+                    if self._failed(search=True):
+                        return
+                    params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+                    return self._json(fake.search(params, 'GET'))
+                if parsed.path.startswith('/ENMAP/files/'):
+                    return self._asset(parsed.path)
+                fake._count('not_found')
+                self._send(404, b'{"error": "not found"}')
+
+            do_HEAD = do_GET
+
+            def do_POST(self):
+                if urlparse(self.path).path != '/search':
+                    fake._count('not_found')
+                    return self._send(404, b'{"error": "not found"}')
+                fake._count('search')
+                fake._sleep(fake.latency)
+                length = int(self.headers.get('Content-Length') or 0)
+                params = json.loads(self.rfile.read(length) or b'{}')
+                if self._failed(search=True):
+                    return
+                return self._json(fake.search(params, 'POST'))
+
+            def _asset(self, path):
+                quicklook = path.endswith('.jpg')
+                fake._count('quicklook' if quicklook else 'download')
+                fake._sleep(fake.asset_latency)
+                if self._failed():
+                    return
+                body = _file_body(path, fake.quicklook_bytes if quicklook else fake.download_bytes)
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                if self.headers.get('If-None-Match') == etag:
+                    fake._count('not_modified')
+                    return self._send(304, b'', headers={'ETag': etag})
+                headers = {'ETag': etag, 'Accept-Ranges': 'bytes'}
+                content_type = 'image/jpeg' if quicklook else 'application/octet-stream'
+                range_header = self.headers.get('Range', '')
+                status, first = 200, 0
+                if range_header.startswith('bytes='):
+                    first, _, last = range_header[6:].partition('-')
+                    first = int(first or 0)
+                    last = min(int(last) if last else len(body) - 1, len(body) - 1)
+                    if first >= len(body):
+                        return self._send(416, b'', headers={'Content-Range': f'bytes */{len(body)}'})
+                    headers['Content-Range'] = f'bytes {first}-{last}/{len(body)}'
+                    status, body = 206, body[first:last + 1]
+                if fake.error_rate and random.random() < fake.error_rate:
+                    fake._count('injected_errors')
+                    if random.random() < 0.5 or quicklook:
+                        return self._send(503, b'{"error": "injected"}')
+                    return self._truncated(status, body, content_type, headers)
+                return self._send(status, body, content_type, headers)
+
+            def _truncated(self, status, body, content_type, headers):
+                """Announce the full body but close the connection halfway through it"""
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body[:len(body) // 2])
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake EnMAP STAC API and asset host")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--items', type=int, default=DEFAULT_ITEMS, help='Synthetic scenes (default: 5000)')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--latency', type=float, default=DEFAULT_LATENCY * 1000, help='STAC latency in ms (default: 50)')
+    parser.add_argument('--jitter', type=float, default=DEFAULT_JITTER * 1000, help='+/- latency jitter in ms (default: 20)')
+    parser.add_argument('--asset-latency', type=float, default=DEFAULT_ASSET_LATENCY * 1000,
+                        help='Quicklook/download latency in ms (default: 30)')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of file requests that fail with 503 or a truncated body (default: 0)')
+    parser.add_argument('--search-error-rate', type=float, default=0.0,
+                        help='Fraction of STAC searches that fail with 500/502/503 (default: 0)')
+    parser.add_argument('--tail-rate', type=float, default=0.0,
+                        help='Fraction of STAC and file requests delayed by --tail-latency (default: 0)')
+    parser.add_argument('--tail-latency', type=float, default=DEFAULT_TAIL_LATENCY * 1000,
+                        help='Extra delay of the slow tail in ms (default: 2000)')
+    parser.add_argument('--unsorted', action='store_true',
+                        help='Drop the sort extension and return results in a shuffled order')
+    args = parser.parse_args()
+
+    fake = FakeSTAC(args.items, args.seed, args.latency / 1000, args.jitter / 1000, args.asset_latency / 1000,
+                    error_rate=args.error_rate, search_error_rate=args.search_error_rate,
+                    tail_rate=args.tail_rate, tail_latency=args.tail_latency / 1000,
+                    sort=not args.unsorted, host=args.host, port=args.port)
+    print(f"🛰️  Fake STAC API with {args.items} scenes at {fake.url} "
+          f"({args.latency:.0f}±{args.jitter:.0f} ms)", flush=True)
+    try:
+        fake.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+EnMAP Footprint Coverage
+Exact intersection of scene footprints with rectangular AOIs. STAC bbox
+searches return every scene whose bbox touches the AOI; EnMAP swaths are
+narrow and rotated, so this computes how much of each AOI a footprint really
+covers. All AOI x footprint pairs are clipped at once with numpy.
+"""
+
+import numpy as np
+
+
+def footprint_rings(geometry, bbox=None):
+    """
+    [(ring, sign)] for a GeoJSON Polygon/MultiPolygon: outer rings count +1,
+    holes -1. Falls back to the bbox rectangle when there is no geometry.
+    """
+    polygons = []
+    if geometry and geometry.get('type') == 'Polygon':
+        polygons = [geometry.get('coordinates') or []]
+    elif geometry and geometry.get('type') == 'MultiPolygon':
+        polygons = geometry.get('coordinates') or []
+
+    rings = []
+    for polygon in polygons:
+        for n, ring in enumerate(polygon):
+            points = np.asarray(ring, dtype=np.float64)
+            if points.ndim != 2 or len(points) < 3:
+                continue
+            points = points[:, :2]
+            if len(points) > 3 and np.array_equal(points[0], points[-1]):
+                points = points[:-1]
+            rings.append((points, 1.0 if n == 0 else -1.0))
+
+    if not rings and bbox:
+        w, s, e, n = bbox[:4]
+        rings.append((np.array([[w, s], [e, s], [e, n], [w, n]], dtype=np.float64), 1.0))
+    return rings
+
+
+def _next_index(counts, width):
+    """Index of the following vertex in each ring (wrapping at the ring's own length)"""
+    idx = np.arange(width)[None, :] + 1
+    return np.where(idx < counts[:, None], idx, 0)
+
+
+def _shoelace(points, counts):
+    """Absolute area of each padded ring"""
+    width = points.shape[1]
+    if width == 0:
+        return np.zeros(len(points))
+    nxt = np.take_along_axis(points, _next_index(counts, width)[:, :, None], axis=1)
+    valid = np.arange(width)[None, :] < counts[:, None]
+    cross = points[:, :, 0] * nxt[:, :, 1] - nxt[:, :, 0] * points[:, :, 1]
+    return np.abs(np.where(valid, cross, 0.0).sum(axis=1)) / 2
+
+
+def clipped_areas(points, counts, boxes):
+    """
+    Area of each ring inside its box: Sutherland-Hodgman against the four box
+    edges, vectorized over rings. `points` is (R, V, 2) padded, `counts` (R,)
+    vertices per ring and `boxes` (R, 4) as [west, south, east, north].
+    """
+    # (axis, box column, side): keep x >= west, x <= east, y >= south, y <= north
+    for axis, column, side in ((0, 0, 1.0), (0, 2, -1.0), (1, 1, 1.0), (1, 3, -1.0)):
+        width = points.shape[1]
+        if width == 0:
+            break
+        valid = np.arange(width)[None, :] < counts[:, None]
+        end = np.take_along_axis(points, _next_index(counts, width)[:, :, None], axis=1)
+        limit = boxes[:, column][:, None]
+        d_start = (points[:, :, axis] - limit) * side
+        d_end = (end[:, :, axis] - limit) * side
+        start_in, end_in = d_start >= 0, d_end >= 0
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(start_in != end_in, d_start / (d_start - d_end), 0.0)
+        crossing = points + t[:, :, None] * (end - points)
+
+        # Each edge emits its crossing point (if it crosses) and then its end point (if inside)
+        out = np.stack([crossing, end], axis=2).reshape(len(points), width * 2, 2)
+        keep = np.stack([valid & (start_in != end_in), valid & end_in], axis=2).reshape(len(points), width * 2)
+        order = np.argsort(~keep, axis=1, kind='stable')
+        counts = keep.sum(axis=1)
+        width = int(counts.max()) if len(counts) else 0
+        points = np.take_along_axis(out, order[:, :width, None], axis=1)
+
+    areas = _shoelace(points, counts)
+    areas[counts < 3] = 0.0
+    return areas
+
+
+def coverage_pairs(aoi_bboxes, footprints):
+    """
+    Fraction (0-1) of each AOI covered by the paired footprint.
+
+    `aoi_bboxes[i]` is [west, south, east, north] (west > east crosses the
+    antimeridian) and `footprints[i]` is (geometry, bbox). Areas are planar in
+    degrees, which is accurate for AOIs a few degrees across. Returns NaN
+    where the footprint is unknown or the AOI has no area.
+    """
+    pair_ids, ring_list, signs = [], [], []
+    for i, (geometry, bbox) in enumerate(footprints):
+        for ring, sign in footprint_rings(geometry, bbox):
+            pair_ids.append(i)
+            ring_list.append(ring)
+            signs.append(sign)
+
+    boxes = np.asarray(aoi_bboxes, dtype=np.float64).reshape(-1, 4).copy()
+    crosses = boxes[:, 0] > boxes[:, 2]
+    boxes[crosses, 2] += 360.0
+    aoi_area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    covered = np.zeros(len(boxes))
+
+    if ring_list:
+        pair_ids = np.asarray(pair_ids)
+        counts = np.array([len(ring) for ring in ring_list])
+        points = np.zeros((len(ring_list), counts.max(), 2))
+        for r, ring in enumerate(ring_list):
+            points[r, :len(ring)] = ring
+        # Footprints east of the antimeridian move to 180..360 for crossing AOIs
+        shift = crosses[pair_ids][:, None] & (points[:, :, 0] < 0)
+        points[:, :, 0] += np.where(shift, 360.0, 0.0)
+
+        areas = clipped_areas(points, counts, boxes[pair_ids]) * np.asarray(signs)
+        covered = np.bincount(pair_ids, weights=areas, minlength=len(boxes))
+
+    known = np.zeros(len(boxes), dtype=bool)
+    if ring_list:
+        known[np.unique(pair_ids)] = True
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fractions = np.clip(covered / aoi_area, 0.0, 1.0)
+    fractions[~known | (aoi_area <= 0)] = np.nan
+    return fractions
+
+
+def coverage_fractions(aoi_bbox, footprints):
+    """Coverage of one AOI by each of `footprints` [(geometry, bbox)]"""
+    return coverage_pairs([aoi_bbox] * len(footprints), footprints)
+
+
+def coverage_percent(fraction):
+    """Rounded percentage for results, or None when unknown"""
+    return None if fraction != fraction else round(fraction * 100, 1)
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+EnMAP Footprint Index
+Local mirror of ENMAP_HSI_L2A scene metadata in a packed STR tree over numpy
+arrays, synced incrementally from the STAC API, for bbox + time searches that
+do not need a remote round-trip.
+"""
+
+import argparse
+import json
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from stac_session import STAC_URL, get_manager
+from upstream_client import operation
+
+
+# Configuration
+COLLECTION = "ENMAP_HSI_L2A"
+NODE_CAPACITY = 16               # Entries per STR tree node
+SYNC_PAGE_SIZE = 250             # Items per STAC page while syncing
+SYNC_OVERLAP = timedelta(days=2) # Re-read window when syncing by acquisition datetime
+FORMAT_VERSION = 1
+
+
+def _to_epoch(value):
+    if value is None:
+        return math.nan
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _to_iso(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def record_from_item(item):
+    """Extract the fields the index keeps from a pystac Item"""
+    dt = item.datetime or item.properties.get('start_datetime')
+    cloud = item.properties.get('eo:cloud_cover')
+    return {
+        'id': item.id,
+        'datetime': _to_epoch(dt),
+        'updated': _to_epoch(item.properties.get('updated')),
+        'cloud_cover': math.nan if cloud is None else float(cloud),
+        'bbox': list(item.bbox) if item.bbox else None,
+        'geometry': item.geometry,
+        'assets': {name: asset.href for name, asset in item.assets.items()},
+    }
+
+
+def _bbox_2d(bbox):
+    """Drop the z range from a 3D STAC bbox"""
+    if len(bbox) == 6:
+        return [bbox[0], bbox[1], bbox[3], bbox[4]]
+    return list(bbox[:4])
+
+
+def _str_order(bboxes, capacity):
+    """Sort-Tile-Recursive ordering: x-sorted vertical slices, each sorted by y"""
+    n = len(bboxes)
+    cx = (bboxes[:, 0] + bboxes[:, 2]) * 0.5
+    cy = (bboxes[:, 1] + bboxes[:, 3]) * 0.5
+    leaves = math.ceil(n / capacity)
+    slice_size = math.ceil(math.sqrt(leaves)) * capacity
+    order = np.argsort(cx, kind='stable')
+    for start in range(0, n, slice_size):
+        segment = order[start:start + slice_size]
+        order[start:start + slice_size] = segment[np.argsort(cy[segment], kind='stable')]
+    return order
+
+
+def _pack_level(boxes, capacity):
+    """Bounding boxes of consecutive groups of `capacity` boxes"""
+    starts = np.arange(0, len(boxes), capacity)
+    return np.column_stack([
+        np.minimum.reduceat(boxes[:, 0], starts),
+        np.minimum.reduceat(boxes[:, 1], starts),
+        np.maximum.reduceat(boxes[:, 2], starts),
+        np.maximum.reduceat(boxes[:, 3], starts),
+    ])
+
+
+def _intersects(boxes, bbox):
+    return ((boxes[:, 0] <= bbox[2]) & (boxes[:, 2] >= bbox[0]) &
+            (boxes[:, 1] <= bbox[3]) & (boxes[:, 3] >= bbox[1]))
+
+
+class _IndexState:
+    """Immutable snapshot of the index arrays; swapped atomically on sync"""
+
+    __slots__ = ('ids', 'bboxes', 'times', 'updated', 'cloud', 'details', 'order', 'levels')
+
+    def __init__(self, ids, bboxes, times, updated, cloud, details, capacity):
+        self.ids = ids
+        self.bboxes = bboxes
+        self.times = times
+        self.updated = updated
+        self.cloud = cloud
+        self.details = details
+
+        if len(ids) == 0:
+            self.order = np.zeros(0, dtype=np.int64)
+            self.levels = []
+            return
+
+        self.order = _str_order(bboxes, capacity)
+        # levels[0] holds the leaf boxes in tree order; each level above packs the one below
+        levels = [bboxes[self.order]]
+        while len(levels[-1]) > capacity:
+            levels.append(_pack_level(levels[-1], capacity))
+        self.levels = levels
+
+
+class FootprintIndex:
+    """
+    Array-backed spatial index of scene footprints.
+
+    Scene ids, bboxes, times and cloud cover live in numpy arrays; footprint
+    geometry and asset hrefs are kept alongside for result formatting. Searches
+    walk the packed STR tree level by level with vectorized bbox tests.
+    """
+
+    def __init__(self, collection=COLLECTION, capacity=NODE_CAPACITY):
+        if np is None:
+            raise ImportError("numpy is not installed")
+        self.collection = collection
+        self.capacity = capacity
+        self.last_sync = None
+        self._lock = threading.Lock()
+        self._state = self._build([])
+
+    def __len__(self):
+        return len(self._state.ids)
+
+    def _build(self, records):
+        records = [r for r in records if r.get('bbox')]
+        return _IndexState(
+            ids=np.array([r['id'] for r in records], dtype=str),
+            bboxes=np.array([_bbox_2d(r['bbox']) for r in records], dtype=np.float64).reshape(-1, 4),
+            times=np.array([r['datetime'] for r in records], dtype=np.float64),
+            updated=np.array([r['updated'] for r in records], dtype=np.float64),
+            cloud=np.array([r['cloud_cover'] for r in records], dtype=np.float32),
+            details=[{'geometry': r.get('geometry'), 'assets': r.get('assets') or {}} for r in records],
+            capacity=self.capacity,
+        )
+
+    def records(self):
+        """All indexed scenes as record dicts"""
+        state = self._state
+        return [self._record(state, i) for i in range(len(state.ids))]
+
+    @staticmethod
+    def _record(state, i):
+        return {
+            'id': str(state.ids[i]),
+            'datetime': float(state.times[i]),
+            'updated': float(state.updated[i]),
+            'cloud_cover': float(state.cloud[i]),
+            'bbox': state.bboxes[i].tolist(),
+            'geometry': state.details[i]['geometry'],
+            'assets': state.details[i]['assets'],
+        }
+
+    def upsert(self, new_records):
+        """Insert or replace records by scene id and rebuild the tree"""
+        with self._lock:
+            merged = {r['id']: r for r in self.records()}
+            for record in new_records:
+                merged[record['id']] = record
+            self._state = self._build(list(merged.values()))
+
+    def search_indices(self, bbox, start=None, end=None):
+        """Row numbers of scenes whose bbox intersects `bbox` within [start, end] (epoch seconds)"""
+        return self._search_indices(self._state, bbox, start, end)
+
+    def _search_indices(self, state, bbox, start, end):
+        """search_indices over one state snapshot (a sync may swap self._state meanwhile)"""
+        if not state.levels:
+            return np.zeros(0, dtype=np.int64)
+
+        bbox = np.asarray(bbox, dtype=np.float64)
+        levels = state.levels
+        top = len(levels) - 1
+        candidates = np.flatnonzero(_intersects(levels[top], bbox))
+        for level in range(top, 0, -1):
+            children = (candidates[:, None] * self.capacity + np.arange(self.capacity)).ravel()
+            children = children[children < len(levels[level - 1])]
+            candidates = children[_intersects(levels[level - 1][children], bbox)]
+
+        rows = state.order[candidates]
+        if start is not None or end is not None:
+            times = state.times[rows]
+            keep = ~np.isnan(times)
+            if start is not None:
+                keep &= times >= start
+            if end is not None:
+                keep &= times <= end
+            rows = rows[keep]
+        return rows
+
+    def search(self, bbox, start=None, end=None, max_items=100):
+        """Matching scenes as record dicts, newest first, at most `max_items`"""
+        state = self._state
+        rows = self._search_indices(state, bbox, start, end)
+        rows = rows[np.argsort(-state.times[rows], kind='stable')][:max_items]
+        return [self._record(state, i) for i in rows]
+
+    def sync(self, manager=None, full=False, page_size=SYNC_PAGE_SIZE):
+        """
+        Pull new or changed scenes from the STAC API.
+
+        Uses a CQL2 filter on `updated` when the API supports filtering and the
+        index already has update times; otherwise re-reads acquisitions from
+        shortly before the newest indexed datetime. Returns the number of
+        records received.
+        """
+        manager = manager or get_manager(STAC_URL)
+        state = self._state
+        kwargs = {'collections': [self.collection], 'limit': page_size}
+
+        if not full and len(state.ids):
+            catalog = manager.get_catalog()
+            max_updated = np.nanmax(state.updated) if not np.isnan(state.updated).all() else None
+            if max_updated is not None and _supports_filter(catalog):
+                kwargs['filter'] = {'op': '>', 'args': [{'property': 'updated'}, _to_iso(max_updated)]}
+                kwargs['filter_lang'] = 'cql2-json'
+            elif not np.isnan(state.times).all():
+                since = datetime.fromtimestamp(np.nanmax(state.times), timezone.utc) - SYNC_OVERLAP
+                kwargs['datetime'] = f"{since.strftime('%Y-%m-%dT%H:%M:%SZ')}/.."
+
+        try:
+            with operation('stac_search'):
+                new_records = [record_from_item(item) for item in manager.search(**kwargs).items()]
+        except Exception:
+            manager.invalidate()
+            raise
+
+        self.upsert(new_records)
+        self.last_sync = time.time()
+        return len(new_records)
+
+    def stats(self):
+        state = self._state
+        return {
+            'collection': self.collection,
+            'scenes': len(state.ids),
+            'tree_levels': len(state.levels),
+            'last_sync': _to_iso(self.last_sync) if self.last_sync else None,
+            'newest_scene': _to_iso(np.nanmax(state.times)) if not np.isnan(state.times).all() else None,
+        }
+
+    def save(self, path):
+        """Write the index to a .npz file atomically (a crash never leaves a half-written file)"""
+        state = self._state
+        meta = {
+            'version': FORMAT_VERSION,
+            'collection': self.collection,
+            'capacity': self.capacity,
+            'last_sync': self.last_sync,
+            'details': state.details,
+        }
+        path = Path(path)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                ids=state.ids,
+                bboxes=state.bboxes,
+                times=state.times,
+                updated=state.updated,
+                cloud=state.cloud,
+                meta=np.frombuffer(json.dumps(meta).encode('utf-8'), dtype=np.uint8),
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read an index written by `save`"""
+        with np.load(path) as data:
+            meta = json.loads(data['meta'].tobytes().decode('utf-8'))
+            index = cls(meta['collection'], meta['capacity'])
+            index.last_sync = meta.get('last_sync')
+            records = [{
+                'id': scene_id,
+                'datetime': t,
+                'updated': u,
+                'cloud_cover': c,
+                'bbox': list(b),
+                'geometry': d['geometry'],
+                'assets': d['assets'],
+            } for scene_id, b, t, u, c, d in zip(
+                data['ids'].tolist(), data['bboxes'].tolist(), data['times'].tolist(),
+                data['updated'].tolist(), data['cloud'].tolist(), meta['details'])]
+        index._state = index._build(records)
+        return index
+
+
+def _supports_filter(catalog):
+    try:
+        return catalog.conforms_to('FILTER')
+    except Exception:
+        return False
+
+
+def to_pystac_item(record, collection=COLLECTION):
+    """Rebuild a minimal pystac Item from an index record (for CLI printing/export)"""
+    import pystac
+
+    dt = None if math.isnan(record['datetime']) else datetime.fromtimestamp(record['datetime'], timezone.utc)
+    properties = {}
+    if not math.isnan(record['cloud_cover']):
+        properties['eo:cloud_cover'] = record['cloud_cover']
+    item = pystac.Item(
+        id=record['id'],
+        geometry=record['geometry'],
+        bbox=record['bbox'],
+        datetime=dt,
+        properties=properties,
+        collection=collection,
+    )
+    for name, href in record['assets'].items():
+        item.add_asset(name, pystac.Asset(href=href))
+    return item
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build, sync and benchmark the local EnMAP footprint index")
+    parser.add_argument('command', choices=['sync', 'stats', 'bench'])
+    parser.add_argument('index', help='Path to the .npz index file')
+    parser.add_argument('--stac-url', default=STAC_URL, help='STAC API root (e.g. a local fake server)')
+    parser.add_argument('--full', action='store_true', help='Re-download the whole collection')
+    parser.add_argument('--queries', type=int, default=10000, help='Random bbox queries for bench')
+    args = parser.parse_args()
+
+    try:
+        index = FootprintIndex.load(args.index)
+    except FileNotFoundError:
+        index = FootprintIndex()
+
+    if args.command == 'sync':
+        t0 = time.perf_counter()
+        received = index.sync(get_manager(args.stac_url), full=args.full)
+        elapsed = time.perf_counter() - t0
+        index.save(args.index)
+        print(f"✅ Synced {received} scenes in {elapsed:.2f}s ({len(index)} indexed)")
+
+    elif args.command == 'stats':
+        print(json.dumps(index.stats(), indent=2))
+
+    elif args.command == 'bench':
+        if not len(index):
+            print("❌ Index is empty; run sync first")
+            return
+        records = index.records()
+        t0 = time.perf_counter()
+        index._build(records)
+        build = time.perf_counter() - t0
+
+        rng = np.random.default_rng(0)
+        bboxes = index._state.bboxes
+        picks = bboxes[rng.integers(0, len(bboxes), args.queries)]
+        t0 = time.perf_counter()
+        hits = 0
+        for b in picks:
+            hits += len(index.search_indices(b))
+        elapsed = time.perf_counter() - t0
+        print(json.dumps({
+            'scenes': len(records),
+            'build_seconds': round(build, 4),
+            'queries': args.queries,
+            'query_us': round(elapsed / args.queries * 1e6, 2),
+            'queries_per_second': round(args.queries / elapsed, 1),
+            'mean_hits': round(hits / args.queries, 2),
+        }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+EnMAP Metrics
+Minimal in-process counters and latency histograms, rendered in the
+Prometheus text format by /api/metrics and summarized by
+`enmap_query.py --timings`. Observing a value is a lock, a bisect and two
+additions, cheap enough to leave on in production. Stage timings are also
+passed to the current request's trace (profiling.py) when there is one.
+"""
+
+import contextvars
+import sys
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+
+# Configuration
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000, 10000)
+BYTE_BUCKETS = tuple(1024 * 4 ** i for i in range(10))        # 1 KiB .. 256 MiB
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    """Fixed-bucket histogram with optional labels"""
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS, labels=()):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self._series = {}            # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the block in seconds"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        """{label values: (cumulative bucket counts, sum, count)}"""
+        with self._lock:
+            series = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        result = {}
+        for key, (counts, total, count) in series.items():
+            running, cumulative = 0, []
+            for c in counts:
+                running += c
+                cumulative.append(running)
+            result[key] = (cumulative, total, count)
+        return result
+
+    def quantile(self, q, cumulative, count):
+        """Upper bucket bound holding quantile `q` (what Prometheus' histogram_quantile approximates)"""
+        target = q * count
+        for bound, seen in zip(self.buckets + (float('inf'),), cumulative):
+            if seen >= target:
+                return bound
+        return float('inf')
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        for key, (cumulative, total, count) in sorted(self.snapshot().items()):
+            for bound, seen in zip(self.buckets + (float('inf'),), cumulative):
+                le = 'le="' + _format_value(bound if bound == float('inf') else float(bound)) + '"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, le)} {seen}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {count}')
+        return lines
+
+
+class Gauge:
+    """Gauge whose samples are read from a callback at render time"""
+
+    def __init__(self, name, help_text, labels, callback):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.callback = callback        # returns {label values tuple: value}
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} gauge']
+        for key, value in sorted(self.callback().items()):
+            if value is not None:
+                lines.append(f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS, labels=()):
+        return self.register(Histogram(name, help_text, buckets, labels))
+
+    def gauge(self, name, help_text, labels, callback):
+        return self.register(Gauge(name, help_text, labels, callback))
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.histogram(
+    'enmap_stage_seconds', 'Latency of each query stage', labels=('stage',))
+QUERY_ITEMS = REGISTRY.histogram(
+    'enmap_query_items', 'Items returned per query', COUNT_BUCKETS, labels=('source',))
+ERRORS = REGISTRY.counter(
+    'enmap_errors_total', 'Errors by exception type', labels=('type',))
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Per-request stage trace (profiling.RequestTrace), set while a traced request runs
+_stage_trace = contextvars.ContextVar('enmap_stage_trace', default=None)
+
+
+def trace_stages(trace):
+    """Also pass stages observed in this context to `trace.add(stage, seconds)`; returns a reset token"""
+    return _stage_trace.set(trace)
+
+
+def untrace_stages(token):
+    _stage_trace.reset(token)
+
+
+def observe_stage(stage, seconds):
+    """Record `seconds` of `stage` in enmap_stage_seconds and the current trace"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    trace = _stage_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+@contextmanager
+def timed(stage):
+    """Context manager observing the block as `stage` in enmap_stage_seconds"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def count_error(error):
+    ERRORS.inc(type=type(error).__name__)
+
+
+def print_timings(file=sys.stderr):
+    """Print a per-stage latency table from enmap_stage_seconds"""
+    snapshot = STAGE_SECONDS.snapshot()
+    if not snapshot:
+        return
+    print(f"\n⏱️  {'Stage':<20} {'Count':>7} {'Total s':>9} {'Mean ms':>9} {'p50 ≤ms':>9} {'p95 ≤ms':>9}", file=file)
+    for (stage,), (cumulative, total, count) in sorted(snapshot.items(), key=lambda kv: -kv[1][1]):
+        p50 = STAGE_SECONDS.quantile(0.5, cumulative, count) * 1000
+        p95 = STAGE_SECONDS.quantile(0.95, cumulative, count) * 1000
+        print(f"   {stage:<20} {count:>7} {total:>9.3f} {total / count * 1000:>9.1f} {p50:>9.0f} {p95:>9.0f}", file=file)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+EnMAP Preview Prefetcher
+Warms the preview cache in the background with the quicklooks of scenes a
+query just returned, so opening a preview does not pay the DLR round-trip.
+"""
+
+import itertools
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+# Configuration
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_QUEUE = 500          # Pending URLs across all jobs; extra URLs are dropped
+MAX_JOBS = 256                   # Job records kept for cancellation
+TRACK_LIMIT = 5000               # Prefetched URLs remembered for hit/waste accounting
+WASTE_AFTER = 3600               # Seconds before an unrequested prefetch counts as wasted
+
+
+class _Job:
+    __slots__ = ('id', 'created', 'cancelled', 'queued', 'done')
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex[:12]
+        self.created = time.time()
+        self.cancelled = False
+        self.queued = 0
+        self.done = 0
+
+
+class PreviewPrefetcher:
+    """
+    Bounded background prefetch into a PreviewCache.
+
+    URLs are queued with their result rank, so the top results of every job
+    are fetched first. A small pool of daemon workers drains the queue.
+    Jobs can be cancelled, and their remaining URLs are then skipped.
+    """
+
+    def __init__(self, cache, workers=DEFAULT_WORKERS, max_queue=DEFAULT_MAX_QUEUE):
+        self.cache = cache
+        self.workers = workers
+        self._queue = queue.PriorityQueue(maxsize=max_queue)
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._tracked = OrderedDict()       # url -> time prefetched, until requested or wasted
+        self._threads = []
+        self.counts = {'queued': 0, 'dropped': 0, 'prefetched': 0, 'already_cached': 0,
+                       'failed': 0, 'cancelled': 0, 'hits': 0, 'wasted': 0}
+
+    def new_job(self):
+        """Register a prefetch job and return its id"""
+        job = _Job()
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > MAX_JOBS:
+                self._jobs.popitem(last=False)
+        self._ensure_workers()
+        return job.id
+
+    def enqueue(self, job_id, urls, start_rank=0):
+        """Queue `urls` (best-ranked first) for job `job_id`; returns how many were queued"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or job.cancelled:
+            return 0
+
+        queued = 0
+        for rank, url in enumerate(urls, start=start_rank):
+            if not url:
+                continue
+            try:
+                self._queue.put_nowait((rank, next(self._seq), job, url))
+            except queue.Full:
+                with self._lock:
+                    self.counts['dropped'] += 1
+                continue
+            queued += 1
+        with self._lock:
+            job.queued += queued
+            self.counts['queued'] += queued
+        return queued
+
+    def cancel(self, job_id):
+        """Stop fetching the remaining URLs of a job"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return False
+            job.cancelled = True
+            return True
+
+    def note_request(self, url):
+        """Record that a user asked for `url`; counts a hit if it was prefetched"""
+        with self._lock:
+            if self._tracked.pop(url, None) is not None:
+                self.counts['hits'] += 1
+                return True
+            return False
+
+    def _ensure_workers(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            for i in range(self.workers - len(self._threads)):
+                thread = threading.Thread(target=self._run, name=f'enmap-prefetch-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            _, _, job, url = self._queue.get()
+            try:
+                if job.cancelled:
+                    with self._lock:
+                        self.counts['cancelled'] += 1
+                    continue
+                if self.cache.is_cached(url):
+                    with self._lock:
+                        self.counts['already_cached'] += 1
+                    continue
+                try:
+                    self.cache.warm(url)
+                except Exception:
+                    with self._lock:
+                        self.counts['failed'] += 1
+                    continue
+                with self._lock:
+                    self.counts['prefetched'] += 1
+                    self._track_locked(url)
+            finally:
+                with self._lock:
+                    job.done += 1
+                self._queue.task_done()
+
+    def _track_locked(self, url):
+        now = time.time()
+        self._tracked[url] = now
+        self._tracked.move_to_end(url)
+        while self._tracked:
+            oldest_url, fetched = next(iter(self._tracked.items()))
+            if len(self._tracked) <= TRACK_LIMIT and now - fetched <= WASTE_AFTER:
+                break
+            del self._tracked[oldest_url]
+            self.counts['wasted'] += 1
+
+    def job_status(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return {'id': job.id, 'queued': job.queued, 'done': job.done, 'cancelled': job.cancelled}
+
+    def stats(self):
+        with self._lock:
+            used = self.counts['hits'] + self.counts['wasted']
+            return {
+                'workers': self.workers,
+                'pending': self._queue.qsize(),
+                'unrequested': len(self._tracked),
+                'hit_ratio': round(self.counts['hits'] / used, 3) if used else None,
+                **self.counts,
+            }
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+EnMAP Preview Cache
+Content-addressed cache for quicklook images behind /api/preview: a small
+in-memory hot tier, a size-bounded on-disk LRU tier, single-flight fetching
+and conditional revalidation against the upstream server.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from pathlib import Path
+
+from metrics import timed
+from single_flight import SingleFlight
+from upstream_client import operation
+
+
+# Configuration
+DEFAULT_CACHE_DIR = Path(tempfile.gettempdir()) / 'enmap_preview_cache'
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024        # Disk tier budget
+DEFAULT_MEMORY_BYTES = 32 * 1024 * 1024      # Hot tier budget
+MEMORY_ITEM_LIMIT = 512 * 1024               # Larger images are only served from disk
+DEFAULT_TTL = 86400                          # Seconds before revalidating upstream
+EVICT_TARGET = 0.9                           # Eviction shrinks the disk tier to this share of max_bytes
+FETCH_TIMEOUT = 10
+CHUNK_SIZE = 64 * 1024
+
+
+class PreviewFetchError(Exception):
+    """Upstream returned a non-200 response"""
+
+    def __init__(self, status_code):
+        super().__init__(f"Failed to fetch preview: {status_code}")
+        self.status_code = status_code
+
+
+class PreviewEntry:
+    """
+    A cached preview: metadata plus either in-memory bytes or a blob path.
+    Entries returned by PreviewCache.get without `body` carry `file`, an open
+    handle on the blob, so eviction cannot remove it from under the caller.
+    """
+
+    __slots__ = ('meta', 'url', 'content_type', 'etag', 'last_modified', 'size', 'digest', 'fetched', 'path', 'body',
+                 'status', 'file')
+
+    def __init__(self, meta, path, body=None, status='miss'):
+        self.meta = meta
+        self.url = meta['url']
+        self.content_type = meta['content_type']
+        self.etag = meta.get('etag')
+        self.last_modified = meta.get('last_modified')
+        self.size = meta['size']
+        self.digest = meta['digest']
+        self.fetched = meta['fetched']
+        self.path = path
+        self.body = body
+        self.status = status
+        self.file = None
+
+    def opened(self):
+        """A copy of this entry with its own open blob handle; raises FileNotFoundError once evicted"""
+        entry = PreviewEntry(self.meta, self.path, status=self.status)
+        entry.file = open(self.path, 'rb')
+        return entry
+
+
+class PreviewCache:
+    """
+    Cache of preview images keyed by URL and stored by content hash.
+
+    Blobs live under `cache_dir/blobs/<sha256>` and per-URL metadata under
+    `cache_dir/meta/<sha256(url)>.json`. Blob mtimes are bumped on every hit
+    so the oldest blobs are evicted first once `max_bytes` is exceeded, along
+    with the metadata pointing at them. A blob evicted between lookup and
+    use is fetched again. Concurrent requests for the same URL share one
+    upstream fetch (single_flight.py). An optional
+    `limiter` (see upstream_limits.py) caps concurrent upstream fetches.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES,
+                 memory_bytes=DEFAULT_MEMORY_BYTES, ttl=DEFAULT_TTL, session_factory=None, limiter=None):
+        self.cache_dir = Path(cache_dir)
+        self.blob_dir = self.cache_dir / 'blobs'
+        self.meta_dir = self.cache_dir / 'meta'
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.meta_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.ttl = ttl
+        self.session_factory = session_factory
+        self.limiter = limiter
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._flights = SingleFlight()
+        self._disk_size = sum(p.stat().st_size for p in self.blob_dir.iterdir() if p.is_file())
+        self.counts = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'revalidated': 0, 'coalesced': 0, 'evicted': 0}
+
+    def get(self, url):
+        """
+        Return a PreviewEntry for `url`, fetching or revalidating upstream as
+        needed. Entries without `body` come with an open `file` the caller closes.
+        """
+        entry = self._get(url)
+        if entry.body is not None:
+            return entry
+        try:
+            return entry.opened()
+        except FileNotFoundError:
+            # Evicted since it was looked up: fetch it again
+            entry = self._fetch_single_flight(url, None)
+            return entry if entry.body is not None else entry.opened()
+
+    def warm(self, url):
+        """Fetch or revalidate `url` into the cache without opening it (prefetching)"""
+        self._get(url)
+
+    def _get(self, url):
+        now = time.time()
+        with self._lock:
+            cached = self._memory.get(url)
+            if cached is not None and now - cached[0]['fetched'] <= self.ttl:
+                self._memory.move_to_end(url)
+                self.counts['memory_hits'] += 1
+                return PreviewEntry(cached[0], self._blob_path(cached[0]['digest']), cached[1], 'memory')
+
+        meta = self._load_meta(url)
+        if meta is not None and now - meta['fetched'] <= self.ttl:
+            path = self._blob_path(meta['digest'])
+            try:
+                os.utime(path)
+            except OSError:
+                # Evicted since the metadata was read: a miss
+                meta = None
+            else:
+                with self._lock:
+                    self.counts['disk_hits'] += 1
+                return PreviewEntry(meta, path, status='disk')
+
+        return self._fetch_single_flight(url, meta)
+
+    def is_cached(self, url):
+        """True if a fresh copy of `url` is in either tier"""
+        now = time.time()
+        with self._lock:
+            cached = self._memory.get(url)
+            if cached is not None and now - cached[0]['fetched'] <= self.ttl:
+                return True
+        meta = self._load_meta(url)
+        return meta is not None and now - meta['fetched'] <= self.ttl
+
+    def _fetch_single_flight(self, url, stale_meta):
+        entry, shared = self._flights.do(url, self._fetch_limited, url, stale_meta)
+        if shared:
+            with self._lock:
+                self.counts['coalesced'] += 1
+        return entry
+
+    def _fetch_limited(self, url, stale_meta):
+        with self.limiter.slot() if self.limiter is not None else nullcontext():
+            with timed('preview_upstream'):
+                return self._fetch(url, stale_meta)
+
+    def _fetch(self, url, stale_meta):
+        """Fetch `url` upstream, sending validators if a stale copy exists"""
+        headers = {}
+        if stale_meta is not None and self._blob_path(stale_meta['digest']).exists():
+            if stale_meta.get('etag'):
+                headers['If-None-Match'] = stale_meta['etag']
+            if stale_meta.get('last_modified'):
+                headers['If-Modified-Since'] = stale_meta['last_modified']
+
+        session = self._session()
+        with operation('preview'):
+            response = session.get(url, headers=headers, timeout=FETCH_TIMEOUT, verify=False, stream=True)
+        with response:
+            if response.status_code == 304 and headers:
+                path = self._blob_path(stale_meta['digest'])
+                try:
+                    os.utime(path)
+                except FileNotFoundError:
+                    # Evicted after the validators were chosen: fetch the body unconditionally
+                    return self._fetch(url, None)
+                stale_meta['fetched'] = time.time()
+                self._save_meta(url, stale_meta)
+                with self._lock:
+                    self.counts['revalidated'] += 1
+                return self._promote(stale_meta, path, 'revalidated')
+
+            if response.status_code != 200:
+                raise PreviewFetchError(response.status_code)
+
+            # Stream to a temp file while hashing, then move into place by digest
+            hasher = hashlib.sha256()
+            size = 0
+            fd, tmp_name = tempfile.mkstemp(dir=self.blob_dir, suffix='.part')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        hasher.update(chunk)
+                        f.write(chunk)
+                        size += len(chunk)
+                digest = hasher.hexdigest()
+                path = self._blob_path(digest)
+                existed = path.exists()
+                os.replace(tmp_name, path)
+            except BaseException:
+                try:
+                    os.unlink(tmp_name)
+                except OSError:
+                    pass
+                raise
+
+            meta = {
+                'url': url,
+                'digest': digest,
+                'size': size,
+                'content_type': response.headers.get('Content-Type', 'image/jpeg'),
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'fetched': time.time(),
+            }
+
+        self._save_meta(url, meta)
+        with self._lock:
+            self.counts['misses'] += 1
+            if not existed:
+                self._disk_size += size
+        entry = self._promote(meta, path, 'miss')
+        self._evict_disk(keep=path)
+        return entry
+
+    def _promote(self, meta, path, status):
+        """Keep small previews in the memory tier as well"""
+        body = None
+        if meta['size'] <= MEMORY_ITEM_LIMIT:
+            try:
+                body = path.read_bytes()
+            except OSError:
+                body = None
+        if body is not None:
+            with self._lock:
+                old = self._memory.pop(meta['url'], None)
+                if old is not None:
+                    self._memory_size -= len(old[1])
+                self._memory[meta['url']] = (meta, body)
+                self._memory_size += len(body)
+                while self._memory_size > self.memory_bytes and self._memory:
+                    _, (_, evicted) = self._memory.popitem(last=False)
+                    self._memory_size -= len(evicted)
+        return PreviewEntry(meta, path, body, status)
+
+    def _evict_disk(self, keep=None):
+        """
+        Once over `max_bytes`, delete least recently used blobs (never `keep`,
+        the one being returned) down to EVICT_TARGET of it, then the metadata
+        of every URL whose blob is gone.
+        """
+        with self._lock:
+            if self._disk_size <= self.max_bytes:
+                return
+        target = self.max_bytes * EVICT_TARGET
+        blobs = []
+        for p in self.blob_dir.iterdir():
+            if p.suffix == '.part' or p == keep:
+                continue
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            blobs.append((st.st_mtime, st.st_size, p))
+        blobs.sort()
+        kept = keep.stat().st_size if keep is not None and keep.exists() else 0
+        total = kept + sum(size for _, size, _ in blobs)
+        for _, size, p in blobs:
+            if total <= target:
+                break
+            try:
+                p.unlink()
+            except OSError:
+                continue
+            total -= size
+            with self._lock:
+                self.counts['evicted'] += 1
+        with self._lock:
+            self._disk_size = total
+        self._prune_meta()
+
+    def _prune_meta(self):
+        """Delete per-URL metadata whose blob no longer exists"""
+        for p in self.meta_dir.glob('*.json'):
+            try:
+                with open(p, 'r', encoding='utf-8') as f:
+                    digest = json.load(f).get('digest')
+            except (OSError, ValueError):
+                digest = None
+            if digest is None or not self._blob_path(digest).exists():
+                try:
+                    p.unlink()
+                except OSError:
+                    pass
+
+    def _session(self):
+        if self.session_factory is not None:
+            return self.session_factory()
+        import requests
+        return requests.Session()
+
+    def _blob_path(self, digest):
+        return self.blob_dir / digest
+
+    def _meta_path(self, url):
+        return self.meta_dir / (hashlib.sha256(url.encode('utf-8')).hexdigest() + '.json')
+
+    def _load_meta(self, url):
+        try:
+            with open(self._meta_path(url), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('url') != url or not self._blob_path(meta['digest']).exists():
+            return None
+        return meta
+
+    def _save_meta(self, url, meta):
+        path = self._meta_path(url)
+        tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, path)
+
+    def stats(self):
+        with self._lock:
+            hits = self.counts['memory_hits'] + self.counts['disk_hits'] + self.counts['revalidated']
+            lookups = hits + self.counts['misses']
+            return {
+                'cache_dir': str(self.cache_dir),
+                'disk_bytes': self._disk_size,
+                'max_bytes': self.max_bytes,
+                'memory_bytes': self._memory_size,
+                'memory_entries': len(self._memory),
+                'hit_ratio': round(hits / lookups, 3) if lookups else None,
+                **self.counts,
+            }
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+EnMAP Request Profiling
+Opt-in diagnostics for slow queries. Every traced request collects its stage
+timings (the same stages as enmap_stage_seconds) and item counts; requests
+slower than the threshold are kept in a rolling slow-query log. An admin can
+also ask for a cProfile of one request, which is stored as a .prof file.
+Work handed to executor threads through `in_context` carries the trace and
+is profiled as well, merged into the request's profile. cProfile is
+imported on first use.
+"""
+
+import contextvars
+import hmac
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+from metrics import trace_stages, untrace_stages
+
+
+# Configuration
+SLOW_QUERY_SECONDS = float(os.environ.get('ENMAP_SLOW_QUERY_MS', 2000)) / 1000
+SLOW_LOG_SIZE = 100              # Slow-query captures kept per process
+PROFILE_DIR = Path(os.environ.get('ENMAP_PROFILE_DIR', Path(tempfile.gettempdir()) / 'enmap_profiles'))
+PROFILE_KEEP = 20                # Stored profiles kept on disk
+PROFILE_TOP = 15                 # Functions listed per profile summary
+PARAM_LIST_MAX = 8               # Longer lists in captured parameters are replaced by their length
+ADMIN_TOKEN = os.environ.get('ENMAP_ADMIN_TOKEN')   # Profiling and /api/debug/* are off when unset
+PROCESS_WIDE = sys.version_info >= (3, 12)          # cProfile sees every thread (sys.monitoring) from 3.12
+
+_trace = contextvars.ContextVar('enmap_request_trace', default=None)
+_profile = contextvars.ContextVar('enmap_request_profile', default=None)
+
+
+class RequestTrace:
+    """Stage timings and counts of one request, safe to add to from worker threads"""
+
+    def __init__(self, endpoint, params=None):
+        self.endpoint = endpoint
+        self.params = params or {}
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+        self.stages = {}             # stage -> [seconds, calls]
+        self.counts = {}
+        self.profile_id = None
+
+    def add(self, stage, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(stage, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def note(self, **counts):
+        with self._lock:
+            self.counts.update(counts)
+
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def to_dict(self, seconds=None, status=None):
+        with self._lock:
+            stages = {stage: {'ms': round(total * 1000, 1), 'calls': calls}
+                      for stage, (total, calls) in sorted(self.stages.items(), key=lambda kv: -kv[1][0])}
+            counts = dict(self.counts)
+        return {
+            'endpoint': self.endpoint,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.started)),
+            'ms': round((self.elapsed() if seconds is None else seconds) * 1000, 1),
+            'status': status,
+            'params': self.params,
+            'stages': stages,
+            'counts': counts,
+            'profile_id': self.profile_id,
+        }
+
+
+def start_trace(trace):
+    """Make `trace` the current request's trace; returns a token for end_trace"""
+    return _trace.set(trace), trace_stages(trace)
+
+
+def end_trace(tokens):
+    trace_token, stage_token = tokens
+    untrace_stages(stage_token)
+    _trace.reset(trace_token)
+
+
+def note(**counts):
+    """Record counts (items, aois, ...) on the current request's trace, if any"""
+    trace = _trace.get()
+    if trace is not None:
+        trace.note(**counts)
+
+
+class RequestProfile:
+    """
+    cProfile of one request: the thread that started it plus every task run
+    through `in_context` while it is active, each with its own profiler
+    (cProfile profiles one thread) merged into one stats object at the end.
+
+    From Python 3.12 a profiler records every thread in the process and only
+    one can run at a time, so tasks need no profiler of their own, but the
+    profile also holds whatever other requests ran meanwhile (`scope` is
+    'process'). Tasks whose profiler could not start are counted in
+    `unprofiled`.
+    """
+
+    def __init__(self, profile_id=None):
+        import cProfile
+
+        self.id = profile_id or uuid.uuid4().hex[:12]
+        self._profiler_class = cProfile.Profile
+        self._lock = threading.Lock()
+        self._tasks = []
+        self._closed = False
+        self.scope = 'process' if PROCESS_WIDE else 'request'
+        self.task_count = 0
+        self.unprofiled = 0
+        self.profiler = cProfile.Profile()
+        self._token = None
+
+    def start(self):
+        self._token = _profile.set(self)
+        self.profiler.enable()
+
+    def stop(self):
+        """Stop profiling; returns pstats.Stats over the request thread and its finished tasks"""
+        import pstats
+
+        self.profiler.disable()
+        _profile.reset(self._token)
+        with self._lock:
+            self._closed = True
+            tasks = list(self._tasks)
+        stats = pstats.Stats(self.profiler)
+        for profiler in tasks:
+            stats.add(profiler)
+        return stats
+
+    def run_task(self, fn, args, kwargs):
+        if PROCESS_WIDE:
+            # The request's profiler already records this thread
+            with self._lock:
+                if not self._closed:
+                    self.task_count += 1
+            return fn(*args, **kwargs)
+        profiler = self._profiler_class()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is active on this thread
+            with self._lock:
+                if not self._closed:
+                    self.unprofiled += 1
+            return fn(*args, **kwargs)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            profiler.disable()
+            with self._lock:
+                if not self._closed:
+                    self._tasks.append(profiler)
+                    self.task_count += 1
+
+
+def in_context(fn):
+    """
+    `fn` bound to a copy of the current context, for executor threads: the
+    request trace sees its stages, and it is profiled if the request is
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.run(_run_task, fn, args, kwargs)
+    return run
+
+
+def _run_task(fn, args, kwargs):
+    profile = _profile.get()
+    if profile is None:
+        return fn(*args, **kwargs)
+    return profile.run_task(fn, args, kwargs)
+
+
+def summarize_params(params):
+    """Request parameters with long lists (bounds sets, CSV text) reduced to their size"""
+    summary = {}
+    for key, value in (params or {}).items():
+        if isinstance(value, (list, tuple)) and len(value) > PARAM_LIST_MAX:
+            summary[key] = f"<{len(value)} entries>"
+        elif isinstance(value, str) and len(value) > 200:
+            summary[key] = f"<{len(value)} chars>"
+        else:
+            summary[key] = value
+    return summary
+
+
+def admin_allowed(token):
+    """True when an admin token is configured and `token` matches it"""
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+class SlowQueryLog:
+    """Rolling log of traced requests that took longer than `threshold` seconds"""
+
+    def __init__(self, threshold=SLOW_QUERY_SECONDS, size=SLOW_LOG_SIZE):
+        self.threshold = threshold
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.counts = {'traced': 0, 'captured': 0}
+
+    def record(self, trace, status=None):
+        """Keep `trace` if it was slow (or profiled); returns its capture or None"""
+        seconds = trace.elapsed()
+        with self._lock:
+            self.counts['traced'] += 1
+            if seconds < self.threshold and trace.profile_id is None:
+                return None
+            self.counts['captured'] += 1
+        entry = trace.to_dict(seconds, status)
+        with self._lock:
+            self._entries.append(entry)
+        return entry
+
+    def entries(self, limit=None):
+        """Captures, newest first"""
+        with self._lock:
+            entries = list(reversed(self._entries))
+        return entries[:limit] if limit else entries
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'threshold_ms': round(self.threshold * 1000), 'size': len(self._entries), **self.counts}
+
+
+class ProfileStore:
+    """
+    cProfile runs of single requests (worker tasks included), written to
+    `directory` as <id>.prof. One request is profiled at a time; the oldest
+    files beyond `keep` are removed.
+    """
+
+    def __init__(self, directory=PROFILE_DIR, keep=PROFILE_KEEP):
+        self.directory = Path(directory)
+        self.keep = keep
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+        self._ids = deque()
+        self.summaries = {}
+
+    def start(self):
+        """Begin profiling this request; returns a RequestProfile, or None while another profile runs"""
+        if not self._busy.acquire(blocking=False):
+            return None
+        try:
+            profile = RequestProfile()
+            profile.start()
+        except Exception:
+            self._busy.release()
+            raise
+        return profile
+
+    def finish(self, profile):
+        """Stop `profile`, store it and return its top functions"""
+        try:
+            stats = profile.stop()
+        finally:
+            self._busy.release()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stats.dump_stats(str(self.path(profile.id)))
+        summary = {'scope': profile.scope, 'tasks': profile.task_count, 'unprofiled_tasks': profile.unprofiled,
+                   'top': top_functions(stats)}
+        with self._lock:
+            self._ids.append(profile.id)
+            self.summaries[profile.id] = summary
+            while len(self._ids) > self.keep:
+                old = self._ids.popleft()
+                self.summaries.pop(old, None)
+                self.path(old).unlink(missing_ok=True)
+        return summary
+
+    def path(self, profile_id):
+        return self.directory / f"{profile_id}.prof"
+
+    def get(self, profile_id):
+        """Path of a stored profile, or None"""
+        with self._lock:
+            if profile_id not in self.summaries:
+                return None
+        path = self.path(profile_id)
+        return path if path.exists() else None
+
+    def stats(self):
+        with self._lock:
+            return {'directory': str(self.directory), 'stored': len(self._ids), 'running': self._busy.locked()}
+
+
+def top_functions(stats, limit=PROFILE_TOP):
+    """The `limit` functions of a pstats.Stats with the most cumulative time: [{function, calls, tottime_ms, cumtime_ms}]"""
+    rows = []
+    for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items():
+        rows.append({
+            'function': f"{Path(filename).name}:{line}({name})",
+            'calls': calls,
+            'tottime_ms': round(tottime * 1000, 2),
+            'cumtime_ms': round(cumtime * 1000, 2),
+        })
+    rows.sort(key=lambda row: -row['cumtime_ms'])
+    return rows[:limit]
+
+
+@contextmanager
+def profiled(path):
+    """cProfile the block, and tasks it runs through `in_context`, and write the stats to `path`"""
+    profile = RequestProfile()
+    profile.start()
+    try:
+        yield profile
+    finally:
+        profile.stop().dump_stats(str(path))
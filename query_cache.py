@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+EnMAP Query Result Cache
+Caches formatted STAC search results keyed on a normalized query, with LRU/TTL
+eviction, an optional on-disk tier and local answers for contained sub-queries.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+
+
+# Configuration
+BBOX_PRECISION = 5               # Decimal places kept in cache keys (~1 m)
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_TTL = 3600               # Seconds
+
+HIT = 'hit'
+PARTIAL = 'partial'
+MISS = 'miss'
+
+
+def normalize_bbox(bbox, precision=BBOX_PRECISION):
+    """Round a [min_lon, min_lat, max_lon, max_lat] bbox for use in a cache key"""
+    return tuple(round(float(v), precision) for v in bbox)
+
+
+def _parse_instant(value, end_of_day=False):
+    value = value.strip()
+    if value in ('', '..'):
+        return None
+    if len(value) == 10:
+        # Date only: STAC treats an end date as the whole day
+        value += 'T23:59:59+00:00' if end_of_day else 'T00:00:00+00:00'
+    dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def normalize_datetime_range(datetime_range):
+    """
+    Parse a STAC datetime string into (start, end) epoch seconds.
+
+    Open ends ('..' or empty) become None; a single instant gives start == end.
+    """
+    if not datetime_range:
+        return None, None
+    if '/' in datetime_range:
+        start, end = datetime_range.split('/', 1)
+    else:
+        start = end = datetime_range
+    return _parse_instant(start), _parse_instant(end, end_of_day=True)
+
+
+def make_record(bbox, timestamp, result, geometry=None):
+    """
+    Bundle a formatted result with the footprint bbox and epoch time used for
+    sub-query filtering, and the footprint geometry used for AOI coverage
+    """
+    return {
+        'bbox': list(bbox) if bbox else None,
+        'timestamp': timestamp,
+        'geometry': geometry,
+        'result': result,
+    }
+
+
+def _contains_bbox(outer, inner):
+    return (outer[0] <= inner[0] and outer[1] <= inner[1] and
+            outer[2] >= inner[2] and outer[3] >= inner[3])
+
+
+def _intersects_bbox(a, b):
+    return a[0] <= b[2] and a[2] >= b[0] and a[1] <= b[3] and a[3] >= b[1]
+
+
+def _outer_rings(geometry):
+    """Outer rings of a GeoJSON Polygon/MultiPolygon as [(x, y)] lists (holes ignored)"""
+    if geometry.get('type') == 'Polygon':
+        polygons = [geometry.get('coordinates') or []]
+    elif geometry.get('type') == 'MultiPolygon':
+        polygons = geometry.get('coordinates') or []
+    else:
+        return []
+    return [[(float(p[0]), float(p[1])) for p in polygon[0]] for polygon in polygons if polygon and polygon[0]]
+
+
+def _clip_ring(ring, bbox):
+    """Sutherland-Hodgman: the part of `ring` inside `bbox` (boundary included); empty when disjoint"""
+    west, south, east, north = bbox
+    for axis, limit, side in ((0, west, 1), (0, east, -1), (1, south, 1), (1, north, -1)):
+        clipped = []
+        for k, end in enumerate(ring):
+            start = ring[k - 1]
+            d_start, d_end = (start[axis] - limit) * side, (end[axis] - limit) * side
+            if (d_start >= 0) != (d_end >= 0):
+                t = d_start / (d_start - d_end)
+                clipped.append((start[0] + t * (end[0] - start[0]), start[1] + t * (end[1] - start[1])))
+            if d_end >= 0:
+                clipped.append(end)
+        ring = clipped
+        if not ring:
+            break
+    return ring
+
+
+def _intersects_footprint(geometry, bbox):
+    """True if a footprint polygon touches `bbox`, as the STAC API's bbox search matches"""
+    return any(_clip_ring(ring, bbox) for ring in _outer_rings(geometry))
+
+
+def _contains_window(outer_start, outer_end, start, end):
+    if outer_start is not None and (start is None or start < outer_start):
+        return False
+    if outer_end is not None and (end is None or end > outer_end):
+        return False
+    return True
+
+
+def _in_window(timestamp, start, end):
+    if start is not None and timestamp < start:
+        return False
+    if end is not None and timestamp > end:
+        return False
+    return True
+
+
+class QueryCache:
+    """
+    Two-tier cache of formatted query results.
+
+    The memory tier is an LRU of at most `max_entries` entries; the optional
+    disk tier writes one JSON file per key under `cache_dir` so results
+    survive restarts. Entries older than `ttl` seconds are ignored in both.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl=DEFAULT_TTL, cache_dir=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counts = {HIT: 0, PARTIAL: 0, MISS: 0}
+
+    @staticmethod
+    def make_key(bbox, datetime_range, collection, max_items):
+        start, end = normalize_datetime_range(datetime_range)
+        return (normalize_bbox(bbox), start, end, collection, int(max_items))
+
+    def get(self, bbox, datetime_range, collection, max_items):
+        """
+        Look up a query.
+
+        Returns (records, status) where status is 'hit', 'partial' (filtered
+        from a cached superset query) or 'miss' with records None. Records are
+        those stored by `put`; the formatted result is record['result'].
+        """
+        key = self.make_key(bbox, datetime_range, collection, max_items)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry['created'] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                entry = self._load_from_disk(key, now)
+                if entry is not None:
+                    self._store_locked(key, entry)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.counts[HIT] += 1
+                return entry['records'], HIT
+
+            records = self._answer_from_superset(key, now)
+            if records is not None:
+                self.counts[PARTIAL] += 1
+                return records, PARTIAL
+
+            self.counts[MISS] += 1
+            return None, MISS
+
+    def put(self, bbox, datetime_range, collection, max_items, records):
+        """Store records produced by `make_record` for a query"""
+        key = self.make_key(bbox, datetime_range, collection, max_items)
+        entry = {
+            'created': time.time(),
+            'truncated': len(records) >= int(max_items),
+            'records': records,
+        }
+        with self._lock:
+            self._store_locked(key, entry)
+        self._save_to_disk(key, entry)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = sum(self.counts.values())
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'disk_tier': str(self.cache_dir) if self.cache_dir else None,
+                'hit_ratio': round((self.counts[HIT] + self.counts[PARTIAL]) / lookups, 3) if lookups else None,
+                **self.counts,
+            }
+
+    def _store_locked(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _answer_from_superset(self, key, now):
+        """
+        Filter a cached, non-truncated query whose bbox and time window contain
+        `key`. Records are matched on their footprint geometry, like a fresh
+        search; entries with a record lacking geometry are not reused.
+        """
+        bbox, start, end, collection, max_items = key
+        for other_key, entry in reversed(self._entries.items()):
+            other_bbox, other_start, other_end, other_collection, _ = other_key
+            if other_key == key or other_collection != collection or entry['truncated']:
+                continue
+            if now - entry['created'] > self.ttl:
+                continue
+            if not _contains_bbox(other_bbox, bbox):
+                continue
+            if not _contains_window(other_start, other_end, start, end):
+                continue
+
+            records = entry['records']
+            if any(r['bbox'] is None or not r.get('geometry') or r['timestamp'] is None for r in records):
+                # Cannot filter exactly without footprint and time
+                continue
+
+            # The API matches footprint polygons, not their bboxes (EnMAP strips are tilted)
+            matches = [
+                r for r in records
+                if _in_window(r['timestamp'], start, end) and _intersects_bbox(r['bbox'], bbox)
+                and _intersects_footprint(r['geometry'], bbox)
+            ]
+            self._entries.move_to_end(other_key)
+            return matches[:max_items]
+        return None
+
+    def _disk_path(self, key):
+        digest = hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+        return self.cache_dir / f"{digest}.json"
+
+    def _load_from_disk(self, key, now):
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if now - entry.get('created', 0) > self.ttl:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+            return None
+        return entry
+
+    def _save_to_disk(self, key, entry):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Warning: could not write query cache file {path}: {e}")
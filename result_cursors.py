@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+EnMAP Result Cursors
+Server-side snapshots of large query results so clients can page through
+them without re-running the STAC search. Each snapshot pulls upstream pages
+lazily and keeps the formatted results it has already seen.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+# Configuration
+DEFAULT_MAX_CURSORS = 128
+DEFAULT_TTL = 900                # Seconds since last access before a cursor expires
+DEFAULT_MAX_ITEMS = 10000        # Results kept per cursor
+
+
+class CursorExpired(KeyError):
+    """The cursor id is unknown or was evicted"""
+
+
+class _Snapshot:
+    __slots__ = ('id', 'results', 'source', 'exhausted', 'error', 'lock', 'last_access', 'meta', 'max_items')
+
+    def __init__(self, source, meta, max_items):
+        self.id = uuid.uuid4().hex
+        self.results = []
+        self.source = source
+        self.exhausted = False
+        self.error = None
+        self.lock = threading.Lock()
+        self.last_access = time.time()
+        self.meta = meta
+        self.max_items = max_items
+
+    def fill(self, count):
+        """Pull from the upstream iterator until `count` results are held"""
+        while not self.exhausted and len(self.results) < count:
+            try:
+                self.results.append(next(self.source))
+            except StopIteration:
+                self.close()
+            except Exception as e:
+                self.error = str(e)
+                self.close()
+            if len(self.results) >= self.max_items:
+                self.close()
+
+    def close(self):
+        self.exhausted = True
+        close = getattr(self.source, 'close', None)
+        if close is not None:
+            close()
+        self.source = iter(())
+
+
+class CursorStore:
+    """
+    LRU/TTL-bounded set of result snapshots.
+
+    `create` wraps an iterator of formatted results; `page` returns a slice of
+    it, fetching from upstream only as far as the requested page.
+    """
+
+    def __init__(self, max_cursors=DEFAULT_MAX_CURSORS, ttl=DEFAULT_TTL, max_items=DEFAULT_MAX_ITEMS):
+        self.max_cursors = max_cursors
+        self.ttl = ttl
+        self.max_items = max_items
+        self._cursors = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def create(self, results, meta=None):
+        """Register an iterator of results and return the new cursor id"""
+        snapshot = _Snapshot(iter(results), meta or {}, self.max_items)
+        with self._lock:
+            self._expire_locked()
+            self._cursors[snapshot.id] = snapshot
+            while len(self._cursors) > self.max_cursors:
+                _, old = self._cursors.popitem(last=False)
+                self._close_later(old)
+                self.evicted += 1
+        return snapshot.id
+
+    def page(self, cursor_id, page, page_size):
+        """
+        Return (items, info) for zero-based `page` of a cursor.
+
+        Raises CursorExpired if the cursor is unknown or has expired.
+        """
+        with self._lock:
+            self._expire_locked()
+            snapshot = self._cursors.get(cursor_id)
+            if snapshot is None:
+                raise CursorExpired(cursor_id)
+            self._cursors.move_to_end(cursor_id)
+            snapshot.last_access = time.time()
+
+        start = page * page_size
+        with snapshot.lock:
+            # Fetch one extra result so we know whether another page exists
+            snapshot.fill(start + page_size + 1)
+            items = snapshot.results[start:start + page_size]
+            has_more = len(snapshot.results) > start + page_size
+            info = {
+                'cursor': cursor_id,
+                'page': page,
+                'page_size': page_size,
+                'next_page': page + 1 if has_more else None,
+                'fetched': len(snapshot.results),
+                'complete': snapshot.exhausted and snapshot.error is None,
+                **snapshot.meta,
+            }
+            if snapshot.error:
+                info['upstream_error'] = snapshot.error
+        return items, info
+
+    def _expire_locked(self):
+        now = time.time()
+        expired = [cid for cid, snap in self._cursors.items() if now - snap.last_access > self.ttl]
+        for cid in expired:
+            self._close_later(self._cursors.pop(cid))
+            self.evicted += 1
+
+    @staticmethod
+    def _close_later(snapshot):
+        # Do not block the store lock on a snapshot that is mid-fetch
+        def close():
+            with snapshot.lock:
+                snapshot.close()
+                snapshot.results = []
+        threading.Thread(target=close, daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'cursors': len(self._cursors),
+                'max_cursors': self.max_cursors,
+                'ttl_seconds': self.ttl,
+                'held_results': sum(len(s.results) for s in self._cursors.values()),
+                'evicted': self.evicted,
+            }
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+EnMAP Scene Records
+Compact scene type and result formatting shared by server.py and
+enmap_query.py: one compiled parser for EnMAP L2A scene ids, DLR download and
+quicklook URL construction, and a precomputed asset-priority lookup.
+"""
+
+import math
+import re
+from collections import namedtuple
+from datetime import datetime, timezone
+
+
+DOWNLOAD_BASE = "https://download.geoservice.dlr.de/ENMAP/files/L2A"
+OSEO_BASE = "https://geoservice.dlr.de/eoc/oseo"
+
+# Format: ENMAP01-____L2A-DT{DT_NUM}_{DATE}T{TIME}Z_{VERSION}_V{PROD_VERSION}_{TIMESTAMP}Z
+# e.g.    ENMAP01-____L2A-DT0000173759_20260103T180302Z_003_V010505_20260104T045017Z
+SCENE_ID_PATTERN = re.compile(
+    r'^ENMAP\d{2}-_*L2A-'
+    r'(?P<dt>DT\d+)_'
+    r'(?P<year>\d{4})(?P<month>\d{2})(?P<day>\d{2})T(?P<time>\d{6})Z_'
+    r'(?P<version>\d+)_'
+    r'(?P<product_version>V\d+)_'
+    r'(?P<processed>\d{8}T\d{6})Z$'
+)
+
+# Asset names in order of preference; lower value wins
+DATA_ASSET_PRIORITY = {name: rank for rank, name in enumerate(
+    ['data', 'VNIR', 'SWIR', 'product', 'ql_VNIR_COG', 'ql_SWIR_COG'])}
+PREVIEW_ASSET_PRIORITY = {name: rank for rank, name in enumerate(
+    ['thumbnail', 'visual', 'preview', 'quicklook'])}
+
+SceneRecord = namedtuple('SceneRecord', [
+    'id', 'datetime', 'cloud_cover', 'data_url', 'preview_url', 'available_assets',
+    'bbox', 'timestamp', 'geometry',
+])
+SceneRecord.__doc__ = "Formatted scene; `bbox`, `timestamp` and `geometry` are kept for filtering, not returned by the API"
+
+
+def parse_scene_id(scene_id):
+    """Split an EnMAP L2A scene id into its parts, or return None if it does not match"""
+    match = SCENE_ID_PATTERN.match(scene_id)
+    return match.groupdict() if match else None
+
+
+def scene_urls(scene_id, collection="ENMAP_HSI_L2A"):
+    """Construct (data_url, preview_url) for a scene from its id"""
+    parts = SCENE_ID_PATTERN.match(scene_id)
+    if parts is None:
+        # Fallback if parsing fails
+        return (
+            f"{OSEO_BASE}/download?parentIdentifier={collection}&uid={scene_id}",
+            f"{OSEO_BASE}/quicklook?parentIdentifier={collection}&uid={scene_id}",
+        )
+    base = (f"{DOWNLOAD_BASE}/{parts['year']}/{parts['month']}/{parts['day']}/"
+            f"{parts['dt']}/{parts['version']}/{scene_id}")
+    return f"{base}-QL_VNIR_COG.zip", f"{base}-QL_VNIR_COG_thumbnail.jpg"
+
+
+def pick_asset(asset_hrefs, priority):
+    """Href of the highest-priority asset present in `asset_hrefs`, or None"""
+    best_rank, best_href = None, None
+    for name, href in asset_hrefs.items():
+        rank = priority.get(name)
+        if rank is not None and href and (best_rank is None or rank < best_rank):
+            best_rank, best_href = rank, href
+    return best_href
+
+
+def scene_from_fields(scene_id, datetime_str, cloud_cover, asset_hrefs, bbox=None, timestamp=None, geometry=None):
+    """Build a SceneRecord from plain scene metadata"""
+    data_url = pick_asset(asset_hrefs, DATA_ASSET_PRIORITY)
+    preview_url = pick_asset(asset_hrefs, PREVIEW_ASSET_PRIORITY)
+    if data_url is None or preview_url is None:
+        # Only parse the id when STAC assets do not provide both URLs
+        built_data_url, built_preview_url = scene_urls(scene_id)
+        data_url = data_url or built_data_url
+        preview_url = preview_url or built_preview_url
+    return SceneRecord(
+        id=scene_id,
+        datetime=datetime_str,
+        cloud_cover=cloud_cover,
+        data_url=data_url,
+        preview_url=preview_url,
+        available_assets=list(asset_hrefs),
+        bbox=list(bbox) if bbox else None,
+        timestamp=timestamp,
+        geometry=geometry,
+    )
+
+
+def format_datetime(epoch):
+    """Render epoch seconds the way `str(item.datetime)` does"""
+    if epoch is None or math.isnan(epoch):
+        return 'None'
+    return str(datetime.fromtimestamp(epoch, timezone.utc))
+
+
+def item_timestamp(item):
+    """Acquisition time of a pystac Item as epoch seconds, or None"""
+    dt = item.datetime
+    if dt is None:
+        start = item.properties.get('start_datetime')
+        if not start:
+            return None
+        dt = datetime.fromisoformat(start.replace('Z', '+00:00'))
+    return dt.timestamp()
+
+
+def item_updated(item):
+    """Publication time of a pystac Item ("updated", else "created", else acquisition) as epoch seconds"""
+    value = item.properties.get('updated') or item.properties.get('created')
+    if value:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    return item_timestamp(item)
+
+
+def scene_from_item(item):
+    """Build a SceneRecord from a pystac Item so the Item can be dropped"""
+    asset_hrefs = {name: getattr(asset, 'href', None) for name, asset in item.assets.items()}
+    return scene_from_fields(
+        item.id,
+        str(item.datetime),
+        item.properties.get('eo:cloud_cover', None),
+        asset_hrefs,
+        item.bbox,
+        item_timestamp(item),
+        item.geometry,
+    )
+
+
+def scene_to_result(scene):
+    """API/export dict for a SceneRecord"""
+    return {
+        'id': scene.id,
+        'datetime': scene.datetime,
+        'cloud_cover': scene.cloud_cover,
+        'data_url': scene.data_url,
+        'preview_url': scene.preview_url,
+        'available_assets': scene.available_assets,  # Debug info
+    }
@@ -4,68 +4,487 @@ EnMAP Bounds Viewer Server
 Serves the web UI and provides API endpoints for EnMAP queries.
 """
 
-from flask import Flask, render_template_string, request, jsonify, send_from_directory, Response
+from flask import Flask, render_template_string, request, jsonify, send_from_directory, send_file, Response, stream_with_context, g
 from flask_cors import CORS
+import argparse
+import io
+import itertools
 import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from pathlib import Path
-import requests
 
-try:
-    from pystac_client import Client
-except ImportError:
-    print("Warning: pystac-client not installed. Install with: pip install pystac-client")
-    Client = None
+from enmap_core import COLLECTION, MAX_WINDOWS, EnMAPQuery, search_index, scene_from_index_record, stac_available
+from stac_session import get_manager
+from query_cache import QueryCache, make_record
+from preview_cache import PreviewCache, PreviewFetchError, DEFAULT_CACHE_DIR
+from prefetch import PreviewPrefetcher
+from downloads import DownloadManager, DEFAULT_DOWNLOAD_DIR
+from static_assets import StaticAssets, REVALIDATE_CACHE
+from exporters import EXPORT_FORMATS, export_format, export_row, format_available, stream_export
+from scene_record import item_updated, scene_from_item, scene_to_result
+from result_cursors import CursorStore, CursorExpired
+from upstream_limits import UpstreamLimiter, UpstreamBusy
+from single_flight import SingleFlight
+from watch_state import changes_range, parse_since, to_iso
+from metrics import REGISTRY, QUERY_ITEMS, BYTE_BUCKETS, CONTENT_TYPE as METRICS_CONTENT_TYPE, timed, count_error
+from profiling import (ProfileStore, RequestTrace, SlowQueryLog, admin_allowed, end_trace, in_context, note,
+                       start_trace, summarize_params)
+
 
+# pystac-client itself is imported on the first STAC query
+PYSTAC_AVAILABLE = stac_available()
+if not PYSTAC_AVAILABLE:
+    print("Warning: pystac-client not installed. Install with: pip install pystac-client")
 
-app = Flask(__name__)
+app = Flask(__name__, static_folder=None)   # /static/ is served from static_assets
 CORS(app)
 
 # Configuration
-STAC_URL = "https://geoservice.dlr.de/eoc/ogc/stac/v1/"
-COLLECTION = "ENMAP_HSI_L2A"
+STAC_URL = os.environ.get('ENMAP_STAC_URL', "https://geoservice.dlr.de/eoc/ogc/stac/v1/")  # Override for fake_stac.py
+QUERY_CACHE_SIZE = 256                                   # Cached queries kept in memory
+QUERY_CACHE_TTL = 3600                                   # Seconds
+QUERY_CACHE_DIR = os.environ.get('ENMAP_QUERY_CACHE_DIR')  # Optional on-disk tier
 
+FOOTPRINT_INDEX_PATH = os.environ.get('ENMAP_FOOTPRINT_INDEX')  # Optional local scene index (.npz)
+BATCH_WORKERS = 8                # Concurrent upstream searches across all batch requests
+BATCH_MAX_AOIS = 5000
+PREVIEW_CACHE_DIR = os.environ.get('ENMAP_PREVIEW_CACHE_DIR', str(DEFAULT_CACHE_DIR))
+PREVIEW_CACHE_MAX_BYTES = 512 * 1024 * 1024
+PREFETCH_WORKERS = 4             # Background preview fetchers
+PREFETCH_MAX_PER_QUERY = 100     # Only the top-ranked previews of a result are prefetched
+CURSOR_MAX = 128                 # Open result cursors (LRU beyond this)
+CURSOR_TTL = 900                 # Seconds of inactivity before a cursor expires
+CURSOR_MAX_ITEMS = 10000         # Results a single cursor may hold
+MAX_PAGE_SIZE = 500
+TIME_WINDOWS = int(os.environ.get('ENMAP_TIME_WINDOWS', 1))  # Concurrent sub-windows per long STAC search
+STAC_MAX_INFLIGHT = 8            # Concurrent STAC requests (split across --serve workers)
+PREVIEW_MAX_INFLIGHT = 16        # Concurrent quicklook downloads (split across --serve workers)
+UPSTREAM_MAX_WAITING = 32        # Requests queued for an upstream slot before shedding with 503
+UPSTREAM_WAIT_TIMEOUT = 10       # Seconds a request waits for an upstream slot
+RETRY_AFTER = 5                  # Retry-After seconds on 503
+DOWNLOAD_DIR = os.environ.get('ENMAP_DOWNLOAD_DIR', str(DEFAULT_DOWNLOAD_DIR))
+DOWNLOAD_WORKERS = 4             # Scene files downloaded at once per server process
+OVERLAY_MAX_AOIS = 2000000       # AOIs one map overlay upload may hold
+OVERLAY_MAX = 16                 # Overlays kept per server process (LRU beyond this)
+STREAM_MIMETYPES = {'ndjson': 'application/x-ndjson', 'sse': 'text/event-stream'}
+TRACED_ENDPOINTS = {'query_enmap', 'query_enmap_batch', 'query_enmap_changes', 'query_enmap_export'}  # Slow-query log
 
-class EnMAPQuery:
-    """Query EnMAP data from DLR EOC STAC API"""
-    
-    def __init__(self):
-        if Client is None:
-            raise ImportError("pystac-client is not installed")
-        self.catalog = Client.open(STAC_URL)
+stac_limiter = UpstreamLimiter('STAC API', STAC_MAX_INFLIGHT, UPSTREAM_MAX_WAITING, UPSTREAM_WAIT_TIMEOUT, RETRY_AFTER)
+preview_limiter = UpstreamLimiter('preview', PREVIEW_MAX_INFLIGHT, UPSTREAM_MAX_WAITING, UPSTREAM_WAIT_TIMEOUT, RETRY_AFTER)
+query_cache = QueryCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL, QUERY_CACHE_DIR)
+search_flights = SingleFlight()
+footprint_index = None
+index_sync_lock = threading.Lock()  # One /api/index/sync (STAC pull + save) at a time
+overlay_store = None               # Created with the first overlay upload (numpy is loaded then)
+overlay_lock = threading.Lock()
+preview_cache = PreviewCache(
+    PREVIEW_CACHE_DIR,
+    max_bytes=PREVIEW_CACHE_MAX_BYTES,
+    session_factory=lambda: get_manager(STAC_URL).session,
+    limiter=preview_limiter
+)
+cursor_store = CursorStore(CURSOR_MAX, CURSOR_TTL, CURSOR_MAX_ITEMS)
+prefetcher = PreviewPrefetcher(preview_cache, workers=PREFETCH_WORKERS)
+download_manager = DownloadManager(
+    DOWNLOAD_DIR,
+    workers=DOWNLOAD_WORKERS,
+    session_factory=lambda: get_manager(STAC_URL).session
+)
+static_assets = StaticAssets()     # UI page and vendored libraries, read and compressed once
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='enmap-batch')
+slow_log = SlowQueryLog()
+profile_store = ProfileStore()
+
+REQUEST_SECONDS = REGISTRY.histogram('enmap_request_seconds', 'Time to first byte per endpoint', labels=('endpoint',))
+RESPONSE_BYTES = REGISTRY.histogram('enmap_response_bytes', 'Size of non-streamed responses', BYTE_BUCKETS, labels=('endpoint',))
+REGISTRY.gauge('enmap_cache_hit_ratio', 'Hit ratio of each cache since start', ('cache',), lambda: {
+    ('query',): query_cache.stats()['hit_ratio'],
+    ('preview',): preview_cache.stats()['hit_ratio'],
+    ('prefetch',): prefetcher.stats()['hit_ratio'],
+})
+REGISTRY.gauge('enmap_upstream_calls_saved', 'STAC searches answered by an identical in-flight search', (),
+               lambda: {(): search_flights.stats()['saved_upstream_calls']})
+
+
+def load_footprint_index():
+    """Load the local footprint index if one is configured"""
+    global footprint_index
+    if not FOOTPRINT_INDEX_PATH:
+        return None
+    try:
+        from footprint_index import FootprintIndex
+
+        if os.path.exists(FOOTPRINT_INDEX_PATH):
+            footprint_index = FootprintIndex.load(FOOTPRINT_INDEX_PATH)
+        else:
+            footprint_index = FootprintIndex(COLLECTION)
+    except Exception as e:
+        print(f"Warning: could not load footprint index {FOOTPRINT_INDEX_PATH}: {e}")
+        footprint_index = None
+    return footprint_index
+
+
+load_footprint_index()
+
+
+def scene_record(scene):
+    """Cache record for a SceneRecord: API result plus the footprint used for filtering and coverage"""
+    return make_record(scene.bbox, scene.timestamp, scene_to_result(scene), scene.geometry)
+
+
+def covered_results(records, bounds, min_coverage=0, footprints=False):
+    """
+    API results for `records` with the percentage of the AOI each footprint
+    covers as "coverage", dropping scenes below `min_coverage`. Scenes without
+    a known footprint keep "coverage": null and are never dropped. With
+    `footprints` the results also carry "bbox" and "geometry" (for exports).
+    """
+    from footprint_coverage import coverage_fractions, coverage_percent  # numpy is loaded on the first query
     
-    def query_bounds(self, bbox, datetime_range="2024-01-01/2026-01-05", max_items=100):
-        """Query EnMAP data for given bounds"""
-        try:
-            search = self.catalog.search(
-                collections=[COLLECTION],
-                bbox=bbox,
-                datetime=datetime_range,
-                max_items=max_items
-            )
-            
-            items = search.item_collection()
-            return list(items), None
-        except Exception as e:
-            return None, str(e)
+    if not records:
+        return []
+    with timed('coverage'):
+        fractions = coverage_fractions(bounds, [(r.get('geometry'), r['bbox']) for r in records])
+    results = []
+    for record, fraction in zip(records, fractions.tolist()):
+        coverage = coverage_percent(fraction)
+        if min_coverage and coverage is not None and coverage < min_coverage:
+            continue
+        result = {**record['result'], 'coverage': coverage}
+        if footprints:
+            result['bbox'], result['geometry'] = record['bbox'], record.get('geometry')
+        results.append(result)
+    return results
+
+
+def stac_query(windows=1):
+    """EnMAPQuery on the shared catalog, with upstream calls capped by stac_limiter"""
+    return EnMAPQuery(STAC_URL, limiter=stac_limiter, windows=windows)
+
+
+def static_response(asset, cache_control):
+    """Pre-encoded asset body for the client's Accept-Encoding, or 304 when its ETag matches"""
+    encoding = asset.encoding_for(request.headers.get('Accept-Encoding'))
+    headers = {'ETag': asset.etag(encoding), 'Cache-Control': cache_control, 'Vary': 'Accept-Encoding'}
+    if asset.matches(request.headers.get('If-None-Match')):
+        return Response(status=304, headers=headers)
+    if encoding != 'identity':
+        headers['Content-Encoding'] = encoding
+    return Response(asset.bodies[encoding], content_type=asset.content_type, headers=headers)
 
 
 @app.route('/')
 def index():
-    """Serve the main HTML file"""
+    """Serve the main HTML file (fingerprinted and precompressed at startup)"""
     try:
-        html_file = Path(__file__).parent / 'csv_bounds_viewer.html'
-        if not html_file.exists():
+        page = static_assets.page()
+        if page is None:
             return jsonify({'error': 'HTML file not found'}), 404
-        
-        with open(html_file, 'r', encoding='utf-8') as f:
-            html_content = f.read()
-        return html_content, 200, {'Content-Type': 'text/html; charset=utf-8'}
+        return static_response(page, REVALIDATE_CACHE)
     except Exception as e:
+        count_error(e)
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/static/<path:name>')
+def static_file(name):
+    """Vendored JS/CSS (fingerprinted, immutable) and Leaflet images"""
+    asset = static_assets.get(name)
+    if asset is None:
+        return jsonify({'error': 'Not found'}), 404
+    return static_response(asset, static_assets.cache_control(name))
+
+
+def index_available():
+    """True when a non-empty footprint index is loaded"""
+    return footprint_index is not None and len(footprint_index) > 0
+
+
+def search_scenes(bounds, datetime_range, max_items, source='auto', use_cache=True, min_coverage=0, windows=1):
+    """
+    Run one EnMAP search through the footprint index or the cached STAC path.
+
+    Returns (results, error, meta) where meta records the source and cache status.
+    `max_items` scenes are searched before the `min_coverage` filter. A STAC
+    search runs as up to `windows` concurrent time windows.
+    """
+    records, error, meta = search_records(bounds, datetime_range, max_items, source, use_cache, windows)
+    if error:
+        return None, error, meta
+    return covered_results(records, bounds, min_coverage), None, meta
+
+
+def search_records(bounds, datetime_range, max_items, source='auto', use_cache=True, windows=1):
+    """search_scenes without the coverage step: returns (cache records, error, meta)"""
+    if source != 'stac' and index_available():
+        records = search_index(footprint_index, bounds, datetime_range, max_items)
+        with timed('format'):
+            records = [scene_record(scene_from_index_record(r)) for r in records]
+        return records, None, {'source': 'index'}
+    
+    records, cache_status = None, 'bypass'
+    if use_cache:
+        records, cache_status = query_cache.get(bounds, datetime_range, COLLECTION, max_items)
+    
+    meta = {'source': 'stac', 'cache': cache_status}
+    if records is None:
+        # Identical searches already in flight share one upstream call
+        key = QueryCache.make_key(bounds, datetime_range, COLLECTION, max_items)
+        (records, error), shared = search_flights.do(key, search_stac, bounds, datetime_range, max_items, use_cache,
+                                                     windows)
+        if shared:
+            meta['coalesced'] = True
+        if error:
+            return None, error, meta
+    
+    return records, None, meta
+
+
+def search_stac(bounds, datetime_range, max_items, use_cache=True, windows=1):
+    """Query EnMAP and build cache records for the results; returns (records, error)"""
+    scenes, error = stac_query(windows).query_scenes(bounds, datetime_range, max_items)
+    if error:
+        return None, error
+    
+    with timed('format'):
+        records = [scene_record(scene) for scene in scenes]
+    if use_cache:
+        query_cache.put(bounds, datetime_range, COLLECTION, max_items, records)
+    return records, None
+
+
+def search_aoi(bounds, datetime_range, max_items, source='auto', use_cache=True, min_coverage=0):
+    """search_scenes for one batch AOI; a busy upstream becomes that AOI's error"""
+    try:
+        return search_scenes(bounds, datetime_range, max_items, source, use_cache, min_coverage)
+    except UpstreamBusy as e:
+        return None, str(e), {'source': 'stac'}
+
+
+def parse_min_coverage(data):
+    """The "min_coverage" percentage of a request (0 when absent); raises ValueError outside 0-100"""
+    min_coverage = float(data.get('min_coverage') or 0)
+    if not 0 <= min_coverage <= 100:
+        raise ValueError('min_coverage must be between 0 and 100')
+    return min_coverage
+
+
+def parse_windows(data):
+    """The "windows" count of a request (TIME_WINDOWS when absent); raises ValueError outside 1-MAX_WINDOWS"""
+    windows = int(data.get('windows') or TIME_WINDOWS)
+    if not 1 <= windows <= MAX_WINDOWS:
+        raise ValueError(f'windows must be between 1 and {MAX_WINDOWS}')
+    return windows
+
+
+def upstream_busy_response(error):
+    """503 response asking the client to retry later"""
+    count_error(error)
+    return jsonify({'error': str(error), 'retry_after': error.retry_after}), 503, {'Retry-After': str(error.retry_after)}
+
+
+def parse_batch_bounds(data):
+    """
+    Read AOIs from a batch request, either as CSV text ("csv") or as a list of
+    row objects ("bounds"), both using the bounds viewer CSV columns.
+    Returns (aois, errors) where errors describe rows that were skipped; at most
+    BATCH_MAX_AOIS + 1 AOIs are read. Raises ValueError for a CSV without the
+    bounds columns.
+    """
+    from bounds_reader import BoundsReader  # numpy is loaded on the first batch request
+    
+    reader = BoundsReader()
+    if data.get('csv'):
+        chunks = reader.csv_chunks(io.StringIO(data['csv'].strip()))
+    else:
+        chunks = reader.record_chunks(data.get('bounds') or [])
+    aois = list(itertools.islice(reader.aois(chunks), BATCH_MAX_AOIS + 1))
+    return aois, reader.errors
+
+
+def iter_covered(records, bounds, min_coverage=0):
+    """covered_results one record at a time, for lazily produced records"""
+    for record in records:
+        yield from covered_results([record], bounds, min_coverage)
+
+
+def open_cursor(bounds, datetime_range, max_items, source, page_size, min_coverage=0):
+    """Create a result cursor that pulls STAC pages (or index results) lazily"""
+    if source != 'stac' and index_available():
+        records = search_index(footprint_index, bounds, datetime_range, max_items)
+        results = covered_results([scene_record(scene_from_index_record(r)) for r in records], bounds, min_coverage)
+        return cursor_store.create(iter(results), {'source': 'index'})
+    items = stac_query().iter_items(bounds, datetime_range, max_items, limit=page_size)
+    results = iter_covered((scene_record(scene_from_item(item)) for item in items), bounds, min_coverage)
+    return cursor_store.create(results, {'source': 'stac'})
+
+
+def cursor_page_response(cursor_id, page, page_size, prefetch=False):
+    """JSON response for one page of a cursor"""
+    try:
+        items, info = cursor_store.page(cursor_id, page, page_size)
+    except CursorExpired:
+        return jsonify({'error': 'Cursor expired or unknown; re-run the query'}), 410
+    if prefetch:
+        info['prefetch_id'] = start_prefetch(items)
+    return jsonify({
+        'success': True,
+        'count': len(items),
+        **info,
+        'items': items
+    })
+
+
+def start_prefetch(results=()):
+    """Create a prefetch job for the preview URLs of `results` (best-ranked first)"""
+    job_id = prefetcher.new_job()
+    prefetcher.enqueue(job_id, [r.get('preview_url') for r in results][:PREFETCH_MAX_PER_QUERY])
+    return job_id
+
+
+def prefetch_item(job_id, result, rank):
+    """Queue one streamed result's preview for prefetch"""
+    if job_id and rank < PREFETCH_MAX_PER_QUERY:
+        prefetcher.enqueue(job_id, [result.get('preview_url')], start_rank=rank)
+
+
+def stream_format(data):
+    """Pick 'ndjson' or 'sse' from the "stream" field or the Accept header, or None"""
+    fmt = data.get('stream')
+    if fmt is True:
+        fmt = 'ndjson'
+    if not fmt:
+        accept = request.headers.get('Accept', '')
+        if 'text/event-stream' in accept:
+            fmt = 'sse'
+        elif 'application/x-ndjson' in accept:
+            fmt = 'ndjson'
+    return fmt if fmt in STREAM_MIMETYPES else None
+
+
+def encode_message(message, fmt):
+    """Serialize one stream message as an NDJSON line or an SSE event"""
+    payload = json.dumps(message)
+    if fmt == 'sse':
+        return f"event: {message['type']}\ndata: {payload}\n\n"
+    return payload + "\n"
+
+
+def streaming_response(messages, fmt, prefetch_id=None):
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    if prefetch_id:
+        headers['X-Prefetch-Id'] = prefetch_id
+    return Response(
+        stream_with_context(encode_message(m, fmt) for m in messages),
+        mimetype=STREAM_MIMETYPES[fmt],
+        headers=headers
+    )
+
+
+def stream_scenes(bounds, datetime_range, max_items, source='auto', use_cache=True, prefetch_id=None, min_coverage=0,
+                  windows=1):
+    """
+    Yield {"type": "item"} messages as scenes are parsed, then one "done"
+    (or "error") message. STAC pages are formatted as they arrive, so memory
+    does not grow with max_items; streamed STAC results are not cached.
+    """
+    count = 0
+    try:
+        if source != 'stac' and index_available():
+            meta = {'source': 'index'}
+            records = [scene_record(scene_from_index_record(r))
+                       for r in search_index(footprint_index, bounds, datetime_range, max_items)]
+            results = covered_results(records, bounds, min_coverage)
+        else:
+            cached, cache_status = None, 'bypass'
+            if use_cache:
+                cached, cache_status = query_cache.get(bounds, datetime_range, COLLECTION, max_items)
+            meta = {'source': 'stac', 'cache': cache_status}
+            if cached is not None:
+                results = covered_results(cached, bounds, min_coverage)
+            else:
+                items = stac_query(windows).iter_items(bounds, datetime_range, max_items)
+                results = iter_covered((scene_record(scene_from_item(item)) for item in items), bounds, min_coverage)
+        
+        for result in results:
+            prefetch_item(prefetch_id, result, count)
+            count += 1
+            yield {'type': 'item', 'item': result}
+        if prefetch_id:
+            meta['prefetch_id'] = prefetch_id
+        QUERY_ITEMS.observe(count, source=meta['source'])
+        note(items=count, source=meta['source'], cache=meta.get('cache'))
+        yield {'type': 'done', 'count': count, **meta}
+    except UpstreamBusy as e:
+        yield {'type': 'error', 'error': str(e), 'count': count, 'retry_after': e.retry_after}
+    except Exception as e:
+        yield {'type': 'error', 'error': str(e), 'count': count}
+
+
+def batch_aoi_entry(aoi, results, error, meta):
+    """Per-AOI summary for batch responses"""
+    entry = {'granule_id': aoi['granule_id'], 'bbox': aoi['bbox'], **meta}
+    if error:
+        entry['error'] = error
+        entry['scene_ids'] = []
+        entry['coverage'] = []
+    else:
+        entry['scene_ids'] = [r['id'] for r in results]
+        entry['coverage'] = [r['coverage'] for r in results]
+    return entry
+
+
+def merge_scene(scenes, result):
+    """
+    Add a batch result to `scenes` (id -> result) unless already present.
+    A scene found by several AOIs keeps its best coverage. Returns True if new.
+    """
+    existing = scenes.get(result['id'])
+    if existing is None:
+        scenes[result['id']] = result
+        return True
+    if (result['coverage'] or 0) > (existing['coverage'] or 0):
+        existing['coverage'] = result['coverage']
+    return False
+
+
+def stream_batch(aois, row_errors, datetime_range, max_items, source='auto', use_cache=True, prefetch_id=None,
+                 min_coverage=0):
+    """
+    Yield unique scenes and per-AOI summaries as each AOI search finishes.
+    Outstanding searches are cancelled if the client disconnects. An item's
+    coverage is for the first AOI that found it; "aoi" messages carry the
+    coverage of every scene for that AOI.
+    """
+    futures = {
+        batch_executor.submit(in_context(search_aoi), aoi['bbox'], datetime_range, max_items, source, use_cache,
+                              min_coverage): aoi
+        for aoi in aois
+    }
+    seen = set()
+    try:
+        for future in as_completed(futures):
+            aoi = futures[future]
+            results, error, meta = future.result()
+            for result in results or []:
+                if result['id'] not in seen:
+                    prefetch_item(prefetch_id, result, len(seen))
+                    seen.add(result['id'])
+                    yield {'type': 'item', 'item': result}
+            yield {'type': 'aoi', **batch_aoi_entry(aoi, results, error, meta)}
+        note(items=len(seen), aois=len(aois))
+        yield {'type': 'done', 'count': len(seen), 'aoi_count': len(aois), 'row_errors': row_errors,
+               'prefetch_id': prefetch_id}
+    except Exception as e:
+        yield {'type': 'error', 'error': str(e), 'count': len(seen)}
+    finally:
+        for future in futures:
+            future.cancel()
+
+
 @app.route('/api/query-enmap', methods=['POST'])
 def query_enmap():
     """
@@ -73,154 +492,693 @@ def query_enmap():
     Expected JSON: {
         "bounds": [min_lon, min_lat, max_lon, max_lat],
         "datetime": "start_date/end_date",
-        "max_items": 100
+        "max_items": 100,
+        "cache": true,       (optional, false bypasses the result cache)
+        "source": "auto",    (optional: "index", "stac" or "auto" = index when loaded)
+        "stream": "ndjson",  (optional: "ndjson" or "sse"; also chosen by Accept header)
+        "prefetch": false,   (optional: warm the preview cache with the results' quicklooks)
+        "page_size": 50,     (optional: return page 0 of a server-side cursor)
+        "min_coverage": 0,   (optional: drop scenes covering less than this % of the AOI)
+        "windows": 1         (optional: split the datetime range into this many concurrent searches)
     }
+    Every result carries "coverage", the % of the AOI its footprint covers.
+    Next pages: {"cursor": "<id>", "page": k, "page_size": 50}
     """
     try:
         data = request.get_json()
+        
+        if data.get('cursor'):
+            page = int(data.get('page', 0))
+            page_size = min(int(data.get('page_size', 50)), MAX_PAGE_SIZE)
+            if page < 0 or page_size < 1:
+                return jsonify({'error': 'Invalid page or page_size'}), 400
+            return cursor_page_response(data['cursor'], page, page_size, data.get('prefetch', False))
+        
         bounds = data.get('bounds')
         datetime_range = data.get('datetime', '2024-01-01/2026-01-05')
         max_items = data.get('max_items', 100)
+        source = data.get('source', 'auto')
         
         if not bounds or len(bounds) != 4:
             return jsonify({'error': 'Invalid bounds format'}), 400
+        try:
+            min_coverage = parse_min_coverage(data)
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': f'Invalid min_coverage: {e}'}), 400
+        try:
+            windows = parse_windows(data)
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': f'Invalid windows: {e}'}), 400
+        
+        if source == 'index' and not index_available():
+            return jsonify({'error': 'Footprint index not loaded'}), 400
         
-        if Client is None:
+        if not PYSTAC_AVAILABLE and not (source != 'stac' and index_available()):
             return jsonify({'error': 'pystac-client not installed'}), 500
         
-        # Query EnMAP
-        query = EnMAPQuery()
-        items, error = query.query_bounds(bounds, datetime_range, max_items)
+        if data.get('page_size'):
+            page_size = min(int(data['page_size']), MAX_PAGE_SIZE)
+            if page_size < 1:
+                return jsonify({'error': 'Invalid page_size'}), 400
+            cursor_max = min(int(data.get('max_items', CURSOR_MAX_ITEMS)), CURSOR_MAX_ITEMS)
+            cursor_id = open_cursor(bounds, datetime_range, cursor_max, source, page_size, min_coverage)
+            return cursor_page_response(cursor_id, 0, page_size, data.get('prefetch', False))
         
+        fmt = stream_format(data)
+        if fmt:
+            prefetch_id = prefetcher.new_job() if data.get('prefetch') else None
+            return streaming_response(
+                stream_scenes(bounds, datetime_range, max_items, source, data.get('cache', True), prefetch_id,
+                              min_coverage, windows),
+                fmt, prefetch_id
+            )
+        
+        results, error, meta = search_scenes(bounds, datetime_range, max_items, source, data.get('cache', True),
+                                             min_coverage, windows)
         if error:
             return jsonify({'error': error}), 500
         
-        # Format results
-        results = []
-        for item in items:
-            # Extract asset URLs safely
-            data_url = None
-            preview_url = None
-            
-            # Parse scene ID to construct direct download URLs
-            # Format: ENMAP01-____L2A-DT{DT_NUM}_{DATE}T{TIME}Z_{VERSION}_V{PROD_VERSION}_{TIMESTAMP}Z
-            scene_id = item.id
-            try:
-                # Extract date from scene ID (format: YYYYMMDD)
-                date_str = scene_id.split('_')[1]  # e.g., "20260103"
-                year = date_str[:4]
-                month = date_str[4:6]
-                day = date_str[6:8]
-                
-                # Extract DT number
-                dt_part = scene_id.split('-')[2]  # e.g., "DT0000173759"
-                
-                # Extract version number from scene ID
-                version_num = scene_id.split('_')[3]  # e.g., "003"
-                
-                # Extract product version
-                prod_version = scene_id.split('_')[4]  # e.g., "V010505"
-                
-                # Construct download URL (for VNIR data)
-                data_url = f"https://download.geoservice.dlr.de/ENMAP/files/L2A/{year}/{month}/{day}/{dt_part}/{version_num}/{scene_id}-QL_VNIR_COG.zip"
-                
-                # Construct preview URL (quicklook thumbnail)
-                preview_url = f"https://download.geoservice.dlr.de/ENMAP/files/L2A/{year}/{month}/{day}/{dt_part}/{version_num}/{scene_id}-QL_VNIR_COG_thumbnail.jpg"
-            except (IndexError, ValueError):
-                # Fallback if parsing fails
-                data_url = f"https://geoservice.dlr.de/eoc/oseo/download?parentIdentifier=ENMAP_HSI_L2A&uid={scene_id}"
-                preview_url = f"https://geoservice.dlr.de/eoc/oseo/quicklook?parentIdentifier=ENMAP_HSI_L2A&uid={scene_id}"
-            
-            # Also try to get assets from STAC metadata if available
-            data_candidates = ['data', 'VNIR', 'SWIR', 'product', 'ql_VNIR_COG', 'ql_SWIR_COG']
-            for asset_name in data_candidates:
-                if asset_name in item.assets:
-                    try:
-                        asset_url = item.assets[asset_name].href
-                        if asset_url:
-                            data_url = asset_url
-                            break
-                    except (AttributeError, KeyError):
-                        continue
-            
-            preview_candidates = ['thumbnail', 'visual', 'preview', 'quicklook']
-            for asset_name in preview_candidates:
-                if asset_name in item.assets:
-                    try:
-                        asset_url = item.assets[asset_name].href
-                        if asset_url:
-                            preview_url = asset_url
-                            break
-                    except (AttributeError, KeyError):
-                        continue
-            
-            # Compile all available assets for debugging
-            available_assets = list(item.assets.keys())
-            
-            result = {
-                'id': item.id,
-                'datetime': str(item.datetime),
-                'cloud_cover': item.properties.get('eo:cloud_cover', None),
-                'data_url': data_url,
-                'preview_url': preview_url,
-                'available_assets': available_assets,  # Debug info
-            }
-            results.append(result)
+        if data.get('prefetch'):
+            meta['prefetch_id'] = start_prefetch(results)
+        
+        QUERY_ITEMS.observe(len(results), source=meta['source'])
+        note(items=len(results), source=meta['source'], cache=meta.get('cache'), coalesced=meta.get('coalesced', False))
+        with timed('serialize'):
+            return jsonify({
+                'success': True,
+                'count': len(results),
+                **meta,
+                'items': results
+            })
+    
+    except UpstreamBusy as e:
+        return upstream_busy_response(e)
+    except Exception as e:
+        count_error(e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/query-enmap/batch', methods=['POST'])
+def query_enmap_batch():
+    """
+    Batch endpoint: query every AOI of a bounds set concurrently
+    Expected JSON: {
+        "csv": "granule_id,north_lat,south_lat,west_lon,east_lon\n...",
+            or "bounds": [{"granule_id": ..., "north_lat": ..., ...}, ...],
+        "datetime": "start_date/end_date",
+        "max_items": 100,    (per AOI)
+        "cache": true,
+        "source": "auto",
+        "stream": "ndjson",  (optional: stream scenes and AOI summaries as AOIs finish)
+        "prefetch": false,
+        "min_coverage": 0    (optional: per AOI, drop scenes covering less than this %)
+    }
+    Scenes shared by several AOIs are returned once in "items" with their best
+    coverage; "aois" maps each AOI to the ids and coverage of its scenes.
+    """
+    try:
+        data = request.get_json()
+        datetime_range = data.get('datetime', '2024-01-01/2026-01-05')
+        max_items = data.get('max_items', 100)
+        source = data.get('source', 'auto')
+        use_cache = data.get('cache', True)
+        
+        try:
+            min_coverage = parse_min_coverage(data)
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': f'Invalid min_coverage: {e}'}), 400
+        try:
+            aois, errors = parse_batch_bounds(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if not aois:
+            return jsonify({'error': 'No valid bounds found', 'row_errors': errors}), 400
+        if len(aois) > BATCH_MAX_AOIS:
+            return jsonify({'error': f'Too many AOIs (more than {BATCH_MAX_AOIS})'}), 400
+        
+        if source == 'index' and not index_available():
+            return jsonify({'error': 'Footprint index not loaded'}), 400
+        
+        if not PYSTAC_AVAILABLE and not (source != 'stac' and index_available()):
+            return jsonify({'error': 'pystac-client not installed'}), 500
+        
+        fmt = stream_format(data)
+        if fmt:
+            prefetch_id = prefetcher.new_job() if data.get('prefetch') else None
+            return streaming_response(
+                stream_batch(aois, errors, datetime_range, max_items, source, use_cache, prefetch_id, min_coverage),
+                fmt, prefetch_id
+            )
+        
+        futures = [
+            batch_executor.submit(in_context(search_aoi), aoi['bbox'], datetime_range, max_items, source, use_cache,
+                                  min_coverage)
+            for aoi in aois
+        ]
         
+        # Merge in AOI order so the result is deterministic
+        scenes = {}
+        aoi_results = []
+        for aoi, future in zip(aois, futures):
+            results, error, meta = future.result()
+            for result in results or []:
+                merge_scene(scenes, result)
+            aoi_results.append(batch_aoi_entry(aoi, results, error, meta))
+        
+        items = list(scenes.values())
+        note(items=len(items), aois=len(aois), failed_aois=sum(1 for entry in aoi_results if entry.get('error')))
         return jsonify({
             'success': True,
+            'count': len(scenes),
+            'aoi_count': len(aois),
+            'items': items,
+            'aois': aoi_results,
+            'row_errors': errors,
+            'prefetch_id': start_prefetch(items) if data.get('prefetch') else None
+        })
+    
+    except Exception as e:
+        count_error(e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/query-enmap/changes', methods=['GET'])
+def query_enmap_changes():
+    """
+    Scenes published or updated after `since`, for incremental clients
+    Query string: bounds=min_lon,min_lat,max_lon,max_lat&since=<ISO datetime or epoch>
+                  [&max_items=100&min_coverage=0]
+    Searches acquisitions from WATCH_OVERLAP before `since` (late processing)
+    and keeps scenes whose "updated" time (acquisition time when missing) is
+    after it. Pass the returned "next_since" as `since` on the next call; a
+    truncated scan keeps "next_since" at `since`, since unread scenes may lie
+    behind the newest one it saw.
+    """
+    try:
+        try:
+            bounds = [float(v) for v in request.args.get('bounds', '').split(',')]
+            if len(bounds) != 4:
+                raise ValueError('bounds needs 4 comma-separated numbers')
+            since = parse_since(request.args['since'])
+            max_items = int(request.args.get('max_items', 100))
+            min_coverage = parse_min_coverage(request.args)
+        except KeyError:
+            return jsonify({'error': 'Missing since'}), 400
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+        
+        if not PYSTAC_AVAILABLE:
+            return jsonify({'error': 'pystac-client not installed'}), 500
+        
+        # Change feeds always go upstream: cached or indexed results may predate `since`
+        window = changes_range(since)
+        newest, scanned, records, updated = since, 0, [], {}
+        for item in stac_query().iter_items(bounds, window, max_items):
+            scanned += 1
+            published = item_updated(item)
+            if published is not None:
+                newest = max(newest, published)
+            if published is None or published > since:
+                records.append(scene_record(scene_from_item(item)))
+                updated[item.id] = to_iso(published) if published is not None else None
+        
+        results = [{**result, 'updated': updated[result['id']]}
+                   for result in covered_results(records, bounds, min_coverage)]
+        note(items=len(results), scanned=scanned)
+        truncated = scanned >= max_items
+        return jsonify({
+            'success': True,
+            'since': to_iso(since),
+            'next_since': to_iso(since if truncated else newest),
+            'window': window,
+            'scanned': scanned,
+            'truncated': truncated,
             'count': len(results),
             'items': results
         })
     
+    except UpstreamBusy as e:
+        return upstream_busy_response(e)
     except Exception as e:
+        count_error(e)
         return jsonify({'error': str(e)}), 500
 
 
+def export_aoi(aoi, datetime_range, max_items, source='auto', use_cache=True, min_coverage=0):
+    """Export rows (with footprints) for one AOI; raises on search errors"""
+    records, error, _ = search_records(aoi['bbox'], datetime_range, max_items, source, use_cache)
+    if error:
+        raise RuntimeError(f"AOI {aoi['granule_id']}: {error}")
+    results = covered_results(records, aoi['bbox'], min_coverage, footprints=True)
+    return [export_row(result, aoi['granule_id']) for result in results]
+
+
+def export_rows(aois, datetime_range, max_items, source='auto', use_cache=True, min_coverage=0):
+    """
+    Yield export rows AOI by AOI as searches finish. A failed AOI raises, which
+    cuts the response off so a partial export is not mistaken for a full one.
+    """
+    futures = [
+        batch_executor.submit(in_context(export_aoi), aoi, datetime_range, max_items, source, use_cache, min_coverage)
+        for aoi in aois
+    ]
+    rows = 0
+    try:
+        for future in as_completed(futures):
+            aoi_rows = future.result()
+            rows += len(aoi_rows)
+            yield from aoi_rows
+        note(rows=rows)
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+@app.route('/api/query-enmap/export', methods=['POST'])
+def query_enmap_export():
+    """
+    Streaming export of a batch query as a file download
+    Expected JSON (or form fields): the batch request ("csv" or "bounds",
+    "datetime", "max_items", "cache", "source", "min_coverage") plus
+        "format": "json"     ("json", "ndjson", "csv" or "parquet" for GeoParquet)
+    One row per AOI and scene, with the AOI id, coverage and footprint.
+    """
+    try:
+        data = request.get_json(silent=True) or request.form.to_dict()
+        datetime_range = data.get('datetime', '2024-01-01/2026-01-05')
+        max_items = int(data.get('max_items', 100))
+        source = data.get('source', 'auto')
+        use_cache = data.get('cache', True) not in (False, 'false', '0')
+        
+        try:
+            fmt = export_format(fmt=data.get('format') or 'json')
+            min_coverage = parse_min_coverage(data)
+        except (TypeError, ValueError) as e:
+            return jsonify({'error': str(e)}), 400
+        if not format_available(fmt):
+            return jsonify({'error': 'pyarrow not installed (pip install pyarrow)'}), 500
+        try:
+            aois, errors = parse_batch_bounds(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if not aois:
+            return jsonify({'error': 'No valid bounds found', 'row_errors': errors}), 400
+        if len(aois) > BATCH_MAX_AOIS:
+            return jsonify({'error': f'Too many AOIs (more than {BATCH_MAX_AOIS})'}), 400
+        
+        if source == 'index' and not index_available():
+            return jsonify({'error': 'Footprint index not loaded'}), 400
+        
+        if not PYSTAC_AVAILABLE and not (source != 'stac' and index_available()):
+            return jsonify({'error': 'pystac-client not installed'}), 500
+        
+        note(aois=len(aois))
+        rows = export_rows(aois, datetime_range, max_items, source, use_cache, min_coverage)
+        filename = f"enmap_results_{datetime.now().strftime('%Y-%m-%d')}.{fmt}"
+        return Response(
+            stream_with_context(stream_export(rows, fmt)),
+            mimetype=EXPORT_FORMATS[fmt],
+            headers={'Content-Disposition': f'attachment; filename="{filename}"',
+                     'X-Accel-Buffering': 'no', 'X-Row-Errors': str(len(errors))}
+        )
+    
+    except Exception as e:
+        count_error(e)
+        return jsonify({'error': str(e)}), 500
+
+
+def get_overlay_store():
+    """The process-wide OverlayStore, created on first use"""
+    global overlay_store
+    with overlay_lock:
+        if overlay_store is None:
+            from aoi_overlay import OverlayStore
+            overlay_store = OverlayStore(OVERLAY_MAX)
+        return overlay_store
+
+
+def parse_viewport(args):
+    """(bbox, zoom) from ?bbox=west,south,east,north&zoom=z; raises ValueError"""
+    bbox = [float(v) for v in (args.get('bbox') or '').split(',') if v.strip()]
+    if len(bbox) != 4:
+        raise ValueError('bbox must be west,south,east,north')
+    if not all(v == v and abs(v) != float('inf') for v in bbox) or bbox[1] > bbox[3]:
+        raise ValueError(f'Invalid bbox: {args.get("bbox")}')
+    return bbox, int(args.get('zoom', 0))
+
+
+@app.route('/api/overlays', methods=['POST'])
+def create_overlay():
+    """
+    Index a bounds set for server-side map rendering
+    Expected JSON: {"csv": "granule_id,north_lat,..."} or {"bounds": [{...}, ...]}
+    Returns the overlay id, AOI count and overall bounds; fetch the visible
+    part with GET /api/overlays/<id>?bbox=west,south,east,north&zoom=z.
+    """
+    from bounds_reader import BoundsReader
+    import numpy as np
+    
+    try:
+        data = request.get_json(silent=True) or {}
+        reader = BoundsReader()
+        if data.get('csv'):
+            chunks = reader.csv_chunks(io.StringIO(data['csv'].strip()))
+        else:
+            chunks = reader.record_chunks(data.get('bounds') or [])
+        ids, bboxes = [], []
+        try:
+            for chunk in chunks:
+                ids.extend(chunk.ids)
+                bboxes.append(chunk.bboxes)
+                if len(ids) > OVERLAY_MAX_AOIS:
+                    return jsonify({'error': f'Too many AOIs (more than {OVERLAY_MAX_AOIS})'}), 400
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if not ids:
+            return jsonify({'error': 'No valid bounds found', 'row_errors': reader.errors}), 400
+        
+        with timed('overlay_index'):
+            overlay = get_overlay_store().create(ids, np.concatenate(bboxes))
+        return jsonify({
+            'success': True,
+            'overlay_id': overlay.id,
+            'count': len(overlay),
+            'bounds': overlay.bounds(),
+            'rows': reader.summary(),
+            'row_errors': reader.errors
+        }), 201
+    
+    except Exception as e:
+        count_error(e)
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/overlays/<overlay_id>', methods=['GET', 'DELETE'])
+def overlay_features(overlay_id):
+    """
+    GeoJSON for the visible part of an overlay (GET ?bbox=w,s,e,n&zoom=z):
+    the AOI rectangles in view, or quadtree cluster rectangles with a "count"
+    when too many are visible. DELETE drops the overlay.
+    """
+    if overlay_store is None:
+        return jsonify({'error': 'Unknown or expired overlay'}), 404
+    if request.method == 'DELETE':
+        if not overlay_store.delete(overlay_id):
+            return jsonify({'error': 'Unknown or expired overlay'}), 404
+        return jsonify({'success': True})
+    
+    from aoi_overlay import OverlayExpired
+    
+    try:
+        view, zoom = parse_viewport(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        overlay = overlay_store.get(overlay_id)
+    except OverlayExpired:
+        return jsonify({'error': 'Unknown or expired overlay'}), 404
+    with timed('overlay_viewport'):
+        collection = overlay.features(view, zoom)
+    collection['total'] = len(overlay)
+    return jsonify(collection)
+
+
+def preview_content_type(content_type):
+    """Fix incorrect MIME types from DLR server (e.g., application/octet-stream, .dat files)"""
+    if not content_type or 'octet-stream' in content_type or 'dat' in content_type.lower():
+        return 'image/jpeg'  # DLR quicklooks are JPEG format
+    return content_type
+
+
 @app.route('/api/preview', methods=['GET'])
 def preview_proxy():
     """
     Proxy endpoint for preview images
-    Fetches images from external URLs and serves them with CORS headers
+    Fetches images from external URLs (through the preview cache) and serves
+    them with CORS headers
     Query params: url (the image URL to fetch)
     """
+    import requests  # Loaded on the first preview request, not at server start
+    
     try:
         preview_url = request.args.get('url')
         if not preview_url:
             return jsonify({'error': 'No URL provided'}), 400
         
-        # Fetch the image from the external URL
-        response = requests.get(preview_url, timeout=10, verify=False)
-        
-        if response.status_code != 200:
-            return jsonify({'error': f'Failed to fetch preview: {response.status_code}'}), response.status_code
-        
-        # Determine correct Content-Type
-        content_type = response.headers.get('Content-Type', 'image/jpeg')
+        prefetcher.note_request(preview_url)
+        entry = preview_cache.get(preview_url)
+        content_type = preview_content_type(entry.content_type)
         
-        # Fix incorrect MIME types from DLR server (e.g., application/octet-stream, .dat files)
-        if 'octet-stream' in content_type or 'dat' in content_type.lower():
-            content_type = 'image/jpeg'  # DLR quicklooks are JPEG format
+        if entry.body is not None:
+            response = Response(entry.body, status=200, mimetype=content_type)
+            response.set_etag(entry.digest)
+            response.make_conditional(request)
+        else:
+            # Large or disk-only previews are streamed from the blob handle the cache opened
+            response = send_file(entry.file, mimetype=content_type, etag=entry.digest, conditional=True)
+            response.content_length = entry.size
         
-        # Return the image with proper CORS headers using Response
-        return Response(
-            response.content,
-            status=200,
-            headers={
-                'Content-Type': content_type,
-                'Access-Control-Allow-Origin': '*',
-                'Cache-Control': 'max-age=86400',
-                'Content-Length': len(response.content),
-                'Content-Disposition': 'inline'  # Force inline display, not download
-            }
-        )
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        response.headers['Cache-Control'] = 'max-age=86400'
+        response.headers['Content-Disposition'] = 'inline'  # Force inline display, not download
+        response.headers['X-Preview-Cache'] = entry.status
+        return response
     
-    except requests.Timeout:
+    except PreviewFetchError as e:
+        count_error(e)
+        return jsonify({'error': str(e)}), e.status_code
+    except UpstreamBusy as e:
+        return upstream_busy_response(e)
+    except (requests.Timeout, TimeoutError) as e:
+        count_error(e)
         return jsonify({'error': 'Request timeout'}), 504
     except Exception as e:
+        count_error(e)
         return jsonify({'error': f'Proxy error: {str(e)}'}), 500
 
 
+@app.route('/api/prefetch/<job_id>', methods=['GET', 'DELETE'])
+def prefetch_job(job_id):
+    """Check (GET) or cancel (DELETE) a background preview prefetch job"""
+    if request.method == 'DELETE' and not prefetcher.cancel(job_id):
+        return jsonify({'error': 'Unknown prefetch job'}), 404
+    job = prefetcher.job_status(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown prefetch job'}), 404
+    return jsonify(job)
+
+
+def download_files(data):
+    """Download entries from {"files": [{"url", "id", "sha256"}]} or result rows in {"scenes": [...]}"""
+    if 'files' in data:
+        return data['files']
+    return [{'id': scene.get('id'), 'url': scene.get('data_url'), 'sha256': scene.get('sha256')}
+            for scene in data.get('scenes') or [] if scene.get('data_url')]
+
+
+def stream_download(job_id):
+    """
+    Yield a "progress" message whenever the job changes, then one "done"
+    message with every file. Progress messages list only the active files.
+    """
+    version = -1
+    while True:
+        job, version = download_manager.wait(job_id, version)
+        if job is None:
+            yield {'type': 'error', 'error': 'Unknown download job'}
+            return
+        if job['finished'] is not None:
+            yield {'type': 'done', **job}
+            return
+        files = job.pop('files')
+        job['active'] = [f for f in files if f['state'] in ('downloading', 'retrying')]
+        yield {'type': 'progress', **job}
+
+
+@app.route('/api/downloads', methods=['POST'])
+def create_download():
+    """
+    Start a server-side bulk download
+    Expected JSON: {"scenes": [<query results>]} or
+                   {"files": [{"url": "...", "id": "...", "sha256": "<optional>"}]}
+    Returns 202 with the job; follow it with GET /api/downloads/<id>[/events]
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        job_id = download_manager.create(download_files(data))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'success': True, **download_manager.status(job_id)}), 202
+
+
+@app.route('/api/downloads/<job_id>', methods=['GET', 'DELETE'])
+def download_job(job_id):
+    """Poll (GET) or cancel (DELETE) a bulk download job"""
+    if request.method == 'DELETE' and not download_manager.cancel(job_id):
+        return jsonify({'error': 'Unknown download job'}), 404
+    job = download_manager.status(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown download job'}), 404
+    return jsonify(job)
+
+
+@app.route('/api/downloads/<job_id>/events', methods=['GET'])
+def download_events(job_id):
+    """Server-sent progress events for a bulk download job"""
+    if download_manager.status(job_id) is None:
+        return jsonify({'error': 'Unknown download job'}), 404
+    return streaming_response(stream_download(job_id), 'sse')
+
+
+@app.route('/api/index/sync', methods=['POST'])
+def sync_index():
+    """
+    Incrementally sync the local footprint index from the STAC API
+    Optional JSON: {"full": false}
+    """
+    if footprint_index is None:
+        return jsonify({'error': 'Footprint index not configured (set ENMAP_FOOTPRINT_INDEX)'}), 400
+    try:
+        data = request.get_json(silent=True) or {}
+        with index_sync_lock:
+            with stac_limiter.slot():
+                received = footprint_index.sync(get_manager(STAC_URL), full=data.get('full', False))
+            footprint_index.save(FOOTPRINT_INDEX_PATH)
+        return jsonify({
+            'success': True,
+            'received': received,
+            'index': footprint_index.stats()
+        })
+    except UpstreamBusy as e:
+        return upstream_busy_response(e)
+    except Exception as e:
+        count_error(e)
+        return jsonify({'error': str(e)}), 500
+
+
+def profile_requested():
+    """True for ?profile=1 or an "X-Enmap-Profile: 1" header"""
+    return request.args.get('profile') == '1' or request.headers.get('X-Enmap-Profile') == '1'
+
+
+def admin_denied():
+    """403 response unless the request carries the ENMAP_ADMIN_TOKEN in X-Admin-Token, else None"""
+    if admin_allowed(request.headers.get('X-Admin-Token')):
+        return None
+    return jsonify({'error': 'Admin token required (set ENMAP_ADMIN_TOKEN and send it as X-Admin-Token)'}), 403
+
+
+def request_params():
+    """Query parameters of the request for the slow-query log, long lists summarized"""
+    params = {key: value for key, value in request.args.items() if key != 'profile'}
+    if request.method == 'POST':
+        data = request.get_json(silent=True)
+        params.update(data if isinstance(data, dict) else request.form.to_dict())
+    return summarize_params(params)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+    profile = profile_requested()
+    if profile:
+        denied = admin_denied()
+        if denied is not None:
+            return denied
+    if request.endpoint in TRACED_ENDPOINTS or profile:
+        trace = RequestTrace(request.endpoint or 'unknown', request_params())
+        g.trace, g.trace_tokens = trace, start_trace(trace)
+        if profile:
+            g.profile = profile_store.start()
+            if g.profile is not None:
+                trace.profile_id = g.profile.id
+
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unknown'
+    start = g.get('request_start')
+    if start is not None:
+        REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+    if not response.is_streamed:
+        RESPONSE_BYTES.observe(response.calculate_content_length() or 0, endpoint=endpoint)
+    if 'trace' in g:
+        g.trace_status = response.status_code
+        if 'profile' in g:
+            response.headers['X-Profile-Id'] = g.profile.id if g.profile else 'busy'
+    return response
+
+
+@app.teardown_request
+def finish_request_trace(error=None):
+    """Runs after a streamed body is sent, so traces and profiles cover the whole response"""
+    trace = g.pop('trace', None)
+    if trace is None:
+        return
+    profile = g.pop('profile', None)
+    if profile:
+        profile_store.finish(profile)
+    end_trace(g.pop('trace_tokens'))
+    slow_log.record(trace, g.get('trace_status', 500 if error else None))
+
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """
+    Prometheus text-format metrics of this process only. Under --serve with
+    several workers each scrape reaches one arbitrary worker, so the series
+    jump between workers' counters: scrape a --workers 1 server. The worker's
+    pid is sent as X-Enmap-Worker.
+    """
+    response = Response(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+    response.headers['X-Enmap-Worker'] = str(os.getpid())
+    return response
+
+
+@app.route('/api/debug/slow', methods=['GET', 'DELETE'])
+def debug_slow_queries():
+    """
+    Slow-query log (admin): traced requests slower than ENMAP_SLOW_QUERY_MS,
+    and every profiled request, newest first, with parameters, per-stage
+    timings and item counts. ?limit=N caps the list; DELETE clears it.
+    """
+    denied = admin_denied()
+    if denied is not None:
+        return denied
+    if request.method == 'DELETE':
+        slow_log.clear()
+        return jsonify({'success': True})
+    try:
+        limit = int(request.args.get('limit', 0))
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+    return jsonify({**slow_log.stats(), 'entries': slow_log.entries(limit)})
+
+
+@app.route('/api/debug/profiles/<profile_id>', methods=['GET'])
+def debug_profile(profile_id):
+    """
+    A stored request profile (admin): the cProfile .prof file (open with
+    `python -m pstats` or snakeviz), or its top functions with ?format=json.
+    Batch, export and time-window tasks are profiled in their worker threads
+    and merged in ("tasks" counts them, "unprofiled_tasks" those whose
+    profiler could not start), so times of concurrent threads add up and the
+    request thread's own time includes waiting on them. On Python 3.12+
+    "scope" is "process": the profile covers every thread in the worker,
+    including other requests running at the same time.
+    """
+    denied = admin_denied()
+    if denied is not None:
+        return denied
+    path = profile_store.get(profile_id)
+    if path is None:
+        return jsonify({'error': 'Unknown or expired profile'}), 404
+    if request.args.get('format') == 'json':
+        return jsonify({'profile_id': profile_id, **profile_store.summaries.get(profile_id, {})})
+    return send_file(path, mimetype='application/octet-stream', as_attachment=True,
+                     download_name=f"enmap_{profile_id}.prof")
+
+
 @app.route('/api/status', methods=['GET'])
 def status():
     """Check server and API status"""
@@ -228,21 +1186,58 @@ def status():
         'status': 'ok',
         'stac_api': STAC_URL,
         'collection': COLLECTION,
-        'pystac_client_available': Client is not None
+        'pystac_client_available': PYSTAC_AVAILABLE,
+        'catalog': get_manager(STAC_URL).stats(),
+        'query_cache': query_cache.stats(),
+        'coalescing': search_flights.stats(),
+        'footprint_index': footprint_index.stats() if footprint_index is not None else None,
+        'preview_cache': preview_cache.stats(),
+        'prefetch': prefetcher.stats(),
+        'cursors': cursor_store.stats(),
+        'downloads': download_manager.stats(),
+        'overlays': overlay_store.stats() if overlay_store is not None else None,
+        'static': static_assets.stats(),
+        'profiling': {'slow_queries': slow_log.stats(), 'profiles': profile_store.stats()},
+        'upstream': {'stac': stac_limiter.stats(), 'preview': preview_limiter.stats()}
     })
 
 
+def shutdown_background():
+    """Stop background work once in-flight requests have drained"""
+    batch_executor.shutdown(wait=True, cancel_futures=True)
+    download_manager.shutdown()
+
+
+def configure_workers(workers):
+    """Split the upstream limits across server processes so the total stays fixed"""
+    stac_limiter.set_limit(max(1, STAC_MAX_INFLIGHT // workers))
+    preview_limiter.set_limit(max(1, PREVIEW_MAX_INFLIGHT // workers))
+    print(f"🚀 Production mode: {workers} worker(s), "
+          f"{stac_limiter.limit} STAC / {preview_limiter.limit} preview calls in flight per worker")
+    if workers > 1:
+        print("⚠️  /api/metrics reports one worker per scrape; use --workers 1 when scraping it")
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="EnMAP Bounds Viewer Server")
+    parser.add_argument('--serve', action='store_true',
+                        help='Production mode: multi-worker WSGI server (gunicorn) with graceful shutdown')
+    parser.add_argument('--workers', type=int, default=2, help='Worker processes in --serve mode (default: 2)')
+    parser.add_argument('--threads', type=int, default=8, help='Threads per worker in --serve mode (default: 8)')
+    parser.add_argument('--host', default='localhost', help='Bind address (default: localhost)')
+    parser.add_argument('--port', type=int, default=8080, help='Port (default: 8080)')
+    args = parser.parse_args()
+    
     print("=" * 60)
     print("🌍 EnMAP Bounds Viewer Server")
     print("=" * 60)
     print()
-    print("📍 Server: http://localhost:8080")
+    print(f"📍 Server: http://{args.host}:{args.port}")
     print("🔗 STAC API: " + STAC_URL)
     print("📦 Collection: " + COLLECTION)
     print()
     
-    if Client is None:
+    if not PYSTAC_AVAILABLE:
         print("⚠️  Warning: pystac-client not installed")
         print("   Install with: pip install pystac-client")
         print("   EnMAP queries will not be available")
@@ -254,4 +1249,10 @@ if __name__ == '__main__':
     print("=" * 60)
     print()
     
-    app.run(debug=True, host='localhost', port=8080)
+    if args.serve:
+        from serving import serve
+        serve(app, args.host, args.port, args.workers, args.threads,
+              on_start=configure_workers, on_shutdown=shutdown_background)
+    else:
+        static_assets.dev = True       # Pick up UI edits without a restart
+        app.run(debug=True, host=args.host, port=args.port)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+EnMAP Production Serving
+Runs the Flask app under gunicorn (multi-process, threaded workers) or, when
+gunicorn is not installed, under a threaded werkzeug server. Both stop
+accepting connections on SIGTERM/SIGINT and drain in-flight requests before
+exiting.
+"""
+
+import signal
+import sys
+import threading
+import time
+
+from werkzeug.wsgi import ClosingIterator
+
+
+# Configuration
+DEFAULT_WORKERS = 2
+DEFAULT_THREADS = 8
+DRAIN_TIMEOUT = 30               # Seconds to let in-flight requests finish on shutdown
+WORKER_TIMEOUT = 120             # Seconds before gunicorn restarts a silent worker
+
+
+class InFlightTracker:
+    """WSGI middleware counting requests whose response has not finished yet"""
+
+    def __init__(self, app):
+        self.app = app
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        with self._lock:
+            self.active += 1
+        try:
+            body = self.app(environ, start_response)
+        except BaseException:
+            self._done()
+            raise
+        # Streaming responses stay in flight until their iterator is closed
+        return ClosingIterator(body, self._done)
+
+    def _done(self):
+        with self._lock:
+            self.active -= 1
+
+    def wait_idle(self, timeout):
+        """Block until no requests are in flight or `timeout` elapses; True if idle"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._lock:
+                if self.active <= 0:
+                    return True
+            time.sleep(0.1)
+        return False
+
+
+def serve(app, host, port, workers=DEFAULT_WORKERS, threads=DEFAULT_THREADS,
+          drain_timeout=DRAIN_TIMEOUT, on_start=None, on_shutdown=None):
+    """
+    Serve `app` until SIGTERM/SIGINT, then drain and call `on_shutdown`.
+    `on_start(workers)` is called with the actual process count before serving.
+    """
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        print("Warning: gunicorn not installed, serving with one threaded process. "
+              "Install with: pip install gunicorn")
+        if on_start is not None:
+            on_start(1)
+        return _serve_werkzeug(app, host, port, drain_timeout, on_shutdown)
+
+    if on_start is not None:
+        on_start(workers)
+
+    class _Application(BaseApplication):
+        def load_config(self):
+            options = {
+                'bind': f'{host}:{port}',
+                'workers': workers,
+                'threads': threads,
+                'worker_class': 'gthread',
+                'graceful_timeout': drain_timeout,
+                'timeout': WORKER_TIMEOUT,
+                'accesslog': '-',
+            }
+            if on_shutdown is not None:
+                options['worker_exit'] = lambda server, worker: on_shutdown()
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    _Application().run()
+
+
+def _serve_werkzeug(app, host, port, drain_timeout, on_shutdown):
+    from werkzeug.serving import make_server
+
+    tracker = InFlightTracker(app)
+    server = make_server(host, port, tracker, threaded=True)
+
+    def stop(signum, frame):
+        print(f"\nShutting down, draining {tracker.active} in-flight request(s)...", file=sys.stderr)
+        # shutdown() blocks until serve_forever returns, so call it off the main thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    try:
+        server.serve_forever()
+    finally:
+        if not tracker.wait_idle(drain_timeout):
+            print(f"Drain timeout: {tracker.active} request(s) still running", file=sys.stderr)
+        server.server_close()
+        if on_shutdown is not None:
+            on_shutdown()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+EnMAP Single-Flight Calls
+Collapses concurrent identical calls into one: the first caller for a key runs
+the call, callers that arrive while it is in flight wait on the same future
+and receive its result or exception. Nothing is kept after the call finishes.
+"""
+
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """In-flight call registry keyed by any hashable key"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.counts = {'leaders': 0, 'coalesced': 0, 'failed': 0}
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Run `fn(*args, **kwargs)` once per in-flight `key`.
+
+        Returns (result, shared) where `shared` is True for callers that
+        waited on another caller's call. Exceptions propagate to every caller.
+        """
+        with self._lock:
+            future = self._flights.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._flights[key] = future
+                self.counts['leaders'] += 1
+            else:
+                self.counts['coalesced'] += 1
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            with self._lock:
+                self.counts['failed'] += 1
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            # Failures are not remembered; the next caller retries upstream
+            with self._lock:
+                self._flights.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'saved_upstream_calls': self.counts['coalesced'],
+                **self.counts,
+            }
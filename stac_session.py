@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Shared STAC Catalog Manager
+Keeps one pooled HTTP session and one opened STAC catalog per process so that
+searches do not pay the landing-page fetch and TLS handshake every time.
+Requests on the session get timeouts, retries, hedging and circuit breaking
+per operation (upstream_client.py). requests and pystac-client are imported
+on first use, not at import time.
+"""
+
+import threading
+import time
+
+from metrics import timed
+from upstream_client import UpstreamClient, operation
+
+
+# Configuration
+STAC_URL = "https://geoservice.dlr.de/eoc/ogc/stac/v1/"
+DEFAULT_POOL_SIZE = 10           # Keep-alive connections per host
+DEFAULT_CATALOG_TTL = 3600       # Seconds before the landing page is re-fetched
+
+
+class CatalogManager:
+    """
+    Process-wide owner of the STAC client and its HTTP session.
+
+    The catalog is opened lazily on first use, re-opened once its landing page
+    is older than `catalog_ttl`, and dropped after an upstream error so the
+    next caller re-opens it. All methods are safe to call from several threads.
+    """
+
+    def __init__(self, stac_url=STAC_URL, pool_size=DEFAULT_POOL_SIZE, catalog_ttl=DEFAULT_CATALOG_TTL, upstream=None):
+        self.stac_url = stac_url
+        self.pool_size = pool_size
+        self.catalog_ttl = catalog_ttl
+        self.upstream = upstream or UpstreamClient()
+        self._lock = threading.Lock()
+        self._session = None
+        self._catalog = None
+        self._opened_at = 0.0
+        self.open_count = 0
+        self.error_count = 0
+
+    @property
+    def session(self):
+        """Pooled keep-alive session shared by the catalog and other upstream calls"""
+        with self._lock:
+            return self._get_session_locked()
+
+    def _get_session_locked(self):
+        if self._session is None:
+            try:
+                from requests.adapters import HTTPAdapter
+            except ImportError:
+                raise ImportError("requests is not installed")
+            session = self.upstream.new_session()
+            adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._session = session
+        return self._session
+
+    def get_catalog(self):
+        """Return the shared catalog, opening it if missing or expired"""
+        try:
+            from pystac_client import Client
+            from pystac_client.stac_api_io import StacApiIO
+        except ImportError:
+            raise ImportError("pystac-client is not installed")
+
+        with self._lock:
+            age = time.monotonic() - self._opened_at
+            if self._catalog is None or age > self.catalog_ttl:
+                stac_io = StacApiIO()
+                stac_io.session = self._get_session_locked()
+                with timed('catalog_open'), operation('catalog'):
+                    self._catalog = Client.open(self.stac_url, stac_io=stac_io)
+                self._opened_at = time.monotonic()
+                self.open_count += 1
+            return self._catalog
+
+    def invalidate(self):
+        """Forget the cached catalog; the next caller re-opens it"""
+        with self._lock:
+            self._catalog = None
+            self.error_count += 1
+
+    def search(self, **kwargs):
+        """
+        Run `catalog.search(...)` on the shared catalog.
+
+        Pages are fetched lazily while iterating, so callers should call
+        `invalidate()` when consuming the search fails.
+        """
+        return self.get_catalog().search(**kwargs)
+
+    def supports_sort(self):
+        """True when the STAC API conforms to the sort extension (`sortby` may be sent)"""
+        from pystac_client.conformance import ConformanceClasses
+
+        return self.get_catalog().conforms_to(ConformanceClasses.SORT)
+
+    def close(self):
+        """Close the pooled session and drop the catalog"""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+            self._catalog = None
+
+    def stats(self):
+        """Small status snapshot for /api/status"""
+        with self._lock:
+            opened = self._catalog is not None
+            age = time.monotonic() - self._opened_at if opened else None
+        return {
+            'stac_url': self.stac_url,
+            'catalog_open': opened,
+            'catalog_age_seconds': round(age, 1) if age is not None else None,
+            'catalog_ttl_seconds': self.catalog_ttl,
+            'pool_size': self.pool_size,
+            'open_count': self.open_count,
+            'error_count': self.error_count,
+            'upstream': self.upstream.stats(),
+        }
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_manager(stac_url=STAC_URL, **kwargs):
+    """Return the process-wide CatalogManager for `stac_url`, creating it once"""
+    with _managers_lock:
+        manager = _managers.get(stac_url)
+        if manager is None:
+            manager = CatalogManager(stac_url, **kwargs)
+            _managers[stac_url] = manager
+        return manager
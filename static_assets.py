@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+EnMAP Static Assets
+Loads the web UI once at startup, fingerprints it and keeps gzip (and brotli,
+when installed) variants in memory, so each page load is a dictionary lookup
+answered with an ETag, or a 304 for a repeat visit. Leaflet and PapaParse can
+be vendored into vendor/ (`python static_assets.py vendor`); the page then
+loads them from /static/ under fingerprinted, immutable URLs instead of the
+CDN. In dev mode files are re-read when they change on disk.
+"""
+
+import argparse
+import gzip
+import hashlib
+import importlib.util
+import mimetypes
+import os
+import sys
+import threading
+import urllib.request
+from pathlib import Path
+
+
+# Configuration
+UI_FILE = Path(__file__).parent / 'csv_bounds_viewer.html'
+VENDOR_DIR = Path(os.environ.get('ENMAP_VENDOR_DIR', Path(__file__).parent / 'vendor'))
+LEAFLET_CDN = "https://cdnjs.cloudflare.com/ajax/libs/leaflet/1.9.4/"
+PAPAPARSE_CDN = "https://cdnjs.cloudflare.com/ajax/libs/PapaParse/5.4.1/"
+VENDOR_FILES = {                 # vendor/ path -> CDN URL the page uses
+    'leaflet.css': LEAFLET_CDN + 'leaflet.css',
+    'leaflet.min.js': LEAFLET_CDN + 'leaflet.min.js',
+    'papaparse.min.js': PAPAPARSE_CDN + 'papaparse.min.js',
+    # Referenced relative to leaflet.css, so they keep their names
+    'images/layers.png': LEAFLET_CDN + 'images/layers.png',
+    'images/layers-2x.png': LEAFLET_CDN + 'images/layers-2x.png',
+    'images/marker-icon.png': LEAFLET_CDN + 'images/marker-icon.png',
+    'images/marker-icon-2x.png': LEAFLET_CDN + 'images/marker-icon-2x.png',
+    'images/marker-shadow.png': LEAFLET_CDN + 'images/marker-shadow.png',
+}
+FINGERPRINTED = ('.css', '.js')  # Served under name.<hash>.ext with immutable caching
+COMPRESSIBLE = ('text/', 'application/javascript')
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE = 'no-cache'    # Cache, but check the ETag on every use
+ASSET_CACHE = 'public, max-age=86400'
+
+
+def brotli_available():
+    return importlib.util.find_spec('brotli') is not None
+
+
+class StaticAsset:
+    """One file in memory: its fingerprint and pre-encoded bodies by content coding"""
+
+    def __init__(self, path, body, content_type, mtime):
+        self.path = path
+        self.content_type = content_type
+        self.mtime = mtime
+        self.fingerprint = hashlib.sha256(body).hexdigest()[:16]
+        self.bodies = {'identity': body}
+        if content_type.startswith(COMPRESSIBLE):
+            self.bodies['gzip'] = gzip.compress(body, GZIP_LEVEL, mtime=0)
+            if brotli_available():
+                import brotli
+                self.bodies['br'] = brotli.compress(body, quality=BROTLI_QUALITY)
+
+    def etag(self, encoding):
+        return f'"{self.fingerprint}"' if encoding == 'identity' else f'"{self.fingerprint}-{encoding}"'
+
+    def matches(self, if_none_match):
+        """True if an If-None-Match header names any variant of this content"""
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag.strip('"').split('-')[0] == self.fingerprint:
+                return True
+        return False
+
+    def encoding_for(self, accept_encoding):
+        """Best pre-encoded variant the client accepts (brotli, then gzip, then identity)"""
+        accepted = {}
+        for part in (accept_encoding or '').split(','):
+            name, _, params = part.strip().partition(';')
+            quality = 1.0
+            if params.strip().startswith('q='):
+                try:
+                    quality = float(params.strip()[2:])
+                except ValueError:
+                    quality = 0.0
+            accepted[name.strip().lower()] = quality
+        for encoding in ('br', 'gzip'):
+            if encoding in self.bodies and accepted.get(encoding, accepted.get('*', 0)) > 0:
+                return encoding
+        return 'identity'
+
+
+def _load(path, content_type=None):
+    path = Path(path)
+    content_type = content_type or mimetypes.guess_type(path.name)[0] or 'application/octet-stream'
+    if content_type.startswith('text/') and 'charset' not in content_type:
+        content_type += '; charset=utf-8'
+    return StaticAsset(path, path.read_bytes(), content_type, path.stat().st_mtime)
+
+
+def _fingerprinted_name(name, asset):
+    stem, dot, ext = name.rpartition('.')
+    return f"{stem}.{asset.fingerprint}.{ext}" if dot else f"{name}.{asset.fingerprint}"
+
+
+class StaticAssets:
+    """
+    The UI page plus vendored files, keyed by URL path under /static/.
+
+    `page()` is the HTML with CDN URLs rewritten to the vendored copies that
+    exist. With `dev` set, a request re-checks file mtimes and reloads
+    whatever changed; otherwise files are read once.
+    """
+
+    def __init__(self, ui_file=UI_FILE, vendor_dir=VENDOR_DIR, dev=False):
+        self.ui_file = Path(ui_file)
+        self.vendor_dir = Path(vendor_dir)
+        self.dev = dev
+        self._lock = threading.Lock()
+        self._page = None
+        self._files = {}          # /static/ name -> StaticAsset
+        self._sources = {}        # vendor path -> (mtime, served name)
+        self.load()
+
+    def load(self):
+        """(Re)load vendored files and the page; the page is None if the UI file is missing"""
+        files, sources, urls = {}, {}, {}
+        for name, cdn_url in VENDOR_FILES.items():
+            path = self.vendor_dir / name
+            if not path.is_file():
+                continue
+            asset = _load(path)
+            served = _fingerprinted_name(name, asset) if name.endswith(FINGERPRINTED) else name
+            files[served] = asset
+            sources[name] = (asset.mtime, served)
+            urls[cdn_url] = f"/static/{served}"
+
+        page = None
+        if self.ui_file.is_file():
+            html = self.ui_file.read_text(encoding='utf-8')
+            for cdn_url, local_url in urls.items():
+                html = html.replace(cdn_url, local_url)
+            page = StaticAsset(self.ui_file, html.encode('utf-8'), 'text/html; charset=utf-8',
+                               self.ui_file.stat().st_mtime)
+        with self._lock:
+            self._page, self._files, self._sources = page, files, sources
+
+    def page(self):
+        self._check_reload()
+        return self._page
+
+    def get(self, name):
+        """Asset served at /static/<name>, or None"""
+        self._check_reload()
+        return self._files.get(name)
+
+    @staticmethod
+    def cache_control(name):
+        """Fingerprinted files never change under their URL; images are revalidated daily"""
+        return IMMUTABLE_CACHE if name.endswith(FINGERPRINTED) else ASSET_CACHE
+
+    def stats(self):
+        page = self._page
+        return {
+            'page': page.fingerprint if page else None,
+            'encodings': sorted(page.bodies) if page else [],
+            'vendored': sorted(self._files),
+            'dev': self.dev,
+        }
+
+    def _check_reload(self):
+        if not self.dev:
+            return
+        page = self._page
+        changed = (page is None) != self.ui_file.is_file() or (
+            page is not None and self.ui_file.stat().st_mtime != page.mtime)
+        if not changed:
+            for name in VENDOR_FILES:
+                path = self.vendor_dir / name
+                known = self._sources.get(name)
+                exists = path.is_file()
+                if exists != (known is not None) or (exists and path.stat().st_mtime != known[0]):
+                    changed = True
+                    break
+        if changed:
+            self.load()
+
+
+def vendor(vendor_dir=VENDOR_DIR):
+    """Download the pinned Leaflet and PapaParse files into `vendor_dir`"""
+    for name, url in VENDOR_FILES.items():
+        path = Path(vendor_dir) / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with urllib.request.urlopen(url, timeout=30) as response:
+            body = response.read()
+        tmp_path = path.with_name(path.name + '.tmp')
+        tmp_path.write_bytes(body)
+        os.replace(tmp_path, path)
+        print(f"✅ {name} ({len(body) / 1024:.0f} KB)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vendor the web UI's JavaScript/CSS libraries for local serving")
+    parser.add_argument('command', choices=['vendor', 'stats'])
+    parser.add_argument('--vendor-dir', default=str(VENDOR_DIR), help=f'Target directory (default: {VENDOR_DIR})')
+    args = parser.parse_args()
+
+    if args.command == 'vendor':
+        try:
+            vendor(args.vendor_dir)
+        except OSError as e:
+            print(f"❌ Download failed: {e}")
+            sys.exit(1)
+        print(f"📦 Vendored {len(VENDOR_FILES)} files into {args.vendor_dir}; restart the server to serve them")
+    else:
+        print(StaticAssets(vendor_dir=args.vendor_dir).stats())
+
+
+if __name__ == '__main__':
+    main()
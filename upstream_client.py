@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+"""
+EnMAP Upstream Client
+Resilience for calls to the DLR STAC API and quicklook host, shared by
+server.py and enmap_query.py through the pooled session in stac_session.py.
+A request made inside `operation(name)` gets that operation's timeout,
+jittered exponential retries (idempotent requests only), a hedged duplicate
+once it runs longer than the host's recent p95, and a per-host circuit
+breaker that fails fast while the host is down and lets one probe through
+to test recovery. Requests outside an operation (bulk downloads, which retry
+on their own) pass straight through. requests is imported on first use.
+"""
+
+import contextvars
+import math
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from metrics import REGISTRY, timed
+from upstream_limits import UpstreamBusy
+
+
+# Configuration
+RETRY_STATUS = {408, 425, 429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+CONNECT_TIMEOUT = 5              # Seconds to open a connection, for every operation
+BACKOFF_BASE = 0.25              # Seconds; retry n waits up to BACKOFF_BASE * 2^n (full jitter)
+BACKOFF_MAX = 4.0
+BREAKER_FAILURES = 5             # Consecutive failed attempts that open a host's breaker
+BREAKER_COOLDOWN = 30            # Seconds a breaker stays open before a probe is let through
+LATENCY_WINDOW = 200             # Recent latencies kept per host and operation
+HEDGE_MIN_SAMPLES = 20           # No hedging until the p95 rests on this many samples
+HEDGE_MIN_DELAY = 0.05           # Seconds; never hedge sooner than this
+HEDGE_BUDGET = 0.1               # At most this share of an operation's requests is hedged
+HEDGE_ENABLED = os.environ.get('ENMAP_HEDGE', '1') != '0'
+TIMEOUTS_ENV = os.environ.get('ENMAP_UPSTREAM_TIMEOUTS')   # e.g. "stac_search=20,preview=8"
+
+UPSTREAM_EVENTS = REGISTRY.counter(
+    'enmap_upstream_events_total', 'Upstream retries, hedges and breaker rejections',
+    labels=('operation', 'event'))
+
+_operation = contextvars.ContextVar('enmap_upstream_operation', default=None)
+
+
+class OperationPolicy:
+    """
+    How requests of one operation are sent. `timeout` is the read timeout in
+    seconds; `idempotent` marks non-GET requests as safe to repeat (a STAC
+    search POST is a read).
+    """
+
+    def __init__(self, timeout, retries=2, hedge=False, idempotent=False):
+        self.timeout = timeout
+        self.retries = retries
+        self.hedge = hedge
+        self.idempotent = idempotent
+
+    def to_dict(self):
+        return {'timeout': self.timeout, 'retries': self.retries, 'hedge': self.hedge}
+
+
+DEFAULT_POLICIES = {
+    'catalog': OperationPolicy(timeout=15, retries=2),
+    'stac_search': OperationPolicy(timeout=30, retries=2, hedge=True, idempotent=True),
+    'preview': OperationPolicy(timeout=10, retries=1, hedge=True),
+}
+
+
+class CircuitOpen(UpstreamBusy):
+    """A host's breaker is open; the request failed without being sent"""
+
+    def __init__(self, host, retry_after):
+        super().__init__(host, retry_after)
+        self.args = (f"Upstream {host} is failing, retry in {retry_after}s",)
+
+
+def parse_timeouts(text):
+    """{operation: seconds} from "op=seconds,..."; raises ValueError"""
+    timeouts = {}
+    for part in (text or '').split(','):
+        if not part.strip():
+            continue
+        name, sep, value = part.partition('=')
+        name = name.strip()
+        if not sep or name not in DEFAULT_POLICIES:
+            raise ValueError(f"Invalid timeout '{part.strip()}' (use op=seconds with op in "
+                             f"{', '.join(DEFAULT_POLICIES)})")
+        seconds = float(value)
+        if not seconds > 0:
+            raise ValueError(f"Timeout for {name} must be positive")
+        timeouts[name] = seconds
+    return timeouts
+
+
+@contextmanager
+def operation(name):
+    """Send the upstream requests made in this block under `name`'s policy"""
+    token = _operation.set(name)
+    try:
+        yield
+    finally:
+        _operation.reset(token)
+
+
+def busy_cause(error):
+    """The UpstreamBusy an exception was raised from (pystac-client wraps transport errors), or None"""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, UpstreamBusy):
+            return error
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return None
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_MAX):
+    """Full-jitter exponential backoff before retry number `attempt` (0-based)"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def _retry_after(response):
+    """Seconds from a numeric Retry-After header, capped at BACKOFF_MAX, or None"""
+    try:
+        return min(BACKOFF_MAX, max(0.0, float(response.headers.get('Retry-After'))))
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    """
+    Per-host breaker. Closed: requests flow and consecutive failures are
+    counted. Open (after `failures` in a row): requests fail fast with
+    CircuitOpen for `cooldown` seconds. Half-open: one probe is let through;
+    its success closes the breaker, its failure opens it again.
+    """
+
+    def __init__(self, host, failures=BREAKER_FAILURES, cooldown=BREAKER_COOLDOWN):
+        self.host = host
+        self.failures = failures
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self.state = 'closed'
+        self.consecutive = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.counts = {'opened': 0, 'rejected': 0, 'probes': 0}
+
+    def before(self):
+        """Admit a request or raise CircuitOpen"""
+        with self._lock:
+            if self.state == 'open':
+                remaining = self.cooldown - (time.monotonic() - self.opened_at)
+                if remaining > 0:
+                    self.counts['rejected'] += 1
+                    raise CircuitOpen(self.host, math.ceil(remaining))
+                self.state = 'half_open'
+                self.probing = False
+            if self.state == 'half_open':
+                if self.probing:
+                    self.counts['rejected'] += 1
+                    raise CircuitOpen(self.host, 1)
+                self.probing = True
+                self.counts['probes'] += 1
+
+    def release(self):
+        """End an admitted request that neither succeeded nor failed (dropped), freeing the probe slot"""
+        with self._lock:
+            self.probing = False
+
+    def success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.consecutive = 0
+            self.probing = False
+
+    def failure(self):
+        with self._lock:
+            self.consecutive += 1
+            self.probing = False
+            if self.state == 'half_open' or (self.state == 'closed' and self.consecutive >= self.failures):
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self.counts['opened'] += 1
+
+    def stats(self):
+        with self._lock:
+            return {'state': self.state, 'consecutive_failures': self.consecutive, **self.counts}
+
+
+class LatencyWindow:
+    """Recent successful latencies of one host and operation"""
+
+    def __init__(self, size=LATENCY_WINDOW):
+        self._values = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._values.append(seconds)
+
+    def p95(self, min_samples=HEDGE_MIN_SAMPLES):
+        with self._lock:
+            if len(self._values) < min_samples:
+                return None
+            ordered = sorted(self._values)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+
+class UpstreamClient:
+    """
+    Policies, breakers and latency windows behind one pooled session.
+
+    `send` wraps the session's own send for requests made inside
+    `operation(name)`; everything else is passed through unchanged.
+    """
+
+    def __init__(self, policies=None, hedge=HEDGE_ENABLED, breaker_failures=BREAKER_FAILURES,
+                 breaker_cooldown=BREAKER_COOLDOWN):
+        self.policies = {name: OperationPolicy(p.timeout, p.retries, p.hedge, p.idempotent)
+                         for name, p in (policies or DEFAULT_POLICIES).items()}
+        self.hedge = hedge
+        self.breaker_failures = breaker_failures
+        self.breaker_cooldown = breaker_cooldown
+        self._lock = threading.Lock()
+        self._breakers = {}
+        self._latencies = {}
+        self.counts = {}
+        if TIMEOUTS_ENV:
+            self.set_timeouts(parse_timeouts(TIMEOUTS_ENV))
+
+    def set_timeouts(self, timeouts):
+        """Override read timeouts per operation ({name: seconds})"""
+        for name, seconds in timeouts.items():
+            self.policies[name].timeout = seconds
+
+    def new_session(self):
+        """A requests.Session whose requests go through this client"""
+        return _session_class()(self)
+
+    def breaker(self, host):
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker(host, self.breaker_failures, self.breaker_cooldown)
+                self._breakers[host] = breaker
+            return breaker
+
+    def _latency(self, host, name):
+        with self._lock:
+            return self._latencies.setdefault((host, name), LatencyWindow())
+
+    def _count(self, name, event):
+        with self._lock:
+            counts = self.counts.setdefault(name, {'requests': 0, 'retries': 0, 'hedged': 0, 'hedge_wins': 0,
+                                                   'failures': 0, 'rejected': 0})
+            counts[event] += 1
+        if event != 'requests':
+            UPSTREAM_EVENTS.inc(operation=name, event=event)
+
+    def send(self, send, request, **kwargs):
+        """Send a PreparedRequest with `send` under the current operation's policy"""
+        name = _operation.get()
+        policy = self.policies.get(name) if name else None
+        if policy is None:
+            return send(request, **kwargs)
+        # Network time (with retries and hedges) apart from the caller's parsing, as stage "<operation>_http"
+        with timed(f'{name}_http'):
+            return self._send(name, policy, send, request, kwargs)
+
+    def _send(self, name, policy, send, request, kwargs):
+        from requests.exceptions import ConnectionError, RequestException, Timeout
+
+        kwargs['timeout'] = (CONNECT_TIMEOUT, policy.timeout)
+        host = urlsplit(request.url).netloc
+        breaker = self.breaker(host)
+        latency = self._latency(host, name)
+        repeatable = policy.idempotent or request.method in IDEMPOTENT_METHODS
+        attempts = 1 + (policy.retries if repeatable else 0)
+        self._count(name, 'requests')
+
+        for attempt in range(attempts):
+            try:
+                breaker.before()
+            except CircuitOpen:
+                self._count(name, 'rejected')
+                raise
+            # Every exit after before() must settle the breaker, or a half-open probe is never released
+            try:
+                hedge_delay = self._hedge_delay(name, policy, latency, breaker) if repeatable else None
+                if hedge_delay is None:
+                    response = self._timed_send(send, request, kwargs, latency)
+                else:
+                    response = self._hedged_send(send, request, kwargs, latency, hedge_delay, name)
+            except (ConnectionError, Timeout):
+                breaker.failure()
+                self._count(name, 'failures')
+                if attempt + 1 >= attempts:
+                    raise
+                self._count(name, 'retries')
+                time.sleep(backoff_delay(attempt))
+                continue
+            except RequestException:
+                # Broken bodies, bad headers, redirect loops: the host answered badly, not retried
+                breaker.failure()
+                self._count(name, 'failures')
+                raise
+            except BaseException:
+                breaker.release()
+                raise
+
+            if response.status_code not in RETRY_STATUS:
+                breaker.success()
+                return response
+            breaker.failure()
+            self._count(name, 'failures')
+            if attempt + 1 >= attempts:
+                return response
+            delay = _retry_after(response)
+            response.close()
+            self._count(name, 'retries')
+            time.sleep(backoff_delay(attempt) if delay is None else delay)
+
+    def _hedge_delay(self, name, policy, latency, breaker):
+        """Seconds before a duplicate is sent, or None when this request is not hedged"""
+        if not (self.hedge and policy.hedge) or breaker.state != 'closed':
+            return None
+        p95 = latency.p95()
+        if p95 is None:
+            return None
+        with self._lock:
+            counts = self.counts.get(name, {})
+            if counts.get('hedged', 0) >= HEDGE_BUDGET * counts.get('requests', 0):
+                return None
+        return max(HEDGE_MIN_DELAY, p95)
+
+    @staticmethod
+    def _timed_send(send, request, kwargs, latency):
+        start = time.monotonic()
+        response = send(request, **kwargs)
+        if response.status_code < 500:
+            latency.add(time.monotonic() - start)
+        return response
+
+    def _hedged_send(self, send, request, kwargs, latency, delay, name):
+        """
+        Send `request`, and a copy if no answer came within `delay`. The first
+        good response wins; the other one is closed when it arrives. When both
+        fail, the later outcome is returned or raised.
+        """
+        outcomes = queue.Queue()
+
+        def run(index, prepared):
+            try:
+                outcomes.put((index, self._timed_send(send, prepared, kwargs, latency), None))
+            except Exception as e:
+                outcomes.put((index, None, e))
+
+        threading.Thread(target=run, args=(0, request), name='enmap-upstream', daemon=True).start()
+        try:
+            index, response, error = outcomes.get(timeout=delay)
+        except queue.Empty:
+            self._count(name, 'hedged')
+            threading.Thread(target=run, args=(1, request.copy()), name='enmap-hedge', daemon=True).start()
+            index, response, error = outcomes.get()
+            if error is not None or response.status_code in RETRY_STATUS:
+                if response is not None:
+                    response.close()
+                index, response, error = outcomes.get()
+            else:
+                threading.Thread(target=_close_outcome, args=(outcomes,), daemon=True).start()
+            if index == 1 and error is None and response.status_code not in RETRY_STATUS:
+                self._count(name, 'hedge_wins')
+        if error is not None:
+            raise error
+        return response
+
+    def stats(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+            latencies = dict(self._latencies)
+            counts = {name: dict(c) for name, c in self.counts.items()}
+        p95s = {}
+        for (host, name), window in latencies.items():
+            p95 = window.p95(min_samples=1)
+            if p95 is not None:
+                p95s[f"{host} {name}"] = round(p95 * 1000, 1)
+        return {
+            'hedging': self.hedge,
+            'policies': {name: p.to_dict() for name, p in self.policies.items()},
+            'operations': counts,
+            'breakers': {host: b.stats() for host, b in breakers.items()},
+            'p95_ms': p95s,
+        }
+
+
+def _close_outcome(outcomes):
+    """Close the losing response of a hedged pair once it arrives"""
+    _, response, _ = outcomes.get()
+    if response is not None:
+        response.close()
+
+
+_session_cls = None
+
+
+def _session_class():
+    """requests.Session subclass routing send() through an UpstreamClient, defined on first use"""
+    global _session_cls
+    if _session_cls is None:
+        import requests
+
+        class ResilientSession(requests.Session):
+            def __init__(self, upstream):
+                super().__init__()
+                self.upstream = upstream
+
+            def send(self, request, **kwargs):
+                return self.upstream.send(super().send, request, **kwargs)
+
+        _session_cls = ResilientSession
+    return _session_cls
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+EnMAP Upstream Limits
+Caps the number of in-flight calls to an upstream service (the DLR STAC API,
+the quicklook server). Callers beyond the cap wait in a short, bounded queue;
+once the queue is full or the wait times out they get UpstreamBusy, which the
+server turns into 503 + Retry-After.
+"""
+
+import threading
+from contextlib import contextmanager
+
+
+# Configuration
+DEFAULT_MAX_WAITING = 32         # Callers allowed to queue for a slot
+DEFAULT_WAIT_TIMEOUT = 10        # Seconds a caller waits for a slot
+DEFAULT_RETRY_AFTER = 5          # Seconds suggested to shed clients
+
+
+class UpstreamBusy(Exception):
+    """No upstream slot became available"""
+
+    def __init__(self, name, retry_after=DEFAULT_RETRY_AFTER):
+        super().__init__(f"Upstream {name} is busy, retry in {retry_after}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class UpstreamLimiter:
+    """
+    Counting semaphore with a bounded wait queue.
+
+    `limit` can be changed at runtime (e.g. divided across server workers
+    before they fork); waiters are woken as slots free up.
+    """
+
+    def __init__(self, name, limit, max_waiting=DEFAULT_MAX_WAITING,
+                 wait_timeout=DEFAULT_WAIT_TIMEOUT, retry_after=DEFAULT_RETRY_AFTER):
+        self.name = name
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.retry_after = retry_after
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiting = 0
+        self.counts = {'acquired': 0, 'waited': 0, 'rejected_queue_full': 0,
+                       'rejected_timeout': 0, 'peak_in_flight': 0}
+
+    def acquire(self):
+        """Take a slot, waiting up to `wait_timeout`; raises UpstreamBusy"""
+        with self._cond:
+            if self._in_flight >= self.limit:
+                if self._waiting >= self.max_waiting:
+                    self.counts['rejected_queue_full'] += 1
+                    raise UpstreamBusy(self.name, self.retry_after)
+                self._waiting += 1
+                self.counts['waited'] += 1
+                try:
+                    acquired = self._cond.wait_for(lambda: self._in_flight < self.limit, self.wait_timeout)
+                finally:
+                    self._waiting -= 1
+                if not acquired:
+                    self.counts['rejected_timeout'] += 1
+                    raise UpstreamBusy(self.name, self.retry_after)
+            self._in_flight += 1
+            self.counts['acquired'] += 1
+            self.counts['peak_in_flight'] = max(self.counts['peak_in_flight'], self._in_flight)
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self):
+        """Hold one upstream slot for the duration of the block"""
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def set_limit(self, limit):
+        with self._cond:
+            self.limit = max(1, int(limit))
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'limit': self.limit,
+                'in_flight': self._in_flight,
+                'waiting': self._waiting,
+                'max_waiting': self.max_waiting,
+                **self.counts,
+            }
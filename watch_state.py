@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+EnMAP Watch State
+Small JSON store behind incremental ("watch") queries. For each AOI it keeps
+the newest acquisition time seen and the ids of scenes acquired within the
+overlap window before it. The next run searches only from that point on and
+reports scenes it has not seen, so a nightly run costs O(new scenes) instead
+of O(history).
+"""
+
+import json
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from query_cache import normalize_bbox, normalize_datetime_range
+
+
+# Configuration
+WATCH_OVERLAP = 7 * 86400        # Seconds re-read before the newest seen acquisition (late processing)
+STATE_VERSION = 1
+
+
+def to_iso(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def parse_since(value):
+    """Epoch seconds from an ISO date/datetime or a number; raises ValueError"""
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        since, _ = normalize_datetime_range(value.split('/', 1)[0])
+    except ValueError:
+        since = None
+    if since is None:
+        raise ValueError(f"Invalid since: {value!r} (use an ISO date/datetime or epoch seconds)")
+    return since
+
+
+def changes_range(since, overlap=WATCH_OVERLAP):
+    """Open STAC datetime range from `overlap` seconds before `since`"""
+    return f"{to_iso(since - overlap)}/.."
+
+
+class WatchState:
+    """
+    Per-AOI watermarks in one JSON file.
+
+    Entries are keyed on the AOI id plus its rounded bbox, so an AOI whose
+    bounds change starts over with a full history query.
+    """
+
+    def __init__(self, path, overlap=WATCH_OVERLAP):
+        self.path = Path(path)
+        self.overlap = overlap
+        self.aois = {}
+        if self.path.exists():
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == STATE_VERSION:
+                self.aois = data.get('aois', {})
+
+    @staticmethod
+    def aoi_key(name, bbox):
+        return f"{name}|{','.join(str(v) for v in normalize_bbox(bbox))}"
+
+    def delta_range(self, key, datetime_range):
+        """STAC datetime range for this AOI's next search: the full range on the first run"""
+        entry = self.aois.get(key)
+        if not entry or entry.get('newest') is None:
+            return datetime_range
+        return changes_range(entry['newest'], self.overlap)
+
+    def record(self, key, scenes, complete=True):
+        """
+        Store a run's (scene id, acquisition epoch) pairs for an AOI and return
+        the ids not seen before, in input order. Ids older than the overlap
+        window are dropped: later searches cannot return them again. A search
+        cut short by max_items (`complete=False`) does not move the watermark,
+        so the scenes it never read are searched again next run.
+        """
+        entry = self.aois.setdefault(key, {'newest': None, 'seen': {}})
+        seen = entry['seen']
+        new_ids = []
+        for scene_id, timestamp in scenes:
+            if scene_id not in seen:
+                new_ids.append(scene_id)
+            seen[scene_id] = timestamp
+            if complete and timestamp is not None and (entry['newest'] is None or timestamp > entry['newest']):
+                entry['newest'] = timestamp
+
+        if entry['newest'] is not None:
+            cutoff = entry['newest'] - self.overlap
+            entry['seen'] = {i: t for i, t in seen.items() if t is None or t >= cutoff}
+        entry['last_run'] = time.time()
+        return new_ids
+
+    def save(self):
+        """Write the state atomically (a crash never leaves a half-written file)"""
+        tmp_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': STATE_VERSION, 'aois': self.aois}, f)
+        os.replace(tmp_path, self.path)